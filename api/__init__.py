@@ -1,7 +1,10 @@
 import os
 import dotenv
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from api.dependencies.configuration import get_configuration
 from api.routers import (
     customer,
     merchant,
@@ -13,7 +16,20 @@ from api.routers import (
 )
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # rebuild the queues of the restaurants before serving the requests
+    configuration = app.dependency_overrides.get(
+        get_configuration, get_configuration
+    )()
+
+    with configuration.create_session() as session:
+        configuration.queue_engine.warm(session, configuration.catalog_cache)
+
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # load the environment variables
 dotenv.load_dotenv()
@@ -33,6 +49,7 @@ app.add_middleware(
     allow_methods=allow_methods_list,
     allow_headers=allow_headers_list,
     allow_credentials=True,
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(customer.router)
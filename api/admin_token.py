@@ -0,0 +1,62 @@
+"""
+Issues an administrator token for the `/admin` routes. There are no
+administrator accounts; the token is a JWT with an `admin_id` claim, signed
+with the `JWT_SECRET` of the environment (or `.env`). Run it from the
+repository root:
+
+    python -m api.admin_token --days 30
+"""
+
+from datetime import timedelta
+
+import argparse
+import datetime
+import dotenv
+import jwt
+import os
+
+
+def issue_admin_token(
+    jwt_secret: str, token_duration: timedelta, admin_id: int = 0
+) -> str:
+    """
+    Issues a token accepted by `get_admin_id`.
+
+    :param jwt_secret: The secret the tokens of the application are signed \
+        with.
+    :param token_duration: The duration of the token to be valid.
+    :param admin_id: The ID of the operator the token is issued to.
+    """
+
+    return jwt.encode(  # type: ignore
+        {
+            "admin_id": admin_id,
+            "exp": datetime.datetime.now(datetime.timezone.utc)
+            + token_duration,
+        },
+        jwt_secret,
+        algorithm="HS256",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--admin-id", type=int, default=0)
+    arguments = parser.parse_args()
+
+    dotenv.load_dotenv()
+    jwt_secret = os.getenv("JWT_SECRET")
+
+    if jwt_secret is None:
+        raise RuntimeError("JWT_SECRET environment variable is not set")
+
+    print(
+        issue_admin_token(
+            jwt_secret, timedelta(days=arguments.days), arguments.admin_id
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
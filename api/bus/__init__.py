@@ -0,0 +1,337 @@
+from abc import ABC, abstractmethod
+from itertools import count
+from queue import Empty, SimpleQueue
+from threading import Event as ThreadEvent, Thread
+from typing import Any, Callable, Iterator
+from uuid import uuid4
+
+from sqlalchemy import Engine
+
+import logging
+import select
+
+logger = logging.getLogger(__name__)
+
+
+MAX_PAYLOAD_SIZE = 8000
+"""The maximum size in bytes of a Postgres `NOTIFY` payload."""
+
+CHUNK_SIZE = MAX_PAYLOAD_SIZE - 100
+"""
+The maximum size in bytes of a chunk of a message, leaving room for its
+header within the `NOTIFY` payload.
+"""
+
+
+def split_chunks(message: str, size: int = CHUNK_SIZE) -> list[str]:
+    """
+    Splits the message into chunks of at most `size` bytes once encoded,
+    without splitting any character.
+    """
+
+    data = message.encode()
+    chunks: list[str] = []
+    start = 0
+
+    while True:
+        end = min(start + size, len(data))
+
+        # back off to the first byte of the character
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+
+        chunks.append(data[start:end].decode())
+        start = end
+
+        if start >= len(data):
+            return chunks
+
+
+class EventBus(ABC):
+    """
+    Carries the published messages to every worker process, including the
+    one that published them. The messages are opaque strings; `Event`
+    encodes the notifications and delivers them to its local listeners.
+
+    Every message is given a position as it's published. All the workers
+    receive the messages in the order of their positions, along with the
+    same positions, so they can refer to a message the same way.
+    """
+
+    @abstractmethod
+    def start(self, receive: Callable[[int, str], None]) -> int:
+        """
+        Subscribes to the messages; once it returns, every message published
+        by any worker is passed to `receive` along with its position,
+        possibly from another thread. Must be called once, before `publish`.
+
+        :return: The position of the last message published before; every \
+            message with a later position is received.
+        """
+
+    @property
+    @abstractmethod
+    def epoch(self) -> str:
+        """
+        Identifies the positions of the messages, the same for all the
+        workers of the bus.
+        """
+
+    @abstractmethod
+    def publish(self, message: str) -> None:
+        """
+        Publishes the message to every worker. Never blocks; a message that
+        can't be delivered is logged and dropped.
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """Stops receiving and publishing the messages."""
+
+
+class PostgresEventBus(EventBus):
+    """
+    An event bus on Postgres `LISTEN`/`NOTIFY`. Each process listens on its
+    own dedicated connection and publishes through another one, both used
+    by background threads so the event loop never waits for the database.
+
+    A message larger than a `NOTIFY` payload is split into chunks, which
+    are sent in order and put back together by the receivers.
+
+    The positions are taken from the `{channel}_positions` sequence, one for
+    each chunk; a message is at the position of its last chunk. The
+    publishers of the channel take turns, holding an advisory lock until
+    their notifications are committed, so the positions follow the order in
+    which the notifications are received.
+
+    The messages published while a worker's listening connection is down are
+    lost for that worker.
+    """
+
+    __engine: Engine
+    __channel: str
+    __receive: Callable[[str], None] | None
+    __outgoing: SimpleQueue[str | None]
+    __origin: str
+    __sequence: Iterator[int]
+    __partial: dict[str, tuple[int, list[str]]]
+    __closed: ThreadEvent
+    __threads: list[Thread]
+
+    def __init__(self, engine: Engine, channel: str = "events") -> None:
+        """
+        :param engine: The engine the dedicated connections are opened from.
+        :param channel: The name of the `NOTIFY` channel, shared by all the \
+            workers of the application.
+        """
+
+        self.__engine = engine
+        self.__channel = channel
+        self.__receive = None
+        self.__outgoing = SimpleQueue()
+        self.__origin = uuid4().hex[:8]
+        self.__sequence = count()
+        self.__partial = {}
+        self.__closed = ThreadEvent()
+        self.__threads = []
+
+    def __connect(self) -> Any:
+        # a connection of its own, outside of the pool
+        connection = self.__engine.raw_connection()
+        driver_connection = connection.driver_connection
+        connection.detach()
+
+        driver_connection.autocommit = True  # type: ignore
+
+        return driver_connection
+
+    def __listen(self) -> Any:
+        connection = self.__connect()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.__channel}"')
+
+        return connection
+
+    @property
+    def epoch(self) -> str:
+        return self.__channel
+
+    @property
+    def __positions(self) -> str:
+        return f'"{self.__channel}_positions"'
+
+    def start(self, receive: Callable[[int, str], None]) -> int:
+        self.__receive = receive
+
+        # listening before returning, the messages published from now on are
+        # received
+        connection = self.__listen()
+
+        with connection.cursor() as cursor:
+            # the workers may start at the same time
+            cursor.execute(
+                "BEGIN; "
+                "SELECT pg_advisory_xact_lock(hashtext(%s)); "
+                f"CREATE SEQUENCE IF NOT EXISTS {self.__positions}; "
+                "COMMIT",
+                (self.__channel,),
+            )
+
+            # a message at a later position is notified after listening
+            cursor.execute(
+                "SELECT CASE WHEN is_called THEN last_value ELSE 0 END "
+                f"FROM {self.__positions}"
+            )
+            (position,) = cursor.fetchone()
+
+        self.__threads = [
+            Thread(
+                target=self.__receive_messages, args=(connection,), daemon=True
+            ),
+            Thread(target=self.__publish_messages, daemon=True),
+        ]
+
+        for thread in self.__threads:
+            thread.start()
+
+        return position
+
+    def publish(self, message: str) -> None:
+        # `NOTIFY` drops the identical payloads sent in one transaction, the
+        # origin and the sequence number keep them apart and tell the
+        # receivers which chunks belong together
+        sequence = next(self.__sequence)
+        chunks = split_chunks(message)
+
+        for index, chunk in enumerate(chunks):
+            self.__outgoing.put(
+                f"{self.__origin} {sequence} {index} {len(chunks)}\n{chunk}"
+            )
+
+    def close(self) -> None:
+        self.__closed.set()
+        self.__outgoing.put(None)
+
+        for thread in self.__threads:
+            thread.join()
+
+    def __receive_messages(self, connection: Any) -> None:
+        assert self.__receive is not None
+
+        while not self.__closed.is_set():
+            try:
+                if connection is None:
+                    connection = self.__listen()
+
+                # wakes up regularly to notice that the bus is closed
+                if select.select([connection], [], [], 1) == ([], [], []):
+                    continue
+
+                connection.poll()
+
+                while connection.notifies:
+                    payload: str = connection.notifies.pop(0).payload
+                    message = self.__assemble(payload)
+
+                    if message is None:
+                        continue
+
+                    try:
+                        self.__receive(*message)
+                    except Exception:
+                        logger.exception("failed to receive a message")
+
+            except Exception:
+                logger.exception("lost the listening connection, reconnecting")
+
+                if connection is not None:
+                    connection.close()
+                    connection = None
+
+                self.__closed.wait(1)
+
+        if connection is not None:
+            connection.close()
+
+    def __assemble(self, payload: str) -> tuple[int, str] | None:
+        header, _, chunk = payload.partition("\n")
+        position, origin, sequence, index, chunk_count = header.split(" ")
+
+        if chunk_count == "1":
+            return int(position), chunk
+
+        partial = self.__partial.pop(origin, None)
+
+        if index == "0":
+            partial = (int(sequence), [])
+        elif (
+            partial is None
+            or partial[0] != int(sequence)
+            or len(partial[1]) != int(index)
+        ):
+            # the previous chunks were sent while the connection was down
+            logger.warning(
+                f"dropped an incomplete message of {chunk_count} chunks"
+            )
+            return None
+
+        partial[1].append(chunk)
+
+        if len(partial[1]) < int(chunk_count):
+            self.__partial[origin] = partial
+            return None
+
+        return int(position), "".join(partial[1])
+
+    def __publish_messages(self) -> None:
+        connection: Any = None
+
+        while True:
+            payload = self.__outgoing.get()
+
+            if payload is None:
+                break
+
+            # the messages queued meanwhile are sent in the same round trip
+            payloads = [payload]
+
+            while True:
+                try:
+                    payload = self.__outgoing.get_nowait()
+                except Empty:
+                    break
+
+                if payload is None:
+                    self.__outgoing.put(None)
+                    break
+
+                payloads.append(payload)
+
+            try:
+                if connection is None:
+                    connection = self.__connect()
+
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "BEGIN; "
+                        "SELECT pg_advisory_xact_lock(hashtext(%s)); "
+                        "SELECT pg_notify("
+                        f"%s, nextval('{self.__positions}') || ' ' || payload"
+                        ") "
+                        "FROM unnest(%s::text[]) WITH ORDINALITY "
+                        "AS payloads(payload, ordinality) "
+                        "ORDER BY ordinality; "
+                        "COMMIT",
+                        (self.__channel, self.__channel, payloads),
+                    )
+
+            except Exception:
+                logger.exception(f"failed to publish {len(payloads)} messages")
+
+                if connection is not None:
+                    connection.close()
+                    connection = None
+
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,394 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal
+from threading import Lock
+from uuid import uuid4
+
+from sqlalchemy.orm import Session
+
+from api.bus import EventBus
+from api.models.restaurant import Customization, Menu, Option
+
+
+@dataclass(frozen=True)
+class OptionEntry:
+    """A cached snapshot of an `Option` row."""
+
+    id: int
+    customization_id: int
+    name: str
+    description: str | None
+    extra_price: Decimal | None
+
+
+@dataclass(frozen=True)
+class CustomizationEntry:
+    """A cached snapshot of a `Customization` row and its options."""
+
+    id: int
+    menu_id: int
+    title: str
+    description: str | None
+    unique: bool
+    required: bool
+    options: tuple[OptionEntry, ...]
+
+
+@dataclass(frozen=True)
+class CustomizationValidator:
+    """
+    The required and unique rules of a menu's customizations compiled into
+    bitmasks. Each customization of the menu is assigned a bit, ordered by
+    the customization ID.
+    """
+
+    customization_ids: tuple[int, ...]
+    """The customization IDs indexed by their bit position."""
+
+    option_masks: dict[int, int]
+    """Maps the option IDs to the bit of the customization they belong to."""
+
+    required_mask: int
+    """The bits of the customizations that must be chosen."""
+
+    unique_mask: int
+    """The bits of the customizations that can be chosen at most once."""
+
+    @staticmethod
+    def compile(
+        customizations: tuple[CustomizationEntry, ...],
+    ) -> "CustomizationValidator":
+        """Compiles the rules of the given customizations of a menu."""
+
+        customizations = tuple(sorted(customizations, key=lambda c: c.id))
+
+        option_masks: dict[int, int] = {}
+        required_mask = 0
+        unique_mask = 0
+
+        for bit, customization in enumerate(customizations):
+            mask = 1 << bit
+
+            if customization.required:
+                required_mask |= mask
+
+            if customization.unique:
+                unique_mask |= mask
+
+            for option in customization.options:
+                option_masks[option.id] = mask
+
+        return CustomizationValidator(
+            customization_ids=tuple(c.id for c in customizations),
+            option_masks=option_masks,
+            required_mask=required_mask,
+            unique_mask=unique_mask,
+        )
+
+    def __first_customization_id(self, mask: int) -> int | None:
+        if not mask:
+            return None
+
+        return self.customization_ids[(mask & -mask).bit_length() - 1]
+
+    def missing_required(self, chosen_mask: int) -> int | None:
+        """
+        Returns the ID of the first required customization that is not in the
+        chosen customizations, if any.
+        """
+
+        return self.__first_customization_id(self.required_mask & ~chosen_mask)
+
+    def repeated_unique(self, repeated_mask: int) -> int | None:
+        """
+        Returns the ID of the first unique customization that is chosen more
+        than once, if any.
+        """
+
+        return self.__first_customization_id(self.unique_mask & repeated_mask)
+
+
+@dataclass(frozen=True)
+class MenuEntry:
+    """A cached snapshot of a `Menu` row and its customizations."""
+
+    id: int
+    restaurant_id: int
+    name: str
+    description: str
+    price: Decimal
+    image: str | None
+    estimated_prep_time: int | None
+    customizations: tuple[CustomizationEntry, ...]
+    validator: CustomizationValidator
+
+
+@dataclass(frozen=True)
+class RestaurantCatalog:
+    """Every menu, customization and option of a single restaurant."""
+
+    restaurant_id: int
+    """The ID of the restaurant that the catalog belongs to."""
+
+    menus: dict[int, MenuEntry]
+    """The menus of the restaurant keyed by their ID."""
+
+    options: dict[int, tuple[OptionEntry, CustomizationEntry]]
+    """
+    The options of every menu in the restaurant keyed by their ID along with
+    the customization they belong to.
+    """
+
+
+def load_restaurant_catalog(
+    session: Session, restaurant_id: int
+) -> RestaurantCatalog:
+    """Loads the catalog of the restaurant from the database."""
+
+    options_by_customization: dict[int, list[OptionEntry]] = {}
+    for option in (
+        session.query(Option)
+        .filter(
+            (Option.customization_id == Customization.id)
+            & (Customization.menu_id == Menu.id)
+            & (Menu.restaurant_id == restaurant_id)
+        )
+        .order_by(Option.id)
+        .all()
+    ):
+        options_by_customization.setdefault(
+            option.customization_id, []
+        ).append(
+            OptionEntry(
+                id=option.id,
+                customization_id=option.customization_id,
+                name=option.name,
+                description=option.description,
+                extra_price=option.extra_price,
+            )
+        )
+
+    customizations_by_menu: dict[int, list[CustomizationEntry]] = {}
+    for customization in (
+        session.query(Customization)
+        .filter(
+            (Customization.menu_id == Menu.id)
+            & (Menu.restaurant_id == restaurant_id)
+        )
+        .order_by(Customization.id)
+        .all()
+    ):
+        customizations_by_menu.setdefault(customization.menu_id, []).append(
+            CustomizationEntry(
+                id=customization.id,
+                menu_id=customization.menu_id,
+                title=customization.title,
+                description=customization.description,
+                unique=customization.unique,
+                required=customization.required,
+                options=tuple(
+                    options_by_customization.get(customization.id, [])
+                ),
+            )
+        )
+
+    menus: dict[int, MenuEntry] = {}
+    options: dict[int, tuple[OptionEntry, CustomizationEntry]] = {}
+
+    for menu in (
+        session.query(Menu)
+        .filter(Menu.restaurant_id == restaurant_id)
+        .order_by(Menu.id)
+        .all()
+    ):
+        customizations = tuple(customizations_by_menu.get(menu.id, []))
+
+        menus[menu.id] = MenuEntry(
+            id=menu.id,
+            restaurant_id=menu.restaurant_id,
+            name=menu.name,
+            description=menu.description,
+            price=menu.price,
+            image=menu.image,
+            estimated_prep_time=menu.estimated_prep_time,
+            customizations=customizations,
+            validator=CustomizationValidator.compile(customizations),
+        )
+
+        for customization in customizations:
+            for option in customization.options:
+                options[option.id] = (option, customization)
+
+    return RestaurantCatalog(
+        restaurant_id=restaurant_id, menus=menus, options=options
+    )
+
+
+class CatalogCache:
+    """
+    An in-process, size bounded LRU cache of restaurant catalogs.
+
+    The catalogs are rarely modified, therefore, they are cached until one of
+    the write paths (creating or updating a menu, uploading a menu image or
+    creating a customization) invalidates the restaurant's entry.
+
+    The menus of the cached catalogs are indexed by their IDs for
+    `get_menu`; a menu leaves the index along with its catalog.
+
+    With a bus, the invalidations are published to the other workers, which
+    evict their copy of the catalog as well.
+    """
+
+    __catalogs: OrderedDict[int, RestaurantCatalog]
+    __restaurant_by_menu: dict[int, int]
+    __max_restaurants: int
+    __generation: int
+    __hits: int
+    __misses: int
+    __mutex: Lock
+    __bus: EventBus | None
+    __origin: str
+
+    def __init__(
+        self, max_restaurants: int = 256, bus: EventBus | None = None
+    ) -> None:
+        """
+        :param max_restaurants: The maximum number of restaurant catalogs \
+            kept in the cache. The least recently used catalog is evicted \
+            when the limit is exceeded.
+        :param bus: The bus the invalidations are published through to the \
+            other workers, `None` if this process is the only one.
+        """
+
+        if max_restaurants < 1:
+            raise ValueError("max_restaurants must be at least 1")
+
+        self.__catalogs = OrderedDict()
+        self.__restaurant_by_menu = {}
+        self.__max_restaurants = max_restaurants
+        self.__generation = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__mutex = Lock()
+        self.__bus = bus
+        self.__origin = uuid4().hex[:8]
+
+        if bus is not None:
+            bus.start(self.__receive)
+
+    def get(self, session: Session, restaurant_id: int) -> RestaurantCatalog:
+        """
+        Gets the catalog of the restaurant, loading it from the database with
+        the given session on a cache miss.
+        """
+
+        with self.__mutex:
+            catalog = self.__catalogs.get(restaurant_id)
+
+            if catalog is not None:
+                self.__catalogs.move_to_end(restaurant_id)
+                self.__hits += 1
+
+                return catalog
+
+            self.__misses += 1
+            generation = self.__generation
+
+        catalog = load_restaurant_catalog(session, restaurant_id)
+
+        with self.__mutex:
+            # the catalog might have been modified while it was being loaded,
+            # in which case it's not safe to be cached.
+            if generation != self.__generation:
+                return catalog
+
+            # loaded by another request in the meantime
+            self.__evict(restaurant_id)
+
+            self.__catalogs[restaurant_id] = catalog
+
+            for menu_id in catalog.menus:
+                self.__restaurant_by_menu[menu_id] = restaurant_id
+
+            while len(self.__catalogs) > self.__max_restaurants:
+                self.__evict(next(iter(self.__catalogs)))
+
+        return catalog
+
+    def __evict(self, restaurant_id: int) -> None:
+        catalog = self.__catalogs.pop(restaurant_id, None)
+
+        if catalog is None:
+            return
+
+        for menu_id in catalog.menus:
+            if self.__restaurant_by_menu.get(menu_id) == restaurant_id:
+                del self.__restaurant_by_menu[menu_id]
+
+    def get_menu(self, session: Session, menu_id: int) -> MenuEntry | None:
+        """
+        Gets the menu from the catalog of the restaurant that owns it. Returns
+        None if the menu doesn't exist.
+        """
+
+        with self.__mutex:
+            restaurant_id = self.__restaurant_by_menu.get(menu_id)
+
+        if restaurant_id is None:
+            restaurant_id = (
+                session.query(Menu.restaurant_id)
+                .filter(Menu.id == menu_id)
+                .scalar()
+            )
+
+            if restaurant_id is None:
+                return None
+
+        return self.get(session, restaurant_id).menus.get(menu_id)
+
+    def invalidate(self, restaurant_id: int) -> None:
+        """
+        Evicts the catalog of the restaurant, in every worker. Must be called
+        after any of its menus, customizations or options is modified.
+        """
+
+        self.__drop(restaurant_id)
+
+        if self.__bus is not None:
+            self.__bus.publish(f"{self.__origin} {restaurant_id}")
+
+    def __drop(self, restaurant_id: int) -> None:
+        with self.__mutex:
+            self.__generation += 1
+            self.__evict(restaurant_id)
+
+    def __receive(self, _: int, message: str) -> None:
+        origin, _, restaurant_id = message.partition(" ")
+
+        # evicted by this process already
+        if origin != self.__origin:
+            self.__drop(int(restaurant_id))
+
+    @property
+    def hits(self) -> int:
+        """The number of lookups served from the cache."""
+
+        return self.__hits
+
+    @property
+    def misses(self) -> int:
+        """The number of lookups that had to load from the database."""
+
+        return self.__misses
+
+    @property
+    def size(self) -> int:
+        """The number of restaurant catalogs currently cached."""
+
+        return len(self.__catalogs)
+
+    @property
+    def menu_count(self) -> int:
+        """The number of menus of the cached catalogs."""
+
+        return len(self.__restaurant_by_menu)
@@ -4,9 +4,19 @@ from fastapi import UploadFile
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
+from api.catalog import CatalogCache
 from api.errors import FileContentTypeError
 from api.errors.internal import InternalServerError
+from api.bus import EventBus, PostgresEventBus
+from api.idempotency import (
+    IdempotencyStore,
+    InMemoryIdempotencyStore,
+    PostgresIdempotencyStore,
+)
+from api.ingestion import OrderIngestion
 from api.models import Base
+from api.schemas.event import OverflowPolicy, QueueNotifications
+from api.queues import QueueChangeNotifier, QueueEngine
 from platformdirs import user_data_dir
 
 import alembic.config
@@ -33,12 +43,31 @@ class Configuration:
 
     __jwt_secret: str
     __application_data_path: str
+    __catalog_cache: CatalogCache
+    __idempotency_store: IdempotencyStore
+    __order_ingestion: OrderIngestion | None
+    __order_archive_age: int
+    __queue_engine: QueueEngine
+    __queue_change_notifier: QueueChangeNotifier | None
+    __event_bus: EventBus | None
+    __listener_buffer_size: int
+    __listener_overflow_policy: OverflowPolicy
+    __queue_notifications: QueueNotifications
 
     def __init__(
         self,
         session_maker: Callable[[], Session] | None = None,
         jwt_secret: str | None = None,
         application_data_path: str | None = None,
+        catalog_cache_size: int | None = None,
+        idempotency_store: IdempotencyStore | None = None,
+        order_ingestion: OrderIngestion | None = None,
+        order_archive_age: int | None = None,
+        queue_notification_window: float | None = None,
+        event_bus: EventBus | None = None,
+        listener_buffer_size: int | None = None,
+        listener_overflow_policy: OverflowPolicy | None = None,
+        queue_notifications: QueueNotifications | None = None,
     ) -> None:
         """Initialize the configuration of the FastAPI application.
 
@@ -56,6 +85,54 @@ class Configuration:
             environment variables. If not found, the state will use a \
             directory `quickdish` in user data directory. The state will \
             ensure that the directory exists and is writable.
+        :param catalog_cache_size: The maximum number of restaurant catalogs \
+            kept in the in-process catalog cache. If `None`, the \
+            configuration will look for `CATALOG_CACHE_SIZE` in the \
+            environment variables and defaults to 256.
+        :param idempotency_store: The store used to remember the results of \
+            requests sent with an `Idempotency-Key` header. If `None`, the \
+            configuration will look for `IDEMPOTENCY_STORE` (`postgres` or \
+            `memory`, defaults to `postgres`) and `IDEMPOTENCY_KEY_TTL` (in \
+            seconds, defaults to a day) in the environment variables.
+        :param order_ingestion: The group commit pipeline used to write the \
+            new orders. If `None`, the configuration will look for \
+            `ORDER_INGESTION` (`direct` or `batched`, defaults to `direct`), \
+            `ORDER_INGESTION_BATCH_SIZE` (defaults to 64) and \
+            `ORDER_INGESTION_WINDOW_MS` (defaults to 5) in the environment \
+            variables. With `direct`, every order is committed by its own \
+            request.
+        :param order_archive_age: The number of seconds after which the \
+            settled and cancelled orders are moved to the archive \
+            partitions. If `None`, the configuration will look for \
+            `ORDER_ARCHIVE_AGE` in the environment variables and defaults \
+            to 30 days.
+        :param queue_notification_window: The number of seconds the queue \
+            changes of a restaurant are collected for before its customers \
+            are notified, `0` to notify them on every change. If `None`, the \
+            configuration will look for `QUEUE_NOTIFICATION_WINDOW_MS` in \
+            the environment variables and defaults to 250 milliseconds.
+        :param event_bus: The bus the notifications are published through \
+            to the other workers. If `None`, the configuration will look for \
+            `EVENT_BUS` in the environment variables: `memory` (the \
+            default) delivers the notifications within the process only, \
+            `postgres` uses Postgres `LISTEN`/`NOTIFY`, along with the \
+            invalidations of the catalog cache and the queue engine.
+        :param listener_buffer_size: The maximum number of notifications \
+            waiting to be sent to each SSE listener. If `None`, the \
+            configuration will look for `LISTENER_BUFFER_SIZE` in the \
+            environment variables and defaults to 256.
+        :param listener_overflow_policy: What a listener does with a new \
+            notification once its buffer is full. If `None`, the \
+            configuration will look for `LISTENER_OVERFLOW_POLICY` in the \
+            environment variables and defaults to `collapse`.
+        :param queue_notifications: How the customers are told about the \
+            changes of the restaurant queues. If `None`, the configuration \
+            will look for `QUEUE_NOTIFICATIONS` in the environment variables: \
+            `orders` notifies the customer of every order whose queue \
+            changed, `restaurants` broadcasts a single snapshot of the queue \
+            to the subscribers of the restaurant and `both` (the default) \
+            does both, so every change still costs a notification per \
+            waiting customer.
 
         Raises:
             RuntimeError: if the DATABASE_URL or JWT_SECRET environment
@@ -128,6 +205,141 @@ class Configuration:
                 f"{self.__application_data_path} is not writable"
             )
 
+        # the caches of the workers are kept in sync on channels of their own
+        catalog_bus: EventBus | None = None
+        queue_bus: EventBus | None = None
+
+        if event_bus:
+            self.__event_bus = event_bus
+        else:
+            match os.getenv("EVENT_BUS", "memory"):
+                case "memory":
+                    self.__event_bus = None
+
+                case "postgres":
+                    with self.__session_maker() as session:
+                        engine = session.get_bind().engine
+
+                    self.__event_bus = PostgresEventBus(engine)
+                    catalog_bus = PostgresEventBus(engine, "catalogs")
+                    queue_bus = PostgresEventBus(engine, "queues")
+
+                case bus:
+                    raise RuntimeError(
+                        f"unknown EVENT_BUS `{bus}`; expected `memory` or "
+                        "`postgres`"
+                    )
+
+        if catalog_cache_size is None:
+            catalog_cache_size = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+
+        self.__catalog_cache = CatalogCache(catalog_cache_size, catalog_bus)
+
+        if idempotency_store:
+            self.__idempotency_store = idempotency_store
+        else:
+            idempotency_key_ttl = int(
+                os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60))
+            )
+
+            match os.getenv("IDEMPOTENCY_STORE", "postgres"):
+                case "postgres":
+                    self.__idempotency_store = PostgresIdempotencyStore(
+                        idempotency_key_ttl,
+                        float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "30")),
+                    )
+
+                case "memory":
+                    self.__idempotency_store = InMemoryIdempotencyStore(
+                        idempotency_key_ttl
+                    )
+
+                case store:
+                    raise RuntimeError(
+                        f"unknown IDEMPOTENCY_STORE `{store}`; expected "
+                        "`postgres` or `memory`"
+                    )
+
+        if order_ingestion:
+            self.__order_ingestion = order_ingestion
+        else:
+            match os.getenv("ORDER_INGESTION", "direct"):
+                case "direct":
+                    self.__order_ingestion = None
+
+                case "batched":
+                    self.__order_ingestion = OrderIngestion(
+                        self.__session_maker,
+                        batch_size=int(
+                            os.getenv("ORDER_INGESTION_BATCH_SIZE", "64")
+                        ),
+                        window=int(os.getenv("ORDER_INGESTION_WINDOW_MS", "5"))
+                        / 1000,
+                    )
+
+                case ingestion:
+                    raise RuntimeError(
+                        f"unknown ORDER_INGESTION `{ingestion}`; expected "
+                        "`direct` or `batched`"
+                    )
+
+        if order_archive_age is None:
+            order_archive_age = int(
+                os.getenv("ORDER_ARCHIVE_AGE", str(30 * 24 * 60 * 60))
+            )
+
+        self.__order_archive_age = order_archive_age
+        self.__queue_engine = QueueEngine(queue_bus)
+
+        if queue_notification_window is None:
+            queue_notification_window = (
+                int(os.getenv("QUEUE_NOTIFICATION_WINDOW_MS", "250")) / 1000
+            )
+
+        self.__queue_change_notifier = (
+            QueueChangeNotifier(
+                self.__session_maker,
+                self.__catalog_cache,
+                self.__queue_engine,
+                window=queue_notification_window,
+            )
+            if queue_notification_window > 0
+            else None
+        )
+
+        if listener_buffer_size is None:
+            listener_buffer_size = int(
+                os.getenv("LISTENER_BUFFER_SIZE", "256")
+            )
+
+        self.__listener_buffer_size = listener_buffer_size
+
+        if listener_overflow_policy is None:
+            policy = os.getenv("LISTENER_OVERFLOW_POLICY", "collapse")
+
+            try:
+                listener_overflow_policy = OverflowPolicy(policy)
+            except ValueError:
+                raise RuntimeError(
+                    f"unknown LISTENER_OVERFLOW_POLICY `{policy}`; expected "
+                    "`drop_oldest`, `collapse` or `disconnect`"
+                )
+
+        self.__listener_overflow_policy = listener_overflow_policy
+
+        if queue_notifications is None:
+            notifications = os.getenv("QUEUE_NOTIFICATIONS", "both")
+
+            try:
+                queue_notifications = QueueNotifications(notifications)
+            except ValueError:
+                raise RuntimeError(
+                    f"unknown QUEUE_NOTIFICATIONS `{notifications}`; "
+                    "expected `orders`, `restaurants` or `both`"
+                )
+
+        self.__queue_notifications = queue_notifications
+
     def create_session(self) -> Session:
         """Create a new SQLAlchemy session.
 
@@ -148,6 +360,99 @@ class Configuration:
 
         return self.__jwt_secret
 
+    @property
+    def catalog_cache(self) -> CatalogCache:
+        """Get the restaurant catalog cache shared by all requests.
+
+        :return: The catalog cache.
+        """
+
+        return self.__catalog_cache
+
+    @property
+    def idempotency_store(self) -> IdempotencyStore:
+        """Get the store of the idempotency keys.
+
+        :return: The idempotency store.
+        """
+
+        return self.__idempotency_store
+
+    @property
+    def order_ingestion(self) -> OrderIngestion | None:
+        """Get the group commit pipeline of the new orders.
+
+        :return: The order ingestion pipeline or `None` if the orders are \
+            committed by their own requests.
+        """
+
+        return self.__order_ingestion
+
+    @property
+    def order_archive_age(self) -> int:
+        """Get the age in seconds after which finished orders are archived.
+
+        :return: The archive age of the orders.
+        """
+
+        return self.__order_archive_age
+
+    @property
+    def queue_engine(self) -> QueueEngine:
+        """Get the restaurant queues shared by all requests.
+
+        :return: The queue engine.
+        """
+
+        return self.__queue_engine
+
+    @property
+    def queue_change_notifier(self) -> QueueChangeNotifier | None:
+        """Get the notifier that coalesces the queue changes.
+
+        :return: The queue change notifier or `None` if the customers are \
+            notified on every change.
+        """
+
+        return self.__queue_change_notifier
+
+    @property
+    def event_bus(self) -> EventBus | None:
+        """Get the bus the notifications are published through.
+
+        :return: The event bus or `None` if the notifications are only \
+            delivered within the process.
+        """
+
+        return self.__event_bus
+
+    @property
+    def listener_buffer_size(self) -> int:
+        """Get the maximum number of notifications buffered per listener.
+
+        :return: The buffer size of the listeners.
+        """
+
+        return self.__listener_buffer_size
+
+    @property
+    def listener_overflow_policy(self) -> OverflowPolicy:
+        """Get what a listener does once its buffer is full.
+
+        :return: The overflow policy of the listeners.
+        """
+
+        return self.__listener_overflow_policy
+
+    @property
+    def queue_notifications(self) -> QueueNotifications:
+        """Get how the customers are told about the queue changes.
+
+        :return: The kinds of the queue notifications sent.
+        """
+
+        return self.__queue_notifications
+
     @property
     def application_data_path(self) -> str:
         """Get the application data path.
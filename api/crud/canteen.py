@@ -2,7 +2,7 @@ from api.configuration import Configuration
 from api.models.canteen import Canteen
 from api.models.restaurant import Restaurant
 from api.state import State
-from api.schemas.canteen import CanteenBase
+from api.schemas.canteen import CanteenBase, CanteenQueue
 from fastapi.responses import FileResponse
 from api.errors import NotFoundError
 
@@ -156,6 +156,40 @@ async def get_restaurants_in_canteen(
     ]
 
 
+async def get_canteen_queues(
+    state: State, canteen_id: int
+) -> List[CanteenQueue]:
+    """
+    Gets the queue of every restaurant in the canteen, ordered by the
+    restaurant IDs. The queues are answered by the queue engine; the
+    restaurants it hasn't loaded yet are loaded together.
+    """
+
+    # a canteen without restaurants still has a row, with a `NULL` restaurant
+    rows = (
+        state.session.query(Canteen.id, Restaurant.id)
+        .outerjoin(Restaurant, Restaurant.canteen_id == Canteen.id)
+        .filter(Canteen.id == canteen_id)
+        .order_by(Restaurant.id)
+        .all()
+    )
+
+    if not rows:
+        raise NotFoundError("Canteen not found")
+
+    restaurant_ids = [
+        restaurant_id for _, restaurant_id in rows if restaurant_id is not None
+    ]
+    queues = state.queues.restaurant_queues(
+        state.session, state.catalog, restaurant_ids
+    )
+
+    return [
+        CanteenQueue(restaurant_id=restaurant_id, queue=queues[restaurant_id])
+        for restaurant_id in restaurant_ids
+    ]
+
+
 async def get_canteen_by_id(state: State, canteen_id: int) -> Canteen:
     canteen = state.session.query(Canteen).filter_by(id=canteen_id).first()
 
@@ -1,53 +1,81 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from decimal import Decimal
-
-from sqlalchemy import ColumnElement, false, or_
+from typing import Any, Callable
+
+from sqlalchemy import (
+    ColumnElement,
+    Subquery,
+    case,
+    false,
+    func,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.orm import Query, selectinload
 from api.crud.restaurant import get_restaurant
 from api.dependencies.id import Role
-from api.event import Event, User
+from api.event import Event, User, restaurant_queue_topic
 from api.errors import ConflictingError, InvalidArgumentError, NotFoundError
 from api.errors.authentication import UnauthorizedError
 from api.errors.internal import InternalServerError
-from api.models.order import (
-    CancelledOrder,
-    Order,
-    OrderItem,
-    OrderOption,
-    PreparingOrder,
-    ReadyOrder,
-    SettledOrder,
-)
+from api.idempotency import IdempotencyRecord
+from api.ingestion import OrderIngestion, ValidatedOrder, insert_orders
+from api.models.order import Order, OrderId, OrderItem
 from api.models.restaurant import Menu, Option, Customization, Restaurant
+from api.queues import (
+    ACTIVE_ORDER_STATUSES,
+    QueueBroadcaster,
+    QueueChangeNotifier,
+    QueuedOrder,
+    QueueSender,
+    estimate_prep_time,
+)
+from api.schemas.canteen import CanteenQueue
 from api.schemas.event import (
     OrderQueueChangeNotification,
     OrderStatusChangeNotification,
+    QueueEntry,
+    QueueNotifications,
+    RestaurantQueueNotification,
 )
 from api.schemas.order import (
-    CancelledOrderUpdate,
     OrderCancelledBy,
     OrderCreate,
     OrderStatusFlag,
     OrderStatus,
     OrderItem as OrderItemSchema,
     Order as OrderSchema,
+    OrderStatusBulkUpdate,
+    OrderStatusBulkUpdateResult,
     CancelledOrder as CancelledOrderSchema,
     OrderStatusUpdate,
     OrderedOrder as OrderedOrderSchema,
-    PreparingOrderUpdate,
     Queue,
     ReadyOrder as ReadyOrderSchema,
-    ReadyOrderUpdate,
     SettledOrder as SettledOrderSchema,
     PreparingOrder as PreparingOrderSchema,
-    SettledOrderUpdate,
 )
 from api.state import State
 import time
 
 
 async def create_order(
-    state: State, customer_id: int, payload: OrderCreate
+    state: State,
+    customer_id: int,
+    payload: OrderCreate,
+    ingestion: OrderIngestion | None = None,
+    idempotency: IdempotencyRecord | None = None,
 ) -> int:
-    """Creates a new order placed by a customer."""
+    """
+    Creates a new order placed by a customer. If `ingestion` is given, the
+    validated order is written by its group commit pipeline instead of the
+    request's session. If `idempotency` is given, the key is recorded in the
+    same transaction as the order.
+    """
 
     # check if the restaurant exists
     restaurant = await get_restaurant(state, payload.restaurant_id)
@@ -58,17 +86,46 @@ async def create_order(
     price_paid = Decimal(0)
     ordered_at = int(time.time())
 
+    # the menus, customizations and options of the restaurant are read from
+    # the catalog cache so that the validation doesn't hit the database
+    catalog = state.catalog.get(state.session, restaurant.id)
+
+    menu_ids = {order.menu_id for order in payload.items}
+    option_ids = {
+        option.option_id for item in payload.items for option in item.options
+    }
+
+    # anything not found in the catalog either doesn't exist or belongs to
+    # another restaurant, look them up in bulk to report the right error
+    unknown_menu_ids = menu_ids - catalog.menus.keys()
+    unknown_option_ids = option_ids - catalog.options.keys()
+
+    foreign_menu_ids: set[int] = set()
+    foreign_option_ids: set[int] = set()
+
+    if unknown_menu_ids:
+        foreign_menu_ids = set(
+            state.session.scalars(
+                select(Menu.id).filter(Menu.id.in_(unknown_menu_ids))
+            )
+        )
+
+    if unknown_option_ids:
+        foreign_option_ids = set(
+            state.session.scalars(
+                select(Option.id).filter(Option.id.in_(unknown_option_ids))
+            )
+        )
+
     for order in payload.items:
         # check if the menu exists in the restaurant
-        menu = (
-            state.session.query(Menu).filter(Menu.id == order.menu_id).first()
-        )
+        menu = catalog.menus.get(order.menu_id)
 
         if not menu:
-            raise NotFoundError("menu with id {order.menu_id} not found")
+            if order.menu_id not in foreign_menu_ids:
+                raise NotFoundError("menu with id {order.menu_id} not found")
 
-        # check if the menu is actually in the same restaurant
-        if menu.restaurant_id != restaurant.id:
+            # the menu is not in the same restaurant
             raise InvalidArgumentError(
                 f"menu with id {order.menu_id} is not in restaurant with id {restaurant.id}"
             )
@@ -80,170 +137,126 @@ async def create_order(
 
         price_paid += Decimal(menu.price)
 
-        seen_customizations = list[int]()
+        # the bits of the customizations chosen at least once and more than
+        # once, see `CustomizationValidator`
+        chosen_mask = 0
+        repeated_mask = 0
 
         # check if the option ids are a part of the menu
         for option_create in order.options:
             option_id = option_create.option_id
 
-            result = (
-                state.session.query(Option, Customization)
-                .filter(
-                    (Option.id == option_id)
-                    & (Customization.id == Option.customization_id)
-                )
-                .first()
-            )
+            result = catalog.options.get(option_id)
 
-            if result is None:
+            if result is None and option_id not in foreign_option_ids:
                 raise NotFoundError(
                     f"the option with id {option_id} not found"
                 )
 
-            option = result[0]
-            customization = result[1]
+            mask = menu.validator.option_masks.get(option_id)
 
-            if customization.menu_id != menu.id:
+            if result is None or mask is None:
                 raise InvalidArgumentError(
                     f"the option with id {option_id} is not in menu with id {menu.id}"
                 )
 
-            seen_customizations.append(customization.id)
+            repeated_mask |= chosen_mask & mask
+            chosen_mask |= mask
+
+            option = result[0]
 
             if option.extra_price is not None:
                 price_paid += Decimal(option.extra_price)
 
         # check if all the required customizations are present
-        required_menu_customizations = (
-            state.session.query(Customization)
-            .filter(
-                (Customization.menu_id == menu.id) & (Customization.required)
-            )
-            .all()
-        )
+        missing_customization_id = menu.validator.missing_required(chosen_mask)
 
-        for required_customization in required_menu_customizations:
-            if required_customization.id not in seen_customizations:
-                raise InvalidArgumentError(
-                    f"menu with id {menu.id} requires customization with id {required_customization.id}"
-                )
+        if missing_customization_id is not None:
+            raise InvalidArgumentError(
+                f"menu with id {menu.id} requires customization with id {missing_customization_id}"
+            )
 
         # check if the unique customizations are actually unique
-        unique_customizations = (
-            state.session.query(Customization)
-            .filter(
-                (Customization.menu_id == menu.id) & (Customization.unique)
-            )
-            .all()
+        repeated_customization_id = menu.validator.repeated_unique(
+            repeated_mask
         )
 
-        for unique_customization in unique_customizations:
-            # the number of customizations with the same id must be at most 1
-            if seen_customizations.count(unique_customization.id) > 1:
-                raise InvalidArgumentError(
-                    f"menu with id {menu.id} requires customization with id {unique_customization.id} to be unique"
-                )
+        if repeated_customization_id is not None:
+            raise InvalidArgumentError(
+                f"menu with id {menu.id} requires customization with id {repeated_customization_id} to be unique"
+            )
 
-    sql_order = Order(
+    validated_order = ValidatedOrder(
         customer_id=customer_id,
         restaurant_id=restaurant.id,
         ordered_at=ordered_at,
         price_paid=price_paid,
-        status=str(OrderStatusFlag.ORDERED),
+        items=payload.items,
+        idempotency=idempotency,
     )
 
-    state.session.add(sql_order)
-    state.session.flush()
-
-    state.session.refresh(sql_order)
-
-    for order in payload.items:
-        order_item = OrderItem(
-            order_id=sql_order.id,
-            menu_id=order.menu_id,
-            quantity=order.quantity,
-            extra_requests=order.extra_requests,
-        )
-        state.session.add(order_item)
+    # hand the order to the group commit pipeline if it's enabled
+    if ingestion is not None:
+        order_id = await ingestion.submit(validated_order)
+    else:
+        # write the order, its items and their options in a single
+        # transaction
+        [order_id] = insert_orders(state.session, [validated_order])
         state.session.commit()
 
-        state.session.refresh(order_item)
-
-        for option in order.options:
-            state.session.add(
-                OrderOption(
-                    order_item_id=order_item.id, option_id=option.option_id
-                )
-            )
-            state.session.commit()
+    state.queues.add(
+        validated_order.restaurant_id,
+        QueuedOrder(
+            order_id=order_id,
+            customer_id=customer_id,
+            ordered_at=ordered_at,
+            prep_time=estimate_prep_time(catalog, payload.items),
+        ),
+    )
 
-    return sql_order.id
+    return order_id
 
 
 async def get_order_status_no_validation(
     state: State, order: Order
 ) -> OrderStatus:
+    # the status details are stored on the order row itself, rendering the
+    # status doesn't need any extra query
     match order.status:
         case OrderStatusFlag.ORDERED:
             return OrderedOrderSchema()
 
         case OrderStatusFlag.CANCELLED:
-            cancelled_query = (
-                state.session.query(CancelledOrder)
-                .filter(CancelledOrder.order_id == order.id)
-                .first()
-            )
-
-            if not cancelled_query:
+            if order.cancelled_time is None or order.cancelled_by is None:
                 # this should never happen
                 raise InternalServerError("can't find the cancelled order")
 
             return CancelledOrderSchema(
-                cancelled_by=cancelled_query.cancelled_by,
-                cancelled_time=cancelled_query.cancelled_time,
-                reason=cancelled_query.reason,
+                cancelled_by=order.cancelled_by,
+                cancelled_time=order.cancelled_time,
+                reason=order.cancelled_reason,
             )
 
         case OrderStatusFlag.PREPARING:
-            preparing_query = (
-                state.session.query(PreparingOrder)
-                .filter(PreparingOrder.order_id == order.id)
-                .first()
-            )
-
-            if not preparing_query:
+            if order.prepared_at is None:
                 # this should never happen
                 raise InternalServerError("can't find the preparing order")
 
-            return PreparingOrderSchema(
-                prepared_at=preparing_query.prepared_at
-            )
+            return PreparingOrderSchema(prepared_at=order.prepared_at)
 
         case OrderStatusFlag.READY:
-            ready_query = (
-                state.session.query(ReadyOrder)
-                .filter(ReadyOrder.order_id == order.id)
-                .first()
-            )
-
-            if not ready_query:
+            if order.ready_at is None:
                 # this should never happen
                 raise InternalServerError("can't find the ready order")
 
-            return ReadyOrderSchema(ready_at=ready_query.ready_at)
+            return ReadyOrderSchema(ready_at=order.ready_at)
 
         case OrderStatusFlag.SETTLED:
-            settled_query = (
-                state.session.query(SettledOrder)
-                .filter(SettledOrder.order_id == order.id)
-                .first()
-            )
-
-            if not settled_query:
+            if order.settled_at is None:
                 # this should never happen
                 raise InternalServerError("can't find the settled order")
 
-            return SettledOrderSchema(settled_at=settled_query.settled_at)
+            return SettledOrderSchema(settled_at=order.settled_at)
 
 
 async def convert_to_schema(
@@ -269,52 +282,100 @@ async def get_orders(
     role: Role,
     restaurant_id_filter: int | None,
     status_filter: list[OrderStatusFlag],
+    after_id: int | None = None,
+    limit: int | None = None,
+    ordered_after: int | None = None,
+    ordered_before: int | None = None,
 ) -> list[Order]:
+    """
+    Gets a page of the orders of the customer or the restaurants of the
+    merchant, ordered by `ordered_at` and then by `id`.
+
+    :param after_id: The ID of the last order of the previous page. Only \
+        the orders that come after it are returned. Must be an order of \
+        the user, otherwise `InvalidArgumentError` is raised.
+    :param limit: The maximum number of orders returned.
+    :param ordered_after: Only the orders placed at or after this time are \
+        returned.
+    :param ordered_before: Only the orders placed before this time are \
+        returned.
+    """
+
     status_filter_query: list[ColumnElement[bool]] = []
     for status in status_filter:
         status_filter_query.append(Order.status == status)
 
+    # load the items and their options of every order in the list with one
+    # query each instead of lazy loading them per order
+    eager_load_items = selectinload(Order.items).selectinload(
+        OrderItem.options
+    )
+
     match role:
         case Role.CUSTOMER:
+            owner_filter = Order.customer_id == user_id
 
-            return (
-                state.session.query(Order)
-                .filter(
-                    (Order.customer_id == user_id)
-                    & (
-                        or_(false(), *status_filter_query)
-                        if len(status_filter_query) != 0
-                        else True
-                    )
-                    & (
-                        Order.restaurant_id == restaurant_id_filter
-                        if restaurant_id_filter is not None
-                        else True
-                    )
-                )
-                .all()
+        case Role.MERCHANT:
+            owner_filter = (Restaurant.merchant_id == user_id) & (
+                Order.restaurant_id == Restaurant.id
             )
 
-        case Role.MERCHANT:
-            return (
-                state.session.query(Order)
-                .filter(
-                    (Restaurant.merchant_id == user_id)
-                    & (Order.restaurant_id == Restaurant.id)
-                    & (
-                        or_(false(), *status_filter_query)
-                        if len(status_filter_query) != 0
-                        else True
-                    )
-                    & (
-                        Order.restaurant_id == restaurant_id_filter
-                        if restaurant_id_filter is not None
-                        else True
-                    )
-                )
-                .all()
+    # keyset pagination, seek past the last order of the previous page
+    # instead of counting the skipped rows
+    after_filter: ColumnElement[bool] | bool = True
+    if after_id is not None:
+        # the cursor must be one of the user's orders, anything else would
+        # silently end the listing
+        after_ordered_at = state.session.scalar(
+            select(Order.ordered_at).filter(
+                (Order.id == after_id) & owner_filter
+            )
+        )
+
+        if after_ordered_at is None:
+            raise InvalidArgumentError(
+                f"after_id {after_id} is not one of the listed orders"
             )
 
+        after_filter = tuple_(Order.ordered_at, Order.id) > tuple_(
+            after_ordered_at, after_id
+        )
+
+    query = (
+        state.session.query(Order)
+        .options(eager_load_items)
+        .filter(
+            owner_filter
+            & (
+                or_(false(), *status_filter_query)
+                if len(status_filter_query) != 0
+                else True
+            )
+            & (
+                Order.restaurant_id == restaurant_id_filter
+                if restaurant_id_filter is not None
+                else True
+            )
+            & (
+                Order.ordered_at >= ordered_after
+                if ordered_after is not None
+                else True
+            )
+            & (
+                Order.ordered_at < ordered_before
+                if ordered_before is not None
+                else True
+            )
+            & after_filter
+        )
+        .order_by(Order.ordered_at, Order.id)
+    )
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query.all()
+
 
 async def get_order_with_validation(
     state: State,
@@ -355,59 +416,247 @@ async def get_order_status(
     return await get_order_status_no_validation(state, order)
 
 
-async def _on_order_event(event: Event, state: State, order: Order):
+async def _on_order_event(
+    event: Event,
+    state: State,
+    order: Order,
+    notifier: QueueChangeNotifier | None = None,
+):
+    await _notify_status_change(event, state, order)
+    await _notify_queue_change(event, state, order.restaurant_id, notifier)
+
+
+async def _notify_status_change(
+    event: Event, state: State, order: Order, merchant_id: int | None = None
+):
+    """
+    Notifies both parties of the order about its status. The `merchant_id`
+    of the restaurant is looked up unless it's given.
+    """
+
     owner_customer_id = order.customer_id
-    owner = (
-        state.session.query(Restaurant)
-        .filter(Restaurant.id == order.restaurant_id)
-        .first()
-    )
 
-    if not owner:
-        raise InternalServerError("can't find the merchant for the restaurant")
+    if merchant_id is None:
+        merchant_id = state.session.scalar(
+            select(Restaurant.merchant_id).where(
+                Restaurant.id == order.restaurant_id
+            )
+        )
 
+        if merchant_id is None:
+            raise InternalServerError(
+                "can't find the merchant for the restaurant"
+            )
 
-    await event.add_notification(
-        User(user_id=owner_customer_id, role=Role.CUSTOMER),
-        OrderStatusChangeNotification(
-            order_id=order.id,
-            status=await get_order_status_no_validation(state, order),
-        ),
+    # the same instance for both, the event serializes it once
+    notification = OrderStatusChangeNotification(
+        order_id=order.id,
+        status=await get_order_status_no_validation(state, order),
     )
 
     await event.add_notification(
-        User(user_id=owner.merchant_id, role=Role.MERCHANT),
-        OrderStatusChangeNotification(
-            order_id=order.id,
-            status=await get_order_status_no_validation(state, order),
-        ),
+        User(user_id=owner_customer_id, role=Role.CUSTOMER), notification
     )
-
-    # queue change notificatioion
-
-    # get on going orders in the restaurant
-    ongoing_orders = (
-        state.session.query(Order)
-        .filter(
-            (Order.restaurant_id == order.restaurant_id)
-            & (
-                (Order.status == OrderStatusFlag.ORDERED)
-                | (Order.status == OrderStatusFlag.PREPARING)
-            )
-        )
-        .all()
+    await event.add_notification(
+        User(user_id=merchant_id, role=Role.MERCHANT), notification
     )
 
-    for ongoing_order in ongoing_orders:
-        customer_id = ongoing_order.customer_id
+
+def __queue_sender(event: Event) -> QueueSender:
+    async def send(queued_order: QueuedOrder, queue: Queue) -> None:
         await event.add_notification(
-            User(user_id=customer_id, role=Role.CUSTOMER),
+            User(user_id=queued_order.customer_id, role=Role.CUSTOMER),
             OrderQueueChangeNotification(
-                order_id=ongoing_order.id,
-                queue=await get_order_queue_no_validation(state, ongoing_order),
+                order_id=queued_order.order_id, queue=queue
+            ),
+        )
+
+    return send
+
+
+def __queue_broadcaster(event: Event) -> QueueBroadcaster:
+    async def broadcast(
+        restaurant_id: int, queues: list[tuple[QueuedOrder, Queue]]
+    ) -> None:
+        await event.publish(
+            restaurant_queue_topic(restaurant_id),
+            RestaurantQueueNotification(
+                restaurant_id=restaurant_id,
+                orders=[
+                    QueueEntry(
+                        order_id=queued_order.order_id,
+                        prep_time=queued_order.prep_time,
+                    )
+                    for queued_order, _ in queues
+                ],
             ),
         )
 
+    return broadcast
+
+
+async def authorize_queue_subscriptions(
+    state: State, user_id: int, role: Role, restaurant_ids: list[int]
+) -> None:
+    """
+    Checks that the user may subscribe to the queues of the restaurants,
+    which carry the IDs of their active orders: a merchant to the queues of
+    its own restaurants, a customer to the queues it has an active order in.
+    """
+
+    if not restaurant_ids:
+        return
+
+    match role:
+        case Role.MERCHANT:
+            allowed = set(
+                state.session.scalars(
+                    select(Restaurant.id).where(
+                        Restaurant.id.in_(restaurant_ids)
+                        & (Restaurant.merchant_id == user_id)
+                    )
+                )
+            )
+
+        case Role.CUSTOMER:
+            allowed = set(
+                state.session.scalars(
+                    select(Order.restaurant_id)
+                    .where(
+                        Order.restaurant_id.in_(restaurant_ids)
+                        & (Order.customer_id == user_id)
+                        # active orders are never archived
+                        & Order.archived.is_(False)
+                        & Order.status.in_(ACTIVE_ORDER_STATUSES)
+                    )
+                    .distinct()
+                )
+            )
+
+    for restaurant_id in restaurant_ids:
+        if restaurant_id not in allowed:
+            raise UnauthorizedError(
+                f"can't subscribe to the queue of restaurant {restaurant_id}"
+            )
+
+
+async def _notify_queue_change(
+    event: Event,
+    state: State,
+    restaurant_id: int,
+    notifier: QueueChangeNotifier | None = None,
+):
+    """
+    Notifies the customers waiting in the queue of the restaurant, each of
+    them and/or all at once through the topic of the restaurant depending on
+    `state.queue_notifications`. With a `notifier`, the change is coalesced
+    with the other changes of the restaurant and only the customers whose
+    queue changed are notified.
+    """
+
+    send = (
+        __queue_sender(event)
+        if state.queue_notifications != QueueNotifications.RESTAURANTS
+        else None
+    )
+    broadcast = (
+        __queue_broadcaster(event)
+        if state.queue_notifications != QueueNotifications.ORDERS
+        else None
+    )
+
+    if notifier is not None:
+        notifier.mark_changed(restaurant_id, send, broadcast)
+        return
+
+    # the queues of all the ongoing orders of the restaurant are computed in
+    # a single pass over the queue engine
+    queues = state.queues.queues_of_orders(
+        state.session, state.catalog, restaurant_id
+    )
+
+    if broadcast is not None:
+        await broadcast(restaurant_id, queues)
+
+    if send is not None:
+        for queued_order, queue in queues:
+            await send(queued_order, queue)
+
+
+@dataclass(frozen=True)
+class _Transition:
+    """
+    A status change of an order that a role may request.
+
+    :param from_statuses: the statuses the order may be in for the change to
+        be applied, empty if the change is never allowed.
+    :param error: the error message when the order is in any other status.
+    :param values: the columns to set alongside the new status, computed from
+        the update and the current time.
+    """
+
+    from_statuses: tuple[OrderStatusFlag, ...]
+    error: str
+    values: Callable[[Any, int], dict[str, Any]] = lambda _, __: {}
+
+
+_NOT_ALLOWED_FOR_CUSTOMER = _Transition(
+    (), "only cancellation or settled are allowed"
+)
+
+_TRANSITIONS: dict[tuple[Role, OrderStatusFlag], _Transition] = {
+    # still can cancel the order
+    (Role.CUSTOMER, OrderStatusFlag.CANCELLED): _Transition(
+        (OrderStatusFlag.ORDERED,),
+        "order can't be cancelled anymore",
+        lambda status, now: {
+            "cancelled_time": now,
+            "cancelled_by": OrderCancelledBy.CUSTOMER,
+            "cancelled_reason": status.reason,
+        },
+    ),
+    (Role.CUSTOMER, OrderStatusFlag.SETTLED): _Transition(
+        (OrderStatusFlag.READY,),
+        "order can only be settled when it's ready",
+        lambda _, now: {"settled_at": now},
+    ),
+    (Role.CUSTOMER, OrderStatusFlag.PREPARING): _NOT_ALLOWED_FOR_CUSTOMER,
+    (Role.CUSTOMER, OrderStatusFlag.READY): _NOT_ALLOWED_FOR_CUSTOMER,
+    (Role.MERCHANT, OrderStatusFlag.PREPARING): _Transition(
+        (OrderStatusFlag.ORDERED,),
+        "order can be prepared only once",
+        lambda _, now: {"prepared_at": now},
+    ),
+    (Role.MERCHANT, OrderStatusFlag.READY): _Transition(
+        (OrderStatusFlag.PREPARING,),
+        "order can be ready after it's prepared",
+        lambda _, now: {"ready_at": now},
+    ),
+    (Role.MERCHANT, OrderStatusFlag.CANCELLED): _Transition(
+        (OrderStatusFlag.ORDERED, OrderStatusFlag.PREPARING),
+        "order can't be cancelled anymore",
+        lambda status, now: {
+            "cancelled_time": now,
+            "cancelled_by": OrderCancelledBy.MERCHANT,
+            "cancelled_reason": status.reason,
+        },
+    ),
+    (Role.MERCHANT, OrderStatusFlag.SETTLED): _Transition(
+        (), "order can't be settled by merchant"
+    ),
+}
+
+
+def _owner_filter(user_id: int, role: Role) -> ColumnElement[bool]:
+    match role:
+        case Role.CUSTOMER:
+            return Order.customer_id == user_id
+
+        case Role.MERCHANT:
+            return Order.restaurant_id.in_(
+                select(Restaurant.id).where(Restaurant.merchant_id == user_id)
+            )
+
 
 async def update_order_status(
     state: State,
@@ -416,96 +665,196 @@ async def update_order_status(
     role: Role,
     order_id: int,
     status: OrderStatusUpdate,
+    notifier: QueueChangeNotifier | None = None,
 ) -> None:
-    order = await get_order_with_validation(state, user_id, role, order_id)
+    """
+    Applies the status change as a single conditional `UPDATE`, so two
+    concurrent requests can't both move the order out of the same status.
 
-    match role, order.status, status:
-        # still can cancel the order
-        case Role.CUSTOMER, OrderStatusFlag.ORDERED, CancelledOrderUpdate():
-            state.session.add(
-                CancelledOrder(
-                    order_id=order.id,
-                    cancelled_time=int(time.time()),
-                    cancelled_by=OrderCancelledBy.CUSTOMER,
-                    reason=status.reason,
-                )
-            )
-            order.status = OrderStatusFlag.CANCELLED
+    The order row is locked with `SKIP LOCKED`; a request that finds the row
+    locked by another status change, which it would otherwise be allowed to
+    make, lost the race and gets a `ConflictingError`.
+    """
 
-            state.session.commit()
-            await _on_order_event(event, state, order)
+    transition = _TRANSITIONS[(role, status.type)]
 
-        case Role.CUSTOMER, OrderStatusFlag.READY, SettledOrderUpdate():
-            state.session.add(
-                SettledOrder(order_id=order.id, settled_at=int(time.time()))
-            )
-            order.status = OrderStatusFlag.SETTLED
+    if not transition.from_statuses:
+        await get_order_with_validation(state, user_id, role, order_id)
 
-            state.session.commit()
-            await _on_order_event(event, state, order)
+        raise InvalidArgumentError(transition.error)
 
-        case Role.CUSTOMER, _, CancelledOrderUpdate():
-            raise InvalidArgumentError("order can't be cancelled anymore")
+    # ongoing orders are never archived, only touch the hot partition
+    transitionable = (
+        (Order.id == order_id)
+        & Order.archived.is_(False)
+        & _owner_filter(user_id, role)
+        & Order.status.in_(transition.from_statuses)
+    )
 
-        case Role.CUSTOMER, _, SettledOrderUpdate():
-            raise InvalidArgumentError(
-                "order can only be settled when it's ready"
-            )
+    order = state.session.scalars(
+        update(Order)
+        .where(
+            transitionable,
+            Order.id
+            == select(Order.id)
+            .where(transitionable)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery(),
+        )
+        .values(
+            status=status.type,
+            **transition.values(status, int(time.time())),
+        )
+        .returning(Order)
+        .execution_options(populate_existing=True)
+    ).first()
 
-        case Role.CUSTOMER, _, _:
-            raise InvalidArgumentError(
-                "only cancellation or settled are allowed"
-            )
+    if not order:
+        state.session.rollback()
 
-        case Role.MERCHANT, OrderStatusFlag.ORDERED, PreparingOrderUpdate():
-            state.session.add(
-                PreparingOrder(order_id=order.id, prepared_at=int(time.time()))
-            )
-            order.status = OrderStatusFlag.PREPARING
+        # find out why the order couldn't be updated
+        current = await get_order_with_validation(
+            state, user_id, role, order_id
+        )
 
-            state.session.commit()
-            await _on_order_event(event, state, order)
+        if current.status in transition.from_statuses:
+            raise ConflictingError("order is being updated by another request")
 
-        case Role.MERCHANT, _, PreparingOrderUpdate():
-            raise InvalidArgumentError("order can be prepared only once")
+        raise InvalidArgumentError(transition.error)
 
-        case Role.MERCHANT, OrderStatusFlag.PREPARING, ReadyOrderUpdate():
-            state.session.add(
-                ReadyOrder(order_id=order.id, ready_at=int(time.time()))
-            )
-            order.status = OrderStatusFlag.READY
+    state.session.commit()
 
-            state.session.commit()
-            await _on_order_event(event, state, order)
+    if order.status not in ACTIVE_ORDER_STATUSES:
+        state.queues.remove(order.restaurant_id, order.id)
 
-        case Role.MERCHANT, _, ReadyOrderUpdate():
-            raise InvalidArgumentError(
-                "order can be ready after it's prepared"
-            )
+    await _on_order_event(event, state, order, notifier)
 
-        case (
-            Role.MERCHANT,
-            (OrderStatusFlag.PREPARING | OrderStatusFlag.ORDERED),
-            CancelledOrderUpdate(),
-        ):
-            state.session.add(
-                CancelledOrder(
-                    order_id=order.id,
-                    cancelled_time=int(time.time()),
-                    cancelled_by=OrderCancelledBy.MERCHANT,
-                    reason=status.reason,
+
+async def update_order_statuses(
+    state: State,
+    event: Event,
+    merchant_id: int,
+    updates: list[OrderStatusBulkUpdate],
+    notifier: QueueChangeNotifier | None = None,
+) -> list[OrderStatusBulkUpdateResult]:
+    """
+    Applies the status changes of many orders of the merchant at once.
+
+    The ownership and the current statuses are read in one query, the
+    changes are applied in one transaction with one conditional `UPDATE` per
+    kind of change, and the notifications are sent once all of them are
+    committed, with one round of queue notifications per restaurant.
+
+    :param updates: the status changes, an order can appear only once.
+    :return: whether each change was applied, in the order of `updates`.
+    """
+
+    owned_statuses: dict[int, tuple[bool, OrderStatusFlag]] = {
+        order_id: (owned, status)
+        for order_id, owned, status in state.session.execute(
+            select(
+                Order.id,
+                _owner_filter(merchant_id, Role.MERCHANT),
+                Order.status,
+            ).where(
+                Order.id.in_(
+                    {status_update.order_id for status_update in updates}
                 )
             )
-            order.status = OrderStatusFlag.CANCELLED
-
-            state.session.commit()
-            await _on_order_event(event, state, order)
-
-        case (Role.MERCHANT, _, CancelledOrderUpdate()):
-            raise InvalidArgumentError("order can't be cancelled anymore")
+        )
+    }
+
+    errors: list[str | None] = [None] * len(updates)
+    seen_order_ids: set[int] = set()
+
+    # the indices of the changes that set the same values
+    groups: dict[
+        tuple[OrderStatusFlag, tuple[tuple[str, Any], ...]], list[int]
+    ] = {}
+    now = int(time.time())
+
+    for i, status_update in enumerate(updates):
+        order_id = status_update.order_id
+        transition = _TRANSITIONS[(Role.MERCHANT, status_update.status.type)]
+
+        if order_id in seen_order_ids:
+            errors[i] = "order can only be updated once per request"
+            continue
+
+        seen_order_ids.add(order_id)
+
+        if order_id not in owned_statuses:
+            errors[i] = f"order with id {order_id} not found"
+            continue
+
+        owned, current_status = owned_statuses[order_id]
+
+        if not owned:
+            errors[i] = "merchant does not own the order"
+        elif current_status not in transition.from_statuses:
+            errors[i] = transition.error
+        else:
+            values = transition.values(status_update.status, now)
+            groups.setdefault(
+                (status_update.status.type, tuple(sorted(values.items()))), []
+            ).append(i)
+
+    updated_orders: list[Order] = []
+
+    for (target_status, values), indices in groups.items():
+        transition = _TRANSITIONS[(Role.MERCHANT, target_status)]
+        transitionable = (
+            Order.id.in_([updates[i].order_id for i in indices])
+            & Order.archived.is_(False)
+            & _owner_filter(merchant_id, Role.MERCHANT)
+            & Order.status.in_(transition.from_statuses)
+        )
 
-        case Role.MERCHANT, _, SettledOrderUpdate():
-            raise InvalidArgumentError("order can't be settled by merchant")
+        group_orders = state.session.scalars(
+            update(Order)
+            .where(
+                transitionable,
+                Order.id.in_(
+                    select(Order.id)
+                    .where(transitionable)
+                    .with_for_update(skip_locked=True)
+                ),
+            )
+            .values(status=target_status, **dict(values))
+            .returning(Order)
+            .execution_options(populate_existing=True)
+        ).all()
+        updated_orders.extend(group_orders)
+
+        # the rest were changed by a concurrent request in the meantime
+        updated_order_ids = {order.id for order in group_orders}
+
+        for i in indices:
+            if updates[i].order_id not in updated_order_ids:
+                errors[i] = "order is being updated by another request"
+
+    state.session.commit()
+
+    for order in updated_orders:
+        if order.status not in ACTIVE_ORDER_STATUSES:
+            state.queues.remove(order.restaurant_id, order.id)
+
+    # the merchant owns all the updated orders, its restaurants aren't read
+    # again for each of them
+    for order in updated_orders:
+        await _notify_status_change(event, state, order, merchant_id)
+
+    for restaurant_id in {order.restaurant_id for order in updated_orders}:
+        await _notify_queue_change(event, state, restaurant_id, notifier)
+
+    return [
+        OrderStatusBulkUpdateResult(
+            order_id=status_update.order_id,
+            success=error is None,
+            error=error,
+        )
+        for status_update, error in zip(updates, errors)
+    ]
 
 
 async def get_order_queue(
@@ -520,19 +869,19 @@ async def get_restaurant_queue(
     state: State,
     restaurant_id: int,
 ) -> Queue:
-    orders = (
-        state.session.query(Order)
-        .filter(
-            (Order.restaurant_id == restaurant_id)
-            & (
-                (Order.status == OrderStatusFlag.ORDERED)
-                | (Order.status == OrderStatusFlag.PREPARING)
-            )
-        )
-        .all()
+    return state.queues.restaurant_queue(
+        state.session, state.catalog, restaurant_id
     )
 
-    return __calculate_queue_from_prior_orders(state, orders)
+
+async def get_order_queue_no_validation(state: State, order: Order) -> Queue:
+    return state.queues.order_queue(
+        state.session,
+        state.catalog,
+        order.restaurant_id,
+        order.ordered_at,
+        order.id,
+    )
 
 
 def __calculate_queue_from_prior_orders(
@@ -541,38 +890,377 @@ def __calculate_queue_from_prior_orders(
     estimated_time = 0
 
     for prior_order in prior_orders:
-        for order_item in prior_order.items:
-            menu = (
-                state.session.query(Menu)
-                .filter(Menu.id == order_item.menu_id)
-                .first()
-            )
+        catalog = state.catalog.get(state.session, prior_order.restaurant_id)
+        estimated_time += estimate_prep_time(catalog, prior_order.items)
 
-            if not menu:
-                raise InternalServerError(
-                    "can't find the menu for the order item"
-                )
+    return Queue(queue_count=len(prior_orders), estimated_time=estimated_time)
 
-            estimated_time += (
-                menu.estimated_prep_time if menu.estimated_prep_time else 1
-            ) * order_item.quantity
 
-    return Queue(queue_count=len(prior_orders), estimated_time=estimated_time)
+def __query_active_orders(state: State, restaurant_id: int) -> Query[Order]:
+    return state.session.query(Order).filter(
+        (Order.restaurant_id == restaurant_id)
+        # active orders are never archived, only scan the hot partition
+        & Order.archived.is_(False)
+        & Order.status.in_(ACTIVE_ORDER_STATUSES)
+    )
 
 
-async def get_order_queue_no_validation(state: State, order: Order) -> Queue:
+async def compute_restaurant_queue(state: State, restaurant_id: int) -> Queue:
+    """
+    Computes the queue of the restaurant from the orders in the database,
+    without the queue engine.
+    """
+
+    return __calculate_queue_from_prior_orders(
+        state, __query_active_orders(state, restaurant_id).all()
+    )
+
+
+async def compute_order_queue(state: State, order: Order) -> Queue:
+    """
+    Computes the queue in front of the order from the orders in the
+    database, without the queue engine.
+    """
+
     prior_orders = (
-        state.session.query(Order)
+        __query_active_orders(state, order.restaurant_id)
         .filter(
-            (Order.restaurant_id == order.restaurant_id)
-            & (Order.ordered_at <= order.ordered_at)
-            & (Order.id < order.id)
-            & (
-                (Order.status == OrderStatusFlag.ORDERED)
-                | (Order.status == OrderStatusFlag.PREPARING)
-            )
+            tuple_(Order.ordered_at, Order.id)
+            < tuple_(order.ordered_at, order.id)
         )
         .all()
     )
 
     return __calculate_queue_from_prior_orders(state, prior_orders)
+
+
+def __prep_times(
+    scope: ColumnElement[bool], order_id: int | None = None
+) -> Subquery:
+    """
+    The estimated time to prepare each active order matching `scope`, along
+    with whether it's `queued`.
+
+    :param order_id: an order to include even if it's no longer active.
+    """
+
+    queued = Order.status.in_(ACTIVE_ORDER_STATUSES)
+
+    # active orders are never archived, only scan the hot partition
+    active = queued & Order.archived.is_(False)
+
+    prep_times = (
+        select(
+            Order.id,
+            Order.restaurant_id,
+            Order.ordered_at,
+            queued.label("queued"),
+            # a menu without a preparation time counts as one
+            func.coalesce(
+                func.sum(
+                    func.coalesce(func.nullif(Menu.estimated_prep_time, 0), 1)
+                    * OrderItem.quantity
+                ),
+                0,
+            ).label("prep_time"),
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Menu, Menu.id == OrderItem.menu_id)
+        .where(
+            scope
+            & (
+                active | (Order.id == order_id)
+                if order_id is not None
+                else active
+            )
+        )
+        .group_by(
+            Order.id, Order.restaurant_id, Order.ordered_at, Order.status
+        )
+        .subquery()
+    )
+
+    return prep_times
+
+
+def __query_window_queues(
+    state: State,
+    scope: ColumnElement[bool],
+    order_id: int | None = None,
+) -> dict[int, Queue]:
+    """
+    Computes the queue in front of every active order matching `scope` in a
+    single query, with window functions over the orders of each restaurant.
+
+    :param order_id: an order to compute the queue of even if it's no
+        longer active; the orders after it don't count it.
+    """
+
+    prep_times = __prep_times(scope, order_id)
+
+    # the orders of the same restaurant placed before each order; the
+    # requested order that's no longer active is left out of the sums
+    prior_orders = {
+        "partition_by": prep_times.c.restaurant_id,
+        "order_by": (prep_times.c.ordered_at, prep_times.c.id),
+        "rows": (None, -1),
+    }
+
+    rows = state.session.execute(
+        select(
+            prep_times.c.id,
+            prep_times.c.queued,
+            func.count(case((prep_times.c.queued, 1))).over(**prior_orders),
+            func.coalesce(
+                func.sum(
+                    case(
+                        (prep_times.c.queued, prep_times.c.prep_time), else_=0
+                    )
+                ).over(**prior_orders),
+                0,
+            ),
+        )
+    )
+
+    return {
+        id: Queue(queue_count=queue_count, estimated_time=int(estimated_time))
+        for id, queued, queue_count, estimated_time in rows
+        if queued or id == order_id
+    }
+
+
+async def compute_order_queue_with_window(state: State, order: Order) -> Queue:
+    """
+    Computes the queue in front of the order in a single query, see
+    `compute_restaurant_order_queues`.
+    """
+
+    return __query_window_queues(
+        state, Order.restaurant_id == order.restaurant_id, order.id
+    )[order.id]
+
+
+async def compute_restaurant_order_queues(
+    state: State, restaurant_id: int
+) -> dict[int, Queue]:
+    """
+    Computes the queue in front of every active order of the restaurant in
+    a single query, without the queue engine.
+
+    :return: the queues keyed by the order IDs.
+    """
+
+    return __query_window_queues(state, Order.restaurant_id == restaurant_id)
+
+
+async def compute_canteen_queues(
+    state: State, canteen_id: int
+) -> list[CanteenQueue]:
+    """
+    Computes the queue of every restaurant in the canteen in a single query,
+    without the queue engine, see `get_canteen_queues`.
+
+    :return: the queues ordered by the restaurant IDs.
+    """
+
+    prep_times = __prep_times(
+        Order.restaurant_id.in_(
+            select(Restaurant.id).where(Restaurant.canteen_id == canteen_id)
+        )
+    )
+
+    rows = state.session.execute(
+        select(
+            Restaurant.id,
+            func.count(prep_times.c.id),
+            func.coalesce(func.sum(prep_times.c.prep_time), 0),
+        )
+        .outerjoin(prep_times, prep_times.c.restaurant_id == Restaurant.id)
+        .where(Restaurant.canteen_id == canteen_id)
+        .group_by(Restaurant.id)
+        .order_by(Restaurant.id)
+    )
+
+    return [
+        CanteenQueue(
+            restaurant_id=restaurant_id,
+            queue=Queue(
+                queue_count=queue_count, estimated_time=int(estimated_time)
+            ),
+        )
+        for restaurant_id, queue_count, estimated_time in rows
+    ]
+
+
+async def check_queue_consistency(
+    state: State, restaurant_id: int
+) -> list[str]:
+    """
+    Compares the queues of the restaurant and of each of its active orders
+    kept by the queue engine and computed with window functions with the ones
+    computed from the orders in the database.
+
+    :return: the description of every mismatch, empty if they all agree.
+    """
+
+    mismatches: list[str] = []
+
+    engine_queue = await get_restaurant_queue(state, restaurant_id)
+    database_queue = await compute_restaurant_queue(state, restaurant_id)
+
+    if engine_queue != database_queue:
+        mismatches.append(
+            f"restaurant {restaurant_id}: engine {engine_queue!r}, "
+            f"database {database_queue!r}"
+        )
+
+    window_queues = await compute_restaurant_order_queues(state, restaurant_id)
+    fanned_out_queues = {
+        queued_order.order_id: queue
+        for queued_order, queue in state.queues.queues_of_orders(
+            state.session, state.catalog, restaurant_id
+        )
+    }
+
+    for order in __query_active_orders(state, restaurant_id):
+        engine_queue = await get_order_queue_no_validation(state, order)
+        database_queue = await compute_order_queue(state, order)
+
+        if engine_queue != database_queue:
+            mismatches.append(
+                f"order {order.id}: engine {engine_queue!r}, "
+                f"database {database_queue!r}"
+            )
+
+        window_queue = window_queues.pop(order.id, None)
+
+        if window_queue != database_queue:
+            mismatches.append(
+                f"order {order.id}: window {window_queue!r}, "
+                f"database {database_queue!r}"
+            )
+
+        fanned_out_queue = fanned_out_queues.pop(order.id, None)
+
+        if fanned_out_queue != database_queue:
+            mismatches.append(
+                f"order {order.id}: fan-out {fanned_out_queue!r}, "
+                f"database {database_queue!r}"
+            )
+
+    for order_id in fanned_out_queues.keys() | window_queues.keys():
+        mismatches.append(f"order {order_id}: not active in the database")
+
+    return mismatches
+
+
+ARCHIVE_BATCH_SIZE = 1000
+"""The default number of orders moved to the archive in one transaction."""
+
+
+def __monthly_ranges(first: int, last: int) -> list[tuple[datetime, datetime]]:
+    """The calendar months (in UTC) covering the two timestamps."""
+
+    start = datetime.fromtimestamp(first, timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    end = datetime.fromtimestamp(last, timezone.utc)
+
+    ranges: list[tuple[datetime, datetime]] = []
+
+    while start <= end:
+        if start.month == 12:
+            next_start = start.replace(year=start.year + 1, month=1)
+        else:
+            next_start = start.replace(month=start.month + 1)
+
+        ranges.append((start, next_start))
+        start = next_start
+
+    return ranges
+
+
+async def archive_finished_orders(
+    state: State, older_than: int, batch_size: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """
+    Moves the settled and cancelled orders placed more than `older_than`
+    seconds ago from the hot partition of `orders` to the monthly archive
+    partitions, creating the missing partitions first.
+
+    Each missing partition is created and committed on its own, since the
+    DDL locks the whole `orders` table; the orders are then moved in
+    batches of `batch_size`, one transaction each, so the reads and the
+    status changes wait for a batch at most.
+
+    :return: The number of archived orders.
+    """
+
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    finished = (
+        Order.archived.is_(False)
+        & Order.status.in_(
+            [OrderStatusFlag.SETTLED, OrderStatusFlag.CANCELLED]
+        )
+        & (Order.ordered_at < int(time.time()) - older_than)
+    )
+
+    first, last = state.session.execute(
+        select(func.min(Order.ordered_at), func.max(Order.ordered_at)).filter(
+            finished
+        )
+    ).one()
+    state.session.commit()
+
+    if first is None or last is None:
+        return 0
+
+    for start, end in __monthly_ranges(first, last):
+        partition = f"orders_archive_{start.year:04}_{start.month:02}"
+
+        # the existing partitions aren't locked at all
+        if state.session.scalar(select(func.to_regclass(partition))) is None:
+            state.session.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {partition} "
+                    f"PARTITION OF orders_archive FOR VALUES "
+                    f"FROM ({int(start.timestamp())}) "
+                    f"TO ({int(end.timestamp())})"
+                )
+            )
+
+        state.session.commit()
+
+    archived = 0
+
+    while True:
+        # updating the partition keys of the orders' IDs cascades to the
+        # orders and moves them to the archive partitions; only the orders
+        # covered by the partitions created above are moved, the ones
+        # locked by a status change are left for the next run
+        batch = (
+            select(Order.id)
+            .where(
+                finished
+                & (Order.ordered_at >= first)
+                & (Order.ordered_at <= last)
+            )
+            .order_by(Order.ordered_at, Order.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+        moved = state.session.execute(
+            update(OrderId)
+            .where(OrderId.id.in_(batch))
+            .values(archived=True)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        state.session.commit()
+
+        archived += moved
+
+        if moved < batch_size:
+            return archived
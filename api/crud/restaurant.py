@@ -1,6 +1,7 @@
 from fastapi import UploadFile
 from fastapi.responses import FileResponse
 
+from api.catalog import CustomizationEntry, MenuEntry
 from api.configuration import Configuration
 from api.crud.merchant import get_merchant
 from api.errors import ConflictingError, InvalidArgumentError, NotFoundError
@@ -204,6 +205,8 @@ async def create_menu(
     state.session.add(new_menu)
     state.session.commit()
 
+    state.catalog.invalidate(restaurant_id)
+
     state.session.refresh(new_menu)
 
     return new_menu.id  # type:ignore
@@ -232,22 +235,22 @@ async def update_menu(state: State, menu_id: int, menu: MenuCreate) -> int:
     existing_menu.estimated_prep_time = menu.estimated_prep_time
 
     state.session.commit()
+    state.catalog.invalidate(existing_menu.restaurant_id)
+
+    # the queued orders of the menu might take a different time now
+    state.queues.invalidate(existing_menu.restaurant_id)
+
     return existing_menu
 
 
 async def get_restaurant_menus(
     state: State,
     restaurant_id: int,
-) -> list[Menu]:
+) -> list[MenuEntry]:
     """Get all menus for a restaurant."""
-    # check if the restaurant exists
-    menus = (
-        state.session.query(Menu)
-        .filter(Menu.restaurant_id == restaurant_id)
-        .all()
-    )
+    catalog = state.catalog.get(state.session, restaurant_id)
 
-    return menus
+    return list(catalog.menus.values())
 
 
 async def upload_menu_image(
@@ -273,6 +276,8 @@ async def upload_menu_image(
     menu.image = image_path  # type:ignore
     state.session.commit()
 
+    state.catalog.invalidate(restaurant.id)
+
     return image_path
 
 
@@ -363,22 +368,22 @@ async def create_customization(
 
     state.session.commit()
 
+    state.catalog.invalidate(restaurant.id)
+
     return id
 
 
 async def get_menu_customizations(
     state: State,
     menu_id: int,
-) -> list[Customization]:
+) -> list[CustomizationEntry]:
     """Get all customizations for a menu."""
-    # check if the menu exists
+    menu = state.catalog.get_menu(state.session, menu_id)
 
-    customizations = (
-        state.session.query(Customization)
-        .filter(Customization.menu_id == menu_id)
-        .all()
-    )
-    return customizations
+    if not menu:
+        return []
+
+    return list(menu.customizations)
 
 
 async def get_restaurant_reviews(
@@ -1,12 +1,21 @@
+from fastapi import Depends
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
 from api.event import Event
 
 _event: None | Event = None
 
 
-def get_event() -> Event:
+def get_event(
+    configuration: Configuration = Depends(get_configuration),
+) -> Event:
     global _event
 
     if _event is None:
-        _event = Event()
+        _event = Event(
+            bus=configuration.event_bus,
+            buffer_size=configuration.listener_buffer_size,
+            overflow_policy=configuration.listener_overflow_policy,
+        )
 
     return _event
@@ -59,6 +59,10 @@ class GetID:
 get_customer_id = GetID("customer_id")
 get_merchant_id = GetID("merchant_id")
 
+# there are no administrator accounts, the tokens are issued to the
+# operators with `python -m api.admin_token`
+get_admin_id = GetID("admin_id")
+
 
 class Role(Enum):
     """The user role enumeration."""
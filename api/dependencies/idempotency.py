@@ -0,0 +1,12 @@
+from fastapi import Depends
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.idempotency import IdempotencyStore
+
+
+def get_idempotency_store(
+    configuration: Configuration = Depends(get_configuration),
+) -> IdempotencyStore:
+    """Use this dependency to get the `IdempotencyStore` object"""
+
+    return configuration.idempotency_store
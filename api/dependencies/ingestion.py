@@ -0,0 +1,12 @@
+from fastapi import Depends
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.ingestion import OrderIngestion
+
+
+def get_order_ingestion(
+    configuration: Configuration = Depends(get_configuration),
+) -> OrderIngestion | None:
+    """Use this dependency to get the `OrderIngestion` object, if enabled"""
+
+    return configuration.order_ingestion
@@ -0,0 +1,12 @@
+from fastapi import Depends
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.queues import QueueChangeNotifier
+
+
+def get_queue_change_notifier(
+    configuration: Configuration = Depends(get_configuration),
+) -> QueueChangeNotifier | None:
+    """Use this dependency to get the `QueueChangeNotifier`, if enabled"""
+
+    return configuration.queue_change_notifier
@@ -11,6 +11,11 @@ def get_state(
     session = configuration.create_session()
 
     try:
-        yield State(session=session)
+        yield State(
+            session=session,
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+            queue_notifications=configuration.queue_notifications,
+        )
     finally:
         session.close()
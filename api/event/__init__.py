@@ -1,10 +1,51 @@
-from typing import Generator
+from typing import Any, Generator
 from fastapi import Request
+from pydantic import TypeAdapter
+from api.bus import EventBus
 from api.dependencies.id import Role
-from api.schemas.event import Notification
+from api.schemas.event import (
+    Notification,
+    OrderQueueChangeNotification,
+    OverflowPolicy,
+    RestaurantQueueNotification,
+)
 
+from asyncio import Task
+from collections import OrderedDict, deque
 from dataclasses import dataclass
 from threading import Lock
+from uuid import uuid4
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_notification_adapter: TypeAdapter[Notification] = TypeAdapter(Notification)
+
+DISCONNECT_CHECK_INTERVAL = 15.0
+"""
+The default number of seconds a waiting listener sleeps before it checks
+whether its client has disconnected.
+"""
+
+BUFFER_SIZE = 256
+"""The default number of notifications a listener buffers."""
+
+REPLAY_WINDOW = 64
+"""The default number of the last deliveries kept for each user or topic."""
+
+REPLAY_USERS = 10000
+"""
+The default number of the users and the topics whose last deliveries are
+kept.
+"""
+
+REAP_INTERVAL = 60.0
+"""
+The default number of seconds between the checks of the reaper for the
+listeners whose client has disconnected.
+"""
 
 
 @dataclass(
@@ -22,19 +63,205 @@ class User:
     """The role of the listener."""
 
 
+def restaurant_queue_topic(restaurant_id: int) -> str:
+    """The topic the snapshots of the queue of the restaurant are sent to."""
+
+    return f"restaurant:{restaurant_id}:queue"
+
+
+@dataclass(frozen=True)
+class Delivery:
+    """A notification delivered to the listeners of a user or a topic."""
+
+    id: str
+    """
+    The ID of the SSE event, `epoch:sequence`. With a bus, the sequence is
+    the position of the notification on the bus and the ID is the same on
+    every worker. Without one, the sequence increases with every
+    notification delivered by the worker and the epoch changes when the
+    worker restarts.
+    """
+
+    notification: Notification
+    """The delivered notification."""
+
+    frame: bytes
+    """
+    The SSE frame of the delivery, encoded once and shared by all the
+    listeners of the user or the subscribers of the topic.
+    """
+
+
+def encode_frame(event_id: str, data: bytes) -> bytes:
+    """
+    Encodes an SSE event with the given ID and data, which mustn't contain
+    line breaks.
+    """
+
+    return b"id: " + event_id.encode() + b"\r\ndata: " + data + b"\r\n\r\n"
+
+
+def _supersedes(notification: Notification, buffered: Notification) -> bool:
+    # a newer queue of the same order or the same restaurant
+    match notification, buffered:
+        case (
+            OrderQueueChangeNotification(),
+            OrderQueueChangeNotification(),
+        ):
+            return notification.order_id == buffered.order_id
+
+        case (
+            RestaurantQueueNotification(),
+            RestaurantQueueNotification(),
+        ):
+            return notification.restaurant_id == buffered.restaurant_id
+
+    return False
+
+
+@dataclass
+class _History:
+    deliveries: deque[tuple[int, Delivery]]
+    # the sequence of the last delivery that no longer fits in the window
+    dropped_sequence: int = 0
+
+
+class BufferStatistics:
+    """The counters of the notification buffers, shared by the listeners."""
+
+    __mutex: Lock
+    __dropped: int
+    __collapsed: int
+    __disconnected: int
+    __high_water_mark: int
+
+    def __init__(self) -> None:
+        self.__mutex = Lock()
+        self.__dropped = 0
+        self.__collapsed = 0
+        self.__disconnected = 0
+        self.__high_water_mark = 0
+
+    def record_size(self, size: int) -> None:
+        with self.__mutex:
+            self.__high_water_mark = max(self.__high_water_mark, size)
+
+    def record_dropped(self) -> None:
+        with self.__mutex:
+            self.__dropped += 1
+
+    def record_collapsed(self) -> None:
+        with self.__mutex:
+            self.__collapsed += 1
+
+    def record_disconnected(self) -> None:
+        with self.__mutex:
+            self.__disconnected += 1
+
+    @property
+    def dropped(self) -> int:
+        """The number of notifications dropped from the full buffers."""
+
+        return self.__dropped
+
+    @property
+    def collapsed(self) -> int:
+        """
+        The number of queue changes dropped from the full buffers because a
+        newer one of the same order arrived.
+        """
+
+        return self.__collapsed
+
+    @property
+    def disconnected(self) -> int:
+        """The number of listeners disconnected for being too slow."""
+
+        return self.__disconnected
+
+    @property
+    def high_water_mark(self) -> int:
+        """The largest number of notifications a buffer has held."""
+
+        return self.__high_water_mark
+
+
 class Listener:
-    """Represents a listener to the event."""
+    """
+    Represents a listener to the event.
+
+    A waiting listener sleeps until a notification is added; it wakes up
+    every `disconnect_check_interval` seconds to check whether the client
+    is gone, so idle listeners cost no CPU in between.
+
+    The notifications wait in a buffer of at most `buffer_size`; once it's
+    full, the `overflow_policy` decides what's given up.
+    """
 
     __request: Request
-    __notifications: list[Notification]
+    __notifications: deque[Delivery]
     __mutex: Lock
     __user: User
+    __wakeup: asyncio.Event
+    __loop: asyncio.AbstractEventLoop | None
+    __disconnect_check_interval: float
+    __buffer_size: int
+    __overflow_policy: OverflowPolicy
+    __overflowed: bool
+    __statistics: BufferStatistics
+    __resync_required: bool
+    __position: str | None
+    __topics: tuple[str, ...]
+
+    def __init__(
+        self,
+        user: User,
+        request: Request,
+        disconnect_check_interval: float = DISCONNECT_CHECK_INTERVAL,
+        buffer_size: int = BUFFER_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.COLLAPSE,
+        statistics: BufferStatistics | None = None,
+        resync_required: bool = False,
+        position: str | None = None,
+        topics: tuple[str, ...] = (),
+    ) -> None:
+        """
+        :param user: The user the notifications are sent to.
+        :param request: The request of the SSE connection.
+        :param disconnect_check_interval: The number of seconds a waiting \
+            listener sleeps before it checks whether the client has \
+            disconnected.
+        :param buffer_size: The maximum number of notifications waiting to \
+            be sent.
+        :param overflow_policy: What's done with a new notification once \
+            the buffer is full.
+        :param statistics: The counters the buffer reports to.
+        :param resync_required: Whether the notifications the client missed \
+            before connecting are no longer kept.
+        :param position: The ID of the last delivery when the listener \
+            was created, if nothing is replayed to it.
+        :param topics: The topics the listener is subscribed to.
+        """
+
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
 
-    def __init__(self, user: User, request: Request) -> None:
         self.__request = request
-        self.__notifications = []
+        self.__notifications = deque()
         self.__mutex = Lock()
         self.__user = user
+        self.__wakeup = asyncio.Event()
+        self.__loop = None
+        self.__disconnect_check_interval = disconnect_check_interval
+        self.__buffer_size = buffer_size
+        self.__overflow_policy = overflow_policy
+        self.__overflowed = False
+        self.__statistics = (
+            statistics if statistics is not None else BufferStatistics()
+        )
+        self.__resync_required = resync_required
+        self.__position = position
+        self.__topics = topics
 
     async def is_disconnected(self) -> bool:
         """
@@ -43,87 +270,566 @@ class Listener:
 
         return await self.__request.is_disconnected()
 
-    def add_notification(self, notification: Notification) -> None:
+    def add_delivery(self, delivery: Delivery) -> None:
         """
-        Adds a notification to the listener.
+        Adds a delivery to the listener and wakes it up if it's waiting.
         """
 
         with self.__mutex:
-            self.__notifications.append(notification)
+            if self.__overflowed:
+                return
 
-    def __await__(self) -> Generator[None, None, Notification | None]:
-        while True:
-            is_disconnected = yield from self.is_disconnected().__await__()
+            if len(self.__notifications) >= self.__buffer_size:
+                self.__overflow(delivery.notification)
+
+            if not self.__overflowed:
+                self.__notifications.append(delivery)
+                self.__statistics.record_size(len(self.__notifications))
+
+            loop = self.__loop
+
+        # the listener hasn't waited yet, it checks the notifications first
+        if loop is None:
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is loop:
+            self.__wakeup.set()
+            return
+
+        # the event is bound to the loop of the listener
+        try:
+            loop.call_soon_threadsafe(self.__wakeup.set)
+        except RuntimeError:
+            # the loop is closed, nobody is waiting anymore
+            pass
+
+    def __overflow(self, notification: Notification) -> None:
+        match self.__overflow_policy:
+            case OverflowPolicy.DROP_OLDEST:
+                self.__notifications.popleft()
+                self.__statistics.record_dropped()
+
+            case OverflowPolicy.COLLAPSE:
+                for index, buffered in enumerate(self.__notifications):
+                    if _supersedes(notification, buffered.notification):
+                        del self.__notifications[index]
+                        self.__statistics.record_collapsed()
+                        return
+
+                self.__notifications.popleft()
+                self.__statistics.record_dropped()
+
+            case OverflowPolicy.DISCONNECT:
+                # the buffered notifications are of no use to a client that
+                # has to catch up anyway
+                self.__overflowed = True
+                self.__notifications.clear()
+                self.__statistics.record_disconnected()
+
+    async def next(self) -> Delivery | None:
+        """
+        Waits for the next delivery.
 
-            # if the connection is disconnected, return None.
-            if is_disconnected:
-                return None
+        :return: The delivery or `None` if the client has disconnected or \
+            has been disconnected for being too slow.
+        """
+
+        with self.__mutex:
+            self.__loop = asyncio.get_running_loop()
 
+        while True:
             with self.__mutex:
+                if self.__overflowed:
+                    return None
+
                 if self.__notifications:
-                    return self.__notifications.pop(0)
+                    return self.__notifications.popleft()
 
-            # return the control to the event loop.
-            yield
+                # a notification added from now on sets the event again
+                self.__wakeup.clear()
+
+            try:
+                await asyncio.wait_for(
+                    self.__wakeup.wait(), self.__disconnect_check_interval
+                )
+            except TimeoutError:
+                if await self.is_disconnected():
+                    return None
+
+    def __await__(self) -> Generator[Any, None, Delivery | None]:
+        return self.next().__await__()
 
     @property
     def user(self) -> User:
         return self.__user
 
+    @property
+    def resync_required(self) -> bool:
+        """
+        Whether the notifications the client missed before connecting are
+        no longer kept, in which case it must fetch its state again.
+        """
+
+        return self.__resync_required
+
+    @property
+    def position(self) -> str | None:
+        """
+        The ID of the last delivery when the listener was created, `None` if
+        missed deliveries were replayed to it.
+        """
+
+        return self.__position
+
+    @property
+    def topics(self) -> tuple[str, ...]:
+        """The topics the listener is subscribed to."""
+
+        return self.__topics
+
 
 class Event:
+    """
+    Delivers the notifications to the listeners of the users, and publishes
+    the ones of a topic to all the listeners subscribed to it.
+
+    Publishing only enqueues the notification on the listeners; the
+    listeners whose client has disconnected are removed by a background
+    reaper every `reap_interval` seconds, while there are listeners.
+
+    Without a bus, only the listeners of this process receive the
+    notifications. With one, the notifications are published to every
+    worker and each delivers them to its own listeners, numbered by their
+    position on the bus; a client can resume its stream on any worker.
+
+    The last `replay_window` deliveries of the `replay_users` users and
+    topics which were notified last are kept, so a client that reconnects
+    with the ID of the last delivery it received gets the ones it missed.
+    The last delivery of every topic is retained and sent to its new
+    subscribers.
+    """
+
     __listeners_by_user: dict[User, list[Listener]]
+    __listeners_by_topic: dict[str, list[Listener]]
     __mutex: Lock
+    __disconnect_check_interval: float
+    __reap_interval: float
+    __reaper: Task[None] | None
+    __bus: EventBus | None
+    __buffer_size: int
+    __overflow_policy: OverflowPolicy
+    __statistics: BufferStatistics
+    __epoch: str
+    __sequence: int
+    __known_from: int
+    __histories: OrderedDict[User | str, _History]
+    __retained: dict[str, Delivery]
+    __replay_window: int
+    __replay_users: int
+    __forgotten_sequence: int
+    __last_serialized: tuple[Notification, bytes] | None
+
+    def __init__(
+        self,
+        disconnect_check_interval: float = DISCONNECT_CHECK_INTERVAL,
+        reap_interval: float = REAP_INTERVAL,
+        bus: EventBus | None = None,
+        buffer_size: int = BUFFER_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.COLLAPSE,
+        replay_window: int = REPLAY_WINDOW,
+        replay_users: int = REPLAY_USERS,
+    ) -> None:
+        """
+        :param disconnect_check_interval: The number of seconds a waiting \
+            listener sleeps before it checks whether the client has \
+            disconnected.
+        :param reap_interval: The number of seconds between the checks of \
+            the background reaper for disconnected listeners.
+        :param bus: The bus the notifications are published through to the \
+            other workers, `None` to only deliver them in this process.
+        :param buffer_size: The maximum number of notifications waiting to \
+            be sent to each listener.
+        :param overflow_policy: What a listener does with a new \
+            notification once its buffer is full.
+        :param replay_window: The number of the last deliveries kept for \
+            each user and topic.
+        :param replay_users: The number of the users and topics whose \
+            deliveries are kept; the ones notified the longest ago are \
+            forgotten first.
+        """
+
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
 
-    def __init__(self) -> None:
         self.__listeners_by_user = {}
+        self.__listeners_by_topic = {}
         self.__mutex = Lock()
-
-    def listens(self, user: User, request: Request) -> Listener:
+        self.__disconnect_check_interval = disconnect_check_interval
+        self.__reap_interval = reap_interval
+        self.__reaper = None
+        self.__bus = bus
+        self.__buffer_size = buffer_size
+        self.__overflow_policy = overflow_policy
+        self.__statistics = BufferStatistics()
+        self.__epoch = uuid4().hex[:8]
+        self.__sequence = 0
+        self.__known_from = 0
+        self.__histories = OrderedDict()
+        self.__retained = {}
+        self.__replay_window = replay_window
+        self.__replay_users = replay_users
+        self.__forgotten_sequence = 0
+        self.__last_serialized = None
+
+        if bus is not None:
+            self.__epoch = bus.epoch
+            position = bus.start(self.__receive)
+
+            # the deliveries before the bus was started weren't received,
+            # the ones after might have been already
+            with self.__mutex:
+                self.__known_from = self.__forgotten_sequence = position
+                self.__sequence = max(self.__sequence, position)
+
+    def listens(
+        self,
+        user: User,
+        request: Request,
+        last_event_id: str | None = None,
+        topics: tuple[str, ...] = (),
+    ) -> Listener:
         """
-        Creates a new listener for the user.
+        Creates a new listener for the user. If called from an event loop,
+        the reaper is started on it unless it's already running.
+
+        :param last_event_id: The ID of the last delivery the client has \
+            received before reconnecting. The deliveries it missed are \
+            replayed to the listener, or the listener requires the client to \
+            resync if they're no longer kept.
+        :param topics: The topics the listener is subscribed to. Unless the \
+            missed deliveries are replayed, the last delivery of each topic \
+            is sent first, without an ID.
         """
 
         with self.__mutex:
-            connections = self.__listeners_by_user.setdefault(user, [])
-            connection = Listener(user, request)
-            connections.append(connection)
-
+            if last_event_id is None:
+                replay, resync_required = [], False
+            else:
+                replay, resync_required = self.__replay(
+                    (user, *topics), last_event_id
+                )
+
+            resumed = last_event_id is not None and not resync_required
+
+            if not resumed:
+                replay = [
+                    self.__retained[topic]
+                    for topic in topics
+                    if topic in self.__retained
+                ]
+
+            connection = Listener(
+                user,
+                request,
+                self.__disconnect_check_interval,
+                self.__buffer_size,
+                self.__overflow_policy,
+                self.__statistics,
+                resync_required,
+                (
+                    None
+                    if resumed and replay
+                    else f"{self.__epoch}:{self.__sequence}"
+                ),
+                topics,
+            )
+            self.__listeners_by_user.setdefault(user, []).append(connection)
+
+            for topic in topics:
+                self.__listeners_by_topic.setdefault(topic, []).append(
+                    connection
+                )
+
+            # added under the lock, the deliveries from now on follow them
+            for delivery in replay:
+                connection.add_delivery(delivery)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
             return connection
 
+        with self.__mutex:
+            # the reaper task is bound to the event loop that started it
+            if (
+                self.__reaper is None
+                or self.__reaper.done()
+                or self.__reaper.get_loop() is not loop
+            ):
+                self.__reaper = loop.create_task(self.__reap_periodically())
+
+        return connection
+
     def remove_listener(self, connection: Listener) -> None:
         """
         Removes the connection from the event.
         """
 
         with self.__mutex:
-            connections = self.__listeners_by_user.get(connection.user)
+            self.__remove_listener(connection)
 
-            if connections is None:
-                return
+    def __remove_listener(self, connection: Listener) -> None:
+        connections = self.__listeners_by_user.get(connection.user)
+
+        # the connection might have been removed by the reaper already
+        if connections is None or connection not in connections:
+            return
 
-            connections.remove(connection)
+        connections.remove(connection)
+
+        if not connections:
+            del self.__listeners_by_user[connection.user]
+
+        for topic in connection.topics:
+            subscribers = self.__listeners_by_topic[topic]
+            subscribers.remove(connection)
+
+            if not subscribers:
+                del self.__listeners_by_topic[topic]
 
     async def add_notification(
         self, user: User, notification: Notification
     ) -> None:
         """
-        Adds a notification to the user.
+        Adds a notification to the user. Never waits; the listeners of the
+        user are woken up to send it.
+
+        The notification is serialized once; sending the same instance to
+        several users one after another reuses the serialized JSON.
+        """
+
+        data = self.__serialize(notification)
+
+        if self.__bus is None:
+            self.__deliver(user, notification, data)
+            return
+
+        self.__bus.publish(f"{user.user_id} {user.role.name}\n{data.decode()}")
+
+    async def publish(self, topic: str, notification: Notification) -> None:
+        """
+        Publishes a notification to the topic. Never waits; it's serialized
+        and encoded once, whatever the number of subscribers, and retained
+        for the ones that subscribe later on.
         """
 
+        data = self.__serialize(notification)
+
+        if self.__bus is None:
+            self.__deliver(topic, notification, data)
+            return
+
+        self.__bus.publish(f"{topic}\n{data.decode()}")
+
+    def __serialize(self, notification: Notification) -> bytes:
         with self.__mutex:
-            connections = self.__listeners_by_user.get(user)
+            last_serialized = self.__last_serialized
 
-            if connections is None:
-                return
+        if last_serialized is not None and last_serialized[0] is notification:
+            return last_serialized[1]
+
+        data = _notification_adapter.dump_json(notification)
+
+        with self.__mutex:
+            self.__last_serialized = (notification, data)
+
+        return data
+
+    def __receive(self, position: int, message: str) -> None:
+        header, _, payload = message.partition("\n")
+        data = payload.encode()
+
+        # `user_id ROLE` for a user, the topic itself has no spaces
+        target, _, role = header.partition(" ")
+
+        self.__deliver(
+            User(user_id=int(target), role=Role[role]) if role else target,
+            _notification_adapter.validate_json(data),
+            data,
+            position,
+        )
+
+    def __deliver(
+        self,
+        target: User | str,
+        notification: Notification,
+        data: bytes,
+        position: int | None = None,
+    ) -> None:
+        with self.__mutex:
+            # the positions on the bus are the same on every worker
+            self.__sequence = (
+                self.__sequence + 1 if position is None else position
+            )
+            event_id = f"{self.__epoch}:{self.__sequence}"
+            delivery = Delivery(
+                id=event_id,
+                notification=notification,
+                frame=encode_frame(event_id, data),
+            )
+
+            self.__remember(target, self.__sequence, delivery)
+
+            if isinstance(target, User):
+                connections = tuple(self.__listeners_by_user.get(target, ()))
+            else:
+                # without an ID, sending it to a new subscriber doesn't
+                # move the position of its stream back
+                self.__retained[target] = Delivery(
+                    id=event_id,
+                    notification=notification,
+                    frame=b"data: " + data + b"\r\n\r\n",
+                )
+                connections = tuple(self.__listeners_by_topic.get(target, ()))
+
+        for connection in connections:
+            connection.add_delivery(delivery)
+
+    def __remember(
+        self, target: User | str, sequence: int, delivery: Delivery
+    ) -> None:
+        history = self.__histories.get(target)
+
+        if history is None:
+            history = self.__histories[target] = _History(deque())
+
+            if len(self.__histories) > self.__replay_users:
+                _, forgotten = self.__histories.popitem(last=False)
+                self.__forgotten_sequence = max(
+                    self.__forgotten_sequence,
+                    (
+                        forgotten.deliveries[-1][0]
+                        if forgotten.deliveries
+                        else forgotten.dropped_sequence
+                    ),
+                )
+        else:
+            self.__histories.move_to_end(target)
+
+        if len(history.deliveries) >= self.__replay_window:
+            history.dropped_sequence = history.deliveries.popleft()[0]
+
+        history.deliveries.append((sequence, delivery))
+
+    def __replay(
+        self, targets: tuple[User | str, ...], last_event_id: str
+    ) -> tuple[list[Delivery], bool]:
+        epoch, _, sequence_text = last_event_id.rpartition(":")
+
+        # the ID of another bus, or of another worker or before a restart
+        # without one
+        if epoch != self.__epoch or not sequence_text.isdigit():
+            return [], True
+
+        sequence = int(sequence_text)
+
+        # not received yet, or from before the bus was started
+        if sequence > self.__sequence or sequence < self.__known_from:
+            return [], True
+
+        missed: list[tuple[int, Delivery]] = []
 
-            removing: list[Listener] = []
+        for target in targets:
+            history = self.__histories.get(target)
 
-            for connection in connections:
-                if await connection.is_disconnected():
-                    removing.append(connection)
-                else:
-                    connection.add_notification(notification)
+            if history is None:
+                # it might have been notified and forgotten since
+                if sequence < self.__forgotten_sequence:
+                    return [], True
 
-            for connection in removing:
-                connections.remove(connection)
+                continue
+
+            if sequence < history.dropped_sequence:
+                return [], True
+
+            missed.extend(
+                (delivery_sequence, delivery)
+                for delivery_sequence, delivery in history.deliveries
+                if delivery_sequence > sequence
+            )
+
+        # the deliveries of the user and the topics in the order they
+        # were made
+        missed.sort(key=lambda entry: entry[0])
+
+        return [delivery for _, delivery in missed], False
+
+    async def reap(self) -> int:
+        """
+        Removes the listeners whose client has disconnected.
+
+        :return: The number of the removed listeners.
+        """
+
+        with self.__mutex:
+            connections = [
+                connection
+                for user_connections in self.__listeners_by_user.values()
+                for connection in user_connections
+            ]
+
+        # the connections are checked without holding the lock
+        disconnected = [
+            connection
+            for connection in connections
+            if await connection.is_disconnected()
+        ]
+
+        with self.__mutex:
+            for connection in disconnected:
+                self.__remove_listener(connection)
+
+        return len(disconnected)
+
+    async def __reap_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.__reap_interval)
+
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("failed to reap the disconnected listeners")
+
+            with self.__mutex:
+                # started again by the next listener
+                if not self.__listeners_by_user:
+                    self.__reaper = None
+                    return
+
+    @property
+    def statistics(self) -> BufferStatistics:
+        """The counters of the notification buffers of the listeners."""
+
+        return self.__statistics
+
+    @property
+    def listener_count(self) -> int:
+        """The number of the connected listeners."""
+
+        with self.__mutex:
+            return sum(
+                len(connections)
+                for connections in self.__listeners_by_user.values()
+            )
+
+    @property
+    def user_count(self) -> int:
+        """The number of the users with at least one listener."""
+
+        with self.__mutex:
+            return len(self.__listeners_by_user)
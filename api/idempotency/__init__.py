@@ -0,0 +1,317 @@
+from abc import ABC, abstractmethod
+from asyncio import Future
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from psycopg2.errors import LockNotAvailable
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from api.errors import ConflictingError
+from api.models.idempotency import IdempotencyKey
+from api.state import State
+
+import asyncio
+import time
+
+
+@dataclass(frozen=True)
+class IdempotencyRecord:
+    """
+    An idempotency key to be recorded by the operation along with its
+    result, in the same transaction, with `insert_idempotency_keys`.
+    """
+
+    customer_id: int
+    key: str
+    expires_at: int
+
+
+class IdempotencyKeyUsedError(Exception):
+    """The key has been recorded by another request in the meantime."""
+
+
+def insert_idempotency_keys(
+    session: Session, records: list[tuple[IdempotencyRecord, int]]
+) -> None:
+    """
+    Records the results of the idempotency keys in the transaction of the
+    session. The keys are expected to be claimed by the caller, see
+    `PostgresIdempotencyStore`, so the insert never waits on a concurrent
+    request.
+
+    :param records: The keys along with their results.
+    :raises IdempotencyKeyUsedError: If a key has already been recorded and \
+        hasn't expired.
+    """
+
+    if not records:
+        return
+
+    now = int(time.time())
+
+    statement = insert(IdempotencyKey).values(
+        [
+            {
+                "customer_id": record.customer_id,
+                "key": record.key,
+                "order_id": result,
+                "expires_at": record.expires_at,
+            }
+            for record, result in records
+        ]
+    )
+
+    recorded = session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[IdempotencyKey.customer_id, IdempotencyKey.key],
+            set_={
+                IdempotencyKey.order_id: statement.excluded.order_id,
+                IdempotencyKey.expires_at: statement.excluded.expires_at,
+            },
+            # the claims without a result are left by the older versions
+            where=(IdempotencyKey.expires_at <= now)
+            | IdempotencyKey.order_id.is_(None),
+        ).returning(IdempotencyKey.key)
+    ).all()
+
+    if len(recorded) < len(records):
+        raise IdempotencyKeyUsedError("the idempotency key is already used")
+
+
+class IdempotencyStore(ABC):
+    """
+    Remembers the result of the first request made with an idempotency key so
+    that the retries of the same request can be answered without running the
+    operation again.
+
+    The keys are scoped by the customer; the same key sent by two different
+    customers refers to two different requests.
+    """
+
+    @abstractmethod
+    async def execute(
+        self,
+        state: State,
+        customer_id: int,
+        key: str,
+        operation: Callable[[IdempotencyRecord | None], Awaitable[int]],
+    ) -> int:
+        """
+        Runs the operation once for the given customer and key and returns
+        its result. If the key has already been used and hasn't expired, the
+        stored result is returned instead. If another request with the same
+        key is in progress, waits for it to finish and returns its result.
+
+        The operation is given the key to record along with its result, if
+        the store needs it to, see `insert_idempotency_keys`.
+
+        A failed operation is not remembered; retrying the key runs the
+        operation again.
+        """
+
+
+@dataclass
+class _InMemoryEntry:
+    result: Future[int]
+    expires_at: float
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """
+    An idempotency store kept in the memory of the process. The keys are not
+    shared between the worker processes and are lost on restart.
+    """
+
+    __entries: OrderedDict[tuple[int, str], _InMemoryEntry]
+    __ttl: float
+
+    def __init__(self, ttl: float) -> None:
+        """
+        :param ttl: The number of seconds a result is remembered for.
+        """
+
+        self.__entries = OrderedDict()
+        self.__ttl = ttl
+
+    def __evict_expired(self, now: float) -> None:
+        # the entries are ordered by their expiration time since the ttl is
+        # constant.
+        while self.__entries:
+            entry = next(iter(self.__entries.values()))
+
+            if entry.expires_at > now or not entry.result.done():
+                return
+
+            self.__entries.popitem(last=False)
+
+    async def execute(
+        self,
+        state: State,
+        customer_id: int,
+        key: str,
+        operation: Callable[[IdempotencyRecord | None], Awaitable[int]],
+    ) -> int:
+        now = time.monotonic()
+        self.__evict_expired(now)
+
+        entry = self.__entries.get((customer_id, key))
+
+        if entry is not None and entry.result.done():
+            if entry.expires_at > now:
+                return entry.result.result()
+
+        elif entry is not None:
+            # shield the future so that a cancelled retry doesn't cancel the
+            # original request.
+            return await asyncio.shield(entry.result)
+
+        entry = _InMemoryEntry(
+            result=asyncio.get_running_loop().create_future(),
+            expires_at=now + self.__ttl,
+        )
+        self.__entries[(customer_id, key)] = entry
+        self.__entries.move_to_end((customer_id, key))
+
+        try:
+            result = await operation(None)
+
+        except BaseException as e:
+            del self.__entries[(customer_id, key)]
+            entry.result.set_exception(e)
+
+            # the waiters will observe the exception, mark it as retrieved
+            # in case there are none.
+            entry.result.exception()
+
+            raise
+
+        entry.result.set_result(result)
+
+        return result
+
+
+class PostgresIdempotencyStore(IdempotencyStore):
+    """
+    An idempotency store backed by the `idempotency_keys` table; the keys are
+    shared between all the worker processes.
+
+    Before running the operation, the request claims the key with a
+    transaction-level advisory lock in its own session. A concurrent request
+    with the same key waits for the claim to be released, then finds the
+    recorded result and returns it without running the operation. A request
+    that waits for longer than `pending_timeout` seconds fails with a
+    conflict.
+
+    The operation records the key along with its result, in the request's
+    transaction or in the batch of the group commit pipeline; either way the
+    claim is held until the result is committed, so the insert of the key
+    never waits and a result is never lost nor recorded twice.
+    """
+
+    __ttl: int
+    __pending_timeout: float
+
+    def __init__(self, ttl: int, pending_timeout: float = 30) -> None:
+        """
+        :param ttl: The number of seconds a result is remembered for.
+        :param pending_timeout: The number of seconds to wait for another \
+            request with the same key to finish.
+        """
+
+        self.__ttl = ttl
+        self.__pending_timeout = pending_timeout
+
+    def __get_result(
+        self, state: State, customer_id: int, key: str
+    ) -> int | None:
+        return state.session.scalar(
+            select(IdempotencyKey.order_id).where(
+                (IdempotencyKey.customer_id == customer_id)
+                & (IdempotencyKey.key == key)
+                & (IdempotencyKey.expires_at > int(time.time()))
+            )
+        )
+
+    def __claim(self, state: State, customer_id: int, key: str) -> None:
+        # the lock is released when the transaction of the session ends;
+        # distinct keys sharing a hash only wait for each other
+        state.session.execute(
+            select(
+                func.set_config(
+                    "lock_timeout",
+                    f"{int(self.__pending_timeout * 1000)}ms",
+                    True,
+                )
+            )
+        )
+
+        try:
+            state.session.execute(
+                select(
+                    func.pg_advisory_xact_lock(customer_id, func.hashtext(key))
+                )
+            )
+
+        except OperationalError as e:
+            if not isinstance(e.orig, LockNotAvailable):
+                raise
+
+            state.session.rollback()
+
+            raise ConflictingError(
+                "a request with the same idempotency key is in progress"
+            )
+
+    async def execute(
+        self,
+        state: State,
+        customer_id: int,
+        key: str,
+        operation: Callable[[IdempotencyRecord | None], Awaitable[int]],
+    ) -> int:
+        result = self.__get_result(state, customer_id, key)
+
+        if result is not None:
+            return result
+
+        # wait for the claim outside of the event loop
+        await asyncio.to_thread(self.__claim, state, customer_id, key)
+
+        try:
+            # the key may have been recorded while waiting for the claim
+            result = self.__get_result(state, customer_id, key)
+
+            if result is None:
+                result = await operation(
+                    IdempotencyRecord(
+                        customer_id=customer_id,
+                        key=key,
+                        expires_at=int(time.time()) + self.__ttl,
+                    )
+                )
+
+        except IdempotencyKeyUsedError:
+            state.session.rollback()
+
+        except BaseException:
+            state.session.rollback()
+
+            raise
+
+        else:
+            # release the claim, the result is committed by now
+            state.session.commit()
+
+            return result
+
+        result = self.__get_result(state, customer_id, key)
+
+        if result is None:
+            # the result expired right after being recorded
+            raise ConflictingError("the idempotency key is already used")
+
+        return result
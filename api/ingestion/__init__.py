@@ -0,0 +1,243 @@
+from asyncio import AbstractEventLoop, Future, Queue, Task
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from api.idempotency import IdempotencyRecord, insert_idempotency_keys
+from api.models.order import Order, OrderItem, OrderOption
+from api.schemas.order import OrderItemCreate, OrderStatusFlag
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ValidatedOrder:
+    """An order that has been validated and priced but not yet written."""
+
+    customer_id: int
+    restaurant_id: int
+    ordered_at: int
+    price_paid: Decimal
+    items: list[OrderItemCreate]
+    idempotency: IdempotencyRecord | None = None
+    """The idempotency key recorded along with the order, if any."""
+
+
+def insert_orders(session: Session, orders: list[ValidatedOrder]) -> list[int]:
+    """
+    Inserts the orders along with their items, options and idempotency keys
+    using batched inserts. The transaction is left for the caller to commit.
+
+    :return: The IDs of the inserted orders, in the same order as `orders`.
+    :raises IdempotencyKeyUsedError: If the idempotency key of an order has \
+        already been used.
+    """
+
+    order_ids = session.scalars(
+        insert(Order).returning(Order.id, sort_by_parameter_order=True),
+        [
+            {
+                "customer_id": order.customer_id,
+                "restaurant_id": order.restaurant_id,
+                "ordered_at": order.ordered_at,
+                "price_paid": order.price_paid,
+                "status": OrderStatusFlag.ORDERED,
+            }
+            for order in orders
+        ],
+    ).all()
+
+    insert_idempotency_keys(
+        session,
+        [
+            (order.idempotency, order_id)
+            for order_id, order in zip(order_ids, orders)
+            if order.idempotency is not None
+        ],
+    )
+
+    items = [
+        (order_id, item)
+        for order_id, order in zip(order_ids, orders)
+        for item in order.items
+    ]
+
+    if not items:
+        return list(order_ids)
+
+    item_ids = session.scalars(
+        insert(OrderItem).returning(
+            OrderItem.id, sort_by_parameter_order=True
+        ),
+        [
+            {
+                "order_id": order_id,
+                "menu_id": item.menu_id,
+                "quantity": item.quantity,
+                "extra_requests": item.extra_requests,
+            }
+            for order_id, item in items
+        ],
+    ).all()
+
+    order_options = [
+        {"order_item_id": item_id, "option_id": option.option_id}
+        for item_id, (_, item) in zip(item_ids, items)
+        for option in item.options
+    ]
+
+    if order_options:
+        session.execute(insert(OrderOption), order_options)
+
+    return list(order_ids)
+
+
+class OrderIngestion:
+    """
+    Group commits the validated orders. The submitted orders are queued and a
+    writer task flushes them in micro-batches: a batch is written in a single
+    transaction once it has `batch_size` orders or `window` seconds have
+    passed since its first order arrived, whichever comes first.
+    """
+
+    __session_maker: Callable[[], Session]
+    __batch_size: int
+    __window: float
+    __queue: Queue[tuple[ValidatedOrder, Future[int]]] | None
+    __writer: Task[None] | None
+    __loop: AbstractEventLoop | None
+
+    def __init__(
+        self,
+        session_maker: Callable[[], Session],
+        batch_size: int = 64,
+        window: float = 0.005,
+    ) -> None:
+        """
+        :param session_maker: The function that returns a new SQLAlchemy \
+            session used by the writer task.
+        :param batch_size: The maximum number of orders written in a single \
+            transaction.
+        :param window: The maximum number of seconds an order waits for the \
+            other orders to join its batch.
+        """
+
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.__session_maker = session_maker
+        self.__batch_size = batch_size
+        self.__window = window
+        self.__queue = None
+        self.__writer = None
+        self.__loop = None
+
+    async def submit(self, order: ValidatedOrder) -> int:
+        """
+        Queues the order to be written and waits until its batch is
+        committed.
+
+        :return: The ID of the written order.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        # the writer task is bound to the event loop that started it
+        if (
+            self.__queue is None
+            or self.__writer is None
+            or self.__writer.done()
+            or self.__loop is not loop
+        ):
+            self.__queue = Queue()
+            self.__loop = loop
+            self.__writer = loop.create_task(self.__write(self.__queue))
+
+        result = loop.create_future()
+        self.__queue.put_nowait((order, result))
+
+        return await result
+
+    async def __write(
+        self, queue: Queue[tuple[ValidatedOrder, Future[int]]]
+    ) -> None:
+        while True:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + self.__window
+
+            while len(batch) < self.__batch_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(
+                        await asyncio.wait_for(queue.get(), remaining)
+                    )
+                except TimeoutError:
+                    break
+
+            # run the blocking database calls outside of the event loop so
+            # that the next batch can be collected in the meantime
+            results = await asyncio.to_thread(
+                self.__flush, [order for order, _ in batch]
+            )
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def __flush(
+        self, orders: list[ValidatedOrder]
+    ) -> list[int | BaseException]:
+        session = self.__session_maker()
+
+        try:
+            try:
+                order_ids = insert_orders(session, orders)
+                session.commit()
+
+                return list(order_ids)
+
+            except Exception:
+                session.rollback()
+
+                if len(orders) == 1:
+                    raise
+
+                logger.exception(
+                    "failed to write a batch of orders, retrying one by one"
+                )
+
+            # a single failing order must not fail the whole batch
+            results: list[int | BaseException] = []
+
+            for order in orders:
+                try:
+                    results.extend(insert_orders(session, [order]))
+                    session.commit()
+
+                except Exception as e:
+                    session.rollback()
+                    results.append(e)
+
+            return results
+
+        except Exception as e:
+            return [e] * len(orders)
+
+        finally:
+            session.close()
@@ -9,8 +9,10 @@ class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
-    token: Mapped[str]
+    customer_id: Mapped[int] = mapped_column(
+        ForeignKey("customers.id"), index=True
+    )
+    token: Mapped[str] = mapped_column(index=True)
     role: Mapped[str]
     expired_at: Mapped[datetime]
     created_at: Mapped[datetime] = mapped_column(default=datetime.now)
\ No newline at end of file
@@ -23,10 +23,14 @@ class CustomerReview(Base):
     __tablename__ = "customer_reviews"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
-    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
+    customer_id: Mapped[int] = mapped_column(
+        ForeignKey("customers.id"), index=True
+    )
     customer = relationship(Customer, backref="customer_reviews")
 
-    restaurant_id: Mapped[int] = mapped_column(ForeignKey("restaurants.id"))
+    restaurant_id: Mapped[int] = mapped_column(
+        ForeignKey("restaurants.id"), index=True
+    )
     restaurant = relationship(Restaurant, backref="customer_reviews")
 
     menu_id: Mapped[int] = mapped_column(ForeignKey("menus.id"))
@@ -46,6 +50,7 @@ class FavoriteRestaurant(Base):
     restaurant_id: Mapped[int] = mapped_column(
         ForeignKey("restaurants.id"), nullable=False
     )
+    # the primary key only covers the lookups by the restaurant
     customer_id: Mapped[int] = mapped_column(
-        ForeignKey("customers.id"), nullable=False
+        ForeignKey("customers.id"), nullable=False, index=True
     )
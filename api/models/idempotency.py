@@ -0,0 +1,13 @@
+from api.models import Base
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, ForeignKey, PrimaryKeyConstraint
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (PrimaryKeyConstraint("customer_id", "key"),)
+
+    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
+    key: Mapped[str]
+    order_id: Mapped[int | None] = mapped_column(ForeignKey("order_ids.id"))
+    expires_at: Mapped[int] = mapped_column(BigInteger)
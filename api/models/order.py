@@ -3,7 +3,19 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 from api.schemas.order import OrderCancelledBy, OrderStatusFlag
 
 from decimal import Decimal
-from sqlalchemy import ForeignKey, Numeric, Enum, PrimaryKeyConstraint
+from sqlalchemy import (
+    BigInteger,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Numeric,
+    Enum,
+    PrimaryKeyConstraint,
+    Sequence,
+    UniqueConstraint,
+    false,
+    text,
+)
 
 
 class OrderOption(Base):
@@ -18,7 +30,10 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"))
+    # the partitioned `orders` table can't be referenced by its ID alone
+    order_id: Mapped[int] = mapped_column(
+        ForeignKey("order_ids.id"), index=True
+    )
     menu_id: Mapped[int] = mapped_column(ForeignKey("menus.id"))
     quantity: Mapped[int]
     extra_requests: Mapped[str | None]
@@ -28,50 +43,77 @@ class OrderItem(Base):
     )
 
 
-class PreparingOrder(Base):
-    __tablename__ = "preparing_orders"
+class OrderId(Base):
+    """
+    The ID and the partition keys of every order, unique by the ID. Each order
+    references its row, so the order IDs are unique across the partitions and
+    can be referenced by the other tables.
 
-    order_id: Mapped[int] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True
-    )
-    prepared_at: Mapped[int]
+    The row is inserted along with the order by a trigger; updating its
+    partition keys cascades to the order.
+    """
 
-
-class SettledOrder(Base):
-    __tablename__ = "settled_orders"
-
-    order_id: Mapped[int] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True
+    __tablename__ = "order_ids"
+    __table_args__ = (
+        UniqueConstraint(
+            "id", "archived", "ordered_at", name="order_ids_partition_key"
+        ),
     )
-    settled_at: Mapped[int]
 
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    archived: Mapped[bool]
+    ordered_at: Mapped[int] = mapped_column(BigInteger)
 
-class ReadyOrder(Base):
-    __tablename__ = "ready_orders"
 
-    order_id: Mapped[int] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True
-    )
-    ready_at: Mapped[int]
-
-
-class CancelledOrder(Base):
-    __tablename__ = "cancelled_orders"
-
-    order_id: Mapped[int] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True
-    )
-    cancelled_time: Mapped[int]
-    cancelled_by: Mapped[OrderCancelledBy] = mapped_column(
-        Enum(OrderCancelledBy, name="order_cancelled_by")
-    )
-    reason: Mapped[str | None]
+class Order(Base):
+    """
+    The orders are partitioned by `archived`. The ongoing and the recently
+    finished orders live in the `orders_hot` partition; the finished orders
+    older than the configured age are moved by `archive_finished_orders` to
+    `orders_archive`, which is partitioned by `ordered_at` monthly.
 
+    Postgres requires the partition keys to be a part of the primary key;
+    the ORM still identifies the orders by their ID alone, which is kept
+    unique by `OrderId`.
+    """
 
-class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "archived", "ordered_at"),
+        ForeignKeyConstraint(
+            ["id", "archived", "ordered_at"],
+            ["order_ids.id", "order_ids.archived", "order_ids.ordered_at"],
+            name="orders_id_fkey",
+            onupdate="CASCADE",
+        ),
+        # the order listings, sorted and paginated by `ordered_at, id`
+        Index(
+            "ix_orders_customer_id_ordered_at",
+            "customer_id",
+            "ordered_at",
+            "id",
+        ),
+        Index(
+            "ix_orders_restaurant_id_ordered_at",
+            "restaurant_id",
+            "ordered_at",
+            "id",
+        ),
+        Index("ix_orders_restaurant_id_status", "restaurant_id", "status"),
+        # the queue of a restaurant, only a small fraction of the orders are
+        # still ongoing
+        Index(
+            "ix_orders_active_restaurant_id",
+            "restaurant_id",
+            "ordered_at",
+            "id",
+            postgresql_where=text("status IN ('ORDERED', 'PREPARING')"),
+        ),
+        {"postgresql_partition_by": "LIST (archived)"},
+    )
+    __mapper_args__ = {"primary_key": ["id"]}
 
-    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(Sequence("orders_id_seq"))
     restaurant_id: Mapped[int] = mapped_column(ForeignKey("restaurants.id"))
     customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
     status: Mapped[OrderStatusFlag] = mapped_column(
@@ -80,6 +122,25 @@ class Order(Base):
     price_paid: Mapped[Decimal] = mapped_column(
         Numeric(precision=10, scale=2, asdecimal=True)
     )
-    ordered_at: Mapped[int]
+    ordered_at: Mapped[int] = mapped_column(BigInteger)
 
-    items: Mapped[list[OrderItem]] = relationship(OrderItem, backref="order")
+    # the timestamps of the status changes, set once the order reaches the
+    # status
+    prepared_at: Mapped[int | None] = mapped_column(BigInteger)
+    ready_at: Mapped[int | None] = mapped_column(BigInteger)
+    settled_at: Mapped[int | None] = mapped_column(BigInteger)
+
+    # set only if the order is cancelled
+    cancelled_time: Mapped[int | None] = mapped_column(BigInteger)
+    cancelled_by: Mapped[OrderCancelledBy | None] = mapped_column(
+        Enum(OrderCancelledBy, name="order_cancelled_by")
+    )
+    cancelled_reason: Mapped[str | None]
+
+    archived: Mapped[bool] = mapped_column(server_default=false())
+
+    items: Mapped[list[OrderItem]] = relationship(
+        OrderItem,
+        primaryjoin="Order.id == foreign(OrderItem.order_id)",
+        backref="order",
+    )
@@ -13,10 +13,14 @@ class Restaurant(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(unique=True)
     address: Mapped[str]
-    merchant_id: Mapped[int] = mapped_column(ForeignKey("merchants.id"))
+    merchant_id: Mapped[int] = mapped_column(
+        ForeignKey("merchants.id"), index=True
+    )
     image: Mapped[str | None]
     location: Mapped[Point] = mapped_column(PointType)
-    canteen_id: Mapped[int] = mapped_column(ForeignKey("canteens.id"))
+    canteen_id: Mapped[int] = mapped_column(
+        ForeignKey("canteens.id"), index=True
+    )
     open: Mapped[bool]
 
 
@@ -24,7 +28,9 @@ class Menu(Base):
     __tablename__ = "menus"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    restaurant_id: Mapped[int] = mapped_column(ForeignKey("restaurants.id"))
+    restaurant_id: Mapped[int] = mapped_column(
+        ForeignKey("restaurants.id"), index=True
+    )
     name: Mapped[str]
     description: Mapped[str]
     price: Mapped[Decimal] = mapped_column(
@@ -39,7 +45,7 @@ class Option(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     customization_id: Mapped[int] = mapped_column(
-        ForeignKey("customizations.id")
+        ForeignKey("customizations.id"), index=True
     )
     name: Mapped[str]
     description: Mapped[str | None]
@@ -52,7 +58,7 @@ class Customization(Base):
     __tablename__ = "customizations"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    menu_id: Mapped[int] = mapped_column(ForeignKey("menus.id"))
+    menu_id: Mapped[int] = mapped_column(ForeignKey("menus.id"), index=True)
     title: Mapped[str]
     description: Mapped[str | None]
     unique: Mapped[bool]
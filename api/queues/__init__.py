@@ -0,0 +1,635 @@
+from asyncio import Task
+from bisect import bisect_left
+from dataclasses import dataclass
+from threading import Lock
+from typing import Awaitable, Callable, Iterable, Protocol
+
+from uuid import uuid4
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from api.bus import EventBus
+from api.catalog import CatalogCache, RestaurantCatalog
+from api.errors.internal import InternalServerError
+from api.models.order import Order
+from api.schemas.order import OrderStatusFlag, Queue
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+ACTIVE_ORDER_STATUSES = (OrderStatusFlag.ORDERED, OrderStatusFlag.PREPARING)
+"""The statuses of the orders that are still waiting in the queue."""
+
+
+class _OrderedItem(Protocol):
+    @property
+    def menu_id(self) -> int: ...
+
+    @property
+    def quantity(self) -> int: ...
+
+
+def estimate_prep_time(
+    catalog: RestaurantCatalog, items: Iterable[_OrderedItem]
+) -> int:
+    """
+    Estimates the time needed to prepare the items of an order from the
+    preparation time of their menus. A menu without a preparation time
+    counts as one.
+    """
+
+    menus = catalog.menus
+    estimated_time = 0
+
+    for item in items:
+        menu = menus.get(item.menu_id)
+
+        if not menu:
+            raise InternalServerError("can't find the menu for the order item")
+
+        estimated_time += (
+            menu.estimated_prep_time if menu.estimated_prep_time else 1
+        ) * item.quantity
+
+    return estimated_time
+
+
+class _FenwickTree:
+    """A binary indexed tree of the sums of an append-only list."""
+
+    __tree: list[int]
+
+    def __init__(self) -> None:
+        # 1-based, the first element is unused
+        self.__tree = [0]
+
+    def append(self, value: int) -> None:
+        index = len(self.__tree)
+        lowest_bit = index & -index
+
+        # the new node covers the elements (index - lowest_bit, index]
+        self.__tree.append(
+            value
+            + self.prefix_sum(index - 1)
+            - self.prefix_sum(index - lowest_bit)
+        )
+
+    def add(self, position: int, value: int) -> None:
+        index = position + 1
+
+        while index < len(self.__tree):
+            self.__tree[index] += value
+            index += index & -index
+
+    def prefix_sum(self, length: int) -> int:
+        """The sum of the first `length` elements."""
+
+        total = 0
+
+        while length > 0:
+            total += self.__tree[length]
+            length -= length & -length
+
+        return total
+
+
+@dataclass(frozen=True)
+class QueuedOrder:
+    """An active order waiting in the queue of its restaurant."""
+
+    order_id: int
+    customer_id: int
+    ordered_at: int
+    prep_time: int
+    """The estimated time to prepare the order, see `estimate_prep_time`."""
+
+
+class RestaurantQueue:
+    """
+    The active orders of a restaurant sorted by `(ordered_at, id)` along with
+    the estimated time to prepare each of them.
+
+    The orders are kept in slots that are only ever appended to, the slot of
+    a finished order is left empty until more than half of the slots are
+    empty. Since the new orders are almost always the last ones in the queue,
+    both adding and removing an order as well as computing the queue in
+    front of an order take O(log n).
+    """
+
+    __keys: list[tuple[int, int]]
+    __orders: list[QueuedOrder | None]
+    __slots: dict[int, int]
+    __counts: _FenwickTree
+    __estimated_times: _FenwickTree
+    __estimated_time: int
+
+    def __init__(self, orders: Iterable[QueuedOrder] = ()) -> None:
+        """
+        :param orders: The active orders, in any order.
+        """
+
+        self.__rebuild(orders)
+
+    def __rebuild(self, orders: Iterable[QueuedOrder]) -> None:
+        self.__keys = []
+        self.__orders = []
+        self.__slots = {}
+        self.__counts = _FenwickTree()
+        self.__estimated_times = _FenwickTree()
+        self.__estimated_time = 0
+
+        for order in sorted(
+            orders, key=lambda order: (order.ordered_at, order.order_id)
+        ):
+            self.__append(order)
+
+    def __append(self, order: QueuedOrder) -> None:
+        self.__slots[order.order_id] = len(self.__keys)
+        self.__keys.append((order.ordered_at, order.order_id))
+        self.__orders.append(order)
+        self.__counts.append(1)
+        self.__estimated_times.append(order.prep_time)
+        self.__estimated_time += order.prep_time
+
+    def __active_orders(self) -> list[QueuedOrder]:
+        return [order for order in self.__orders if order is not None]
+
+    def add(self, order: QueuedOrder) -> None:
+        """Adds the order to the queue, if it's not already in there."""
+
+        if order.order_id in self.__slots:
+            return
+
+        if (
+            self.__keys
+            and (order.ordered_at, order.order_id) < self.__keys[-1]
+        ):
+            self.__rebuild(self.__active_orders() + [order])
+        else:
+            self.__append(order)
+
+    def remove(self, order_id: int) -> None:
+        """Removes the order from the queue, if it's in there."""
+
+        slot = self.__slots.pop(order_id, None)
+
+        if slot is None:
+            return
+
+        order = self.__orders[slot]
+        assert order is not None
+
+        self.__orders[slot] = None
+        self.__counts.add(slot, -1)
+        self.__estimated_times.add(slot, -order.prep_time)
+        self.__estimated_time -= order.prep_time
+
+        if len(self.__slots) * 2 < len(self.__keys):
+            self.__rebuild(self.__active_orders())
+
+    def queue(self) -> Queue:
+        """The queue of all the active orders."""
+
+        return Queue(
+            queue_count=len(self.__slots),
+            estimated_time=self.__estimated_time,
+        )
+
+    def queue_before(self, ordered_at: int, order_id: int) -> Queue:
+        """The queue of the active orders placed before the given order."""
+
+        length = bisect_left(self.__keys, (ordered_at, order_id))
+
+        return Queue(
+            queue_count=self.__counts.prefix_sum(length),
+            estimated_time=self.__estimated_times.prefix_sum(length),
+        )
+
+    def queues_of_orders(self) -> list[tuple[QueuedOrder, Queue]]:
+        """
+        The queue in front of every active order, in the queue order. The
+        queues are computed from a running sum in a single pass.
+        """
+
+        queues: list[tuple[QueuedOrder, Queue]] = []
+        estimated_time = 0
+
+        for order in self.__active_orders():
+            queues.append(
+                (
+                    order,
+                    Queue(
+                        queue_count=len(queues), estimated_time=estimated_time
+                    ),
+                )
+            )
+            estimated_time += order.prep_time
+
+        return queues
+
+
+class QueueEngine:
+    """
+    Keeps the queue of every restaurant in the memory of the process so that
+    the queues can be answered without reading the orders.
+
+    The queue of a restaurant is loaded from the database the first time
+    it's needed and is then kept up to date by the order write paths, which
+    must call `add` after an order is created and `remove` after it leaves
+    the `ORDERED` or `PREPARING` status. The application calls `warm` on
+    startup so that the restaurants with active orders don't wait for their
+    queue to be loaded.
+
+    Without a bus, the queues are only correct if every write goes through
+    this process. With one, every change is published to the other workers,
+    which drop their copy of the queue and load it again when it's next
+    needed.
+    """
+
+    __queues: dict[int, RestaurantQueue]
+    __versions: dict[int, int]
+    __mutex: Lock
+    __bus: EventBus | None
+    __origin: str
+
+    def __init__(self, bus: EventBus | None = None) -> None:
+        """
+        :param bus: The bus the changes are published through to the other \
+            workers, `None` if this process is the only one.
+        """
+
+        self.__queues = {}
+        self.__versions = {}
+        self.__mutex = Lock()
+        self.__bus = bus
+        self.__origin = uuid4().hex[:8]
+
+        if bus is not None:
+            bus.start(self.__receive)
+
+    def __get(
+        self, session: Session, catalog: CatalogCache, restaurant_id: int
+    ) -> RestaurantQueue:
+        return self.__get_many(session, catalog, [restaurant_id])[
+            restaurant_id
+        ]
+
+    def __get_many(
+        self,
+        session: Session,
+        catalog: CatalogCache,
+        restaurant_ids: Iterable[int],
+    ) -> dict[int, RestaurantQueue]:
+        queues: dict[int, RestaurantQueue] = {}
+        versions: dict[int, int] = {}
+
+        with self.__mutex:
+            for restaurant_id in restaurant_ids:
+                queue = self.__queues.get(restaurant_id)
+
+                if queue is not None:
+                    queues[restaurant_id] = queue
+                else:
+                    versions[restaurant_id] = self.__versions.get(
+                        restaurant_id, 0
+                    )
+
+        if not versions:
+            return queues
+
+        # the restaurants that aren't loaded yet are loaded together
+        orders = session.scalars(
+            select(Order)
+            .where(
+                Order.restaurant_id.in_(versions)
+                # active orders are never archived, only scan the hot
+                # partition
+                & Order.archived.is_(False)
+                & Order.status.in_(ACTIVE_ORDER_STATUSES)
+            )
+            .options(selectinload(Order.items))
+        ).all()
+
+        queued_orders: dict[int, list[QueuedOrder]] = {
+            restaurant_id: [] for restaurant_id in versions
+        }
+
+        for order in orders:
+            restaurant_catalog = catalog.get(session, order.restaurant_id)
+            queued_orders[order.restaurant_id].append(
+                QueuedOrder(
+                    order_id=order.id,
+                    customer_id=order.customer_id,
+                    ordered_at=order.ordered_at,
+                    prep_time=estimate_prep_time(
+                        restaurant_catalog, order.items
+                    ),
+                )
+            )
+
+        with self.__mutex:
+            for restaurant_id, version in versions.items():
+                queue = RestaurantQueue(queued_orders[restaurant_id])
+
+                # an order of the restaurant might have changed while the
+                # queue was being loaded, in which case it's not safe to be
+                # kept.
+                if version == self.__versions.get(restaurant_id, 0):
+                    queue = self.__queues.setdefault(restaurant_id, queue)
+
+                queues[restaurant_id] = queue
+
+        return queues
+
+    def __changed(self, restaurant_id: int) -> RestaurantQueue | None:
+        self.__versions[restaurant_id] = (
+            self.__versions.get(restaurant_id, 0) + 1
+        )
+
+        return self.__queues.get(restaurant_id)
+
+    def __publish(self, restaurant_id: int) -> None:
+        if self.__bus is not None:
+            self.__bus.publish(f"{self.__origin} {restaurant_id}")
+
+    def __receive(self, _: int, message: str) -> None:
+        origin, _, restaurant_id = message.partition(" ")
+
+        # the changes of this process are already applied
+        if origin != self.__origin:
+            self.drop(int(restaurant_id))
+
+    def warm(self, session: Session, catalog: CatalogCache) -> int:
+        """
+        Loads the queues of all the restaurants with active orders at once.
+        The queues of the other restaurants are empty and still loaded the
+        first time they're needed.
+
+        :return: The number of the loaded restaurants.
+        """
+
+        restaurant_ids = session.scalars(
+            select(Order.restaurant_id)
+            .where(
+                Order.archived.is_(False)
+                & Order.status.in_(ACTIVE_ORDER_STATUSES)
+            )
+            .distinct()
+        ).all()
+
+        self.__get_many(session, catalog, restaurant_ids)
+
+        return len(restaurant_ids)
+
+    def add(self, restaurant_id: int, order: QueuedOrder) -> None:
+        """Adds the newly created order to the queue of its restaurant."""
+
+        with self.__mutex:
+            queue = self.__changed(restaurant_id)
+
+            if queue is not None:
+                queue.add(order)
+
+        self.__publish(restaurant_id)
+
+    def remove(self, restaurant_id: int, order_id: int) -> None:
+        """Removes the order that's no longer active from the queue."""
+
+        with self.__mutex:
+            queue = self.__changed(restaurant_id)
+
+            if queue is not None:
+                queue.remove(order_id)
+
+        self.__publish(restaurant_id)
+
+    def invalidate(self, restaurant_id: int) -> None:
+        """
+        Drops the queue of the restaurant so that it's loaded again, in every
+        worker. Must be called whenever the preparation time of its menus
+        might change.
+        """
+
+        self.drop(restaurant_id)
+        self.__publish(restaurant_id)
+
+    def drop(self, restaurant_id: int) -> None:
+        """
+        Drops the queue of the restaurant in this process only, e.g. once
+        it's known to have been changed by another worker.
+        """
+
+        with self.__mutex:
+            self.__changed(restaurant_id)
+            self.__queues.pop(restaurant_id, None)
+
+    def restaurant_queue(
+        self, session: Session, catalog: CatalogCache, restaurant_id: int
+    ) -> Queue:
+        """Gets the queue of all the active orders of the restaurant."""
+
+        queue = self.__get(session, catalog, restaurant_id)
+
+        with self.__mutex:
+            return queue.queue()
+
+    def restaurant_queues(
+        self,
+        session: Session,
+        catalog: CatalogCache,
+        restaurant_ids: Iterable[int],
+    ) -> dict[int, Queue]:
+        """
+        Gets the queues of many restaurants at once. The restaurants that
+        aren't loaded yet are loaded with a single query.
+        """
+
+        queues = self.__get_many(session, catalog, restaurant_ids)
+
+        with self.__mutex:
+            return {
+                restaurant_id: queue.queue()
+                for restaurant_id, queue in queues.items()
+            }
+
+    def order_queue(
+        self,
+        session: Session,
+        catalog: CatalogCache,
+        restaurant_id: int,
+        ordered_at: int,
+        order_id: int,
+    ) -> Queue:
+        """
+        Gets the queue of the active orders of the restaurant placed before
+        the given order.
+        """
+
+        queue = self.__get(session, catalog, restaurant_id)
+
+        with self.__mutex:
+            return queue.queue_before(ordered_at, order_id)
+
+    def queues_of_orders(
+        self, session: Session, catalog: CatalogCache, restaurant_id: int
+    ) -> list[tuple[QueuedOrder, Queue]]:
+        """
+        Gets the queue in front of every active order of the restaurant, in
+        the queue order.
+        """
+
+        queue = self.__get(session, catalog, restaurant_id)
+
+        with self.__mutex:
+            return queue.queues_of_orders()
+
+
+QueueSender = Callable[[QueuedOrder, Queue], Awaitable[None]]
+"""Sends the new queue in front of the order to its customer."""
+
+QueueBroadcaster = Callable[
+    [int, list[tuple[QueuedOrder, Queue]]], Awaitable[None]
+]
+"""
+Sends the new queues of all the active orders of the restaurant at once, in
+the queue order.
+"""
+
+
+class QueueChangeNotifier:
+    """
+    Coalesces the queue changes of a restaurant. A restaurant whose queue
+    has changed is marked and its queues are recomputed at most once per
+    window; only the customers whose queue is different from the last one
+    sent to them are notified, and the queues are broadcast only if any of
+    the orders changed.
+    """
+
+    __session_maker: Callable[[], Session]
+    __catalog: CatalogCache
+    __queues: QueueEngine
+    __window: float
+    __senders: dict[int, tuple[QueueSender | None, QueueBroadcaster | None]]
+    __flushes: dict[int, Task[None]]
+    __sent: dict[int, dict[int, Queue]]
+    __broadcast: dict[int, list[tuple[int, int]]]
+
+    def __init__(
+        self,
+        session_maker: Callable[[], Session],
+        catalog: CatalogCache,
+        queues: QueueEngine,
+        window: float = 0.25,
+    ) -> None:
+        """
+        :param session_maker: The function that returns a new SQLAlchemy \
+            session, used if the queue of the restaurant has to be loaded.
+        :param catalog: The catalog cache used to load the queues.
+        :param queues: The queue engine the queues are read from.
+        :param window: The number of seconds the changes of a restaurant \
+            are collected for before its queues are recomputed.
+        """
+
+        self.__session_maker = session_maker
+        self.__catalog = catalog
+        self.__queues = queues
+        self.__window = window
+        self.__senders = {}
+        self.__flushes = {}
+        self.__sent = {}
+        self.__broadcast = {}
+
+    def mark_changed(
+        self,
+        restaurant_id: int,
+        send: QueueSender | None,
+        broadcast: QueueBroadcaster | None = None,
+    ) -> None:
+        """
+        Marks the queue of the restaurant as changed. The queues are sent
+        with the last given `send` and `broadcast` once the window is over.
+        """
+
+        self.__senders[restaurant_id] = (send, broadcast)
+
+        loop = asyncio.get_running_loop()
+        flush = self.__flushes.get(restaurant_id)
+
+        # the flush is bound to the event loop that started it
+        if flush is not None and not flush.done() and flush.get_loop() is loop:
+            return
+
+        self.__flushes[restaurant_id] = loop.create_task(
+            self.__flush_later(restaurant_id)
+        )
+
+    async def __flush_later(self, restaurant_id: int) -> None:
+        await asyncio.sleep(self.__window)
+
+        # the changes marked from now on start a new window
+        del self.__flushes[restaurant_id]
+        send, broadcast = self.__senders.pop(restaurant_id)
+
+        try:
+            await self.notify(restaurant_id, send, broadcast)
+        except Exception:
+            logger.exception(
+                f"failed to notify the queues of restaurant {restaurant_id}"
+            )
+
+    async def notify(
+        self,
+        restaurant_id: int,
+        send: QueueSender | None,
+        broadcast: QueueBroadcaster | None = None,
+    ) -> None:
+        """
+        Sends the queues of the restaurant's orders that have changed since
+        they were last sent, and broadcasts all of them if any has changed
+        since they were last broadcast.
+        """
+
+        session = self.__session_maker()
+
+        try:
+            queues = self.__queues.queues_of_orders(
+                session, self.__catalog, restaurant_id
+            )
+        finally:
+            session.close()
+
+        if broadcast is not None:
+            orders = [
+                (queued_order.order_id, queued_order.prep_time)
+                for queued_order, _ in queues
+            ]
+
+            if self.__broadcast.get(restaurant_id, []) != orders:
+                await broadcast(restaurant_id, queues)
+
+            if orders:
+                self.__broadcast[restaurant_id] = orders
+            else:
+                self.__broadcast.pop(restaurant_id, None)
+
+        if send is None:
+            return
+
+        last_sent = self.__sent.get(restaurant_id, {})
+        sent: dict[int, Queue] = {}
+
+        for queued_order, queue in queues:
+            sent[queued_order.order_id] = queue
+
+            if last_sent.get(queued_order.order_id) != queue:
+                await send(queued_order, queue)
+
+        # the orders that left the queue are forgotten
+        if sent:
+            self.__sent[restaurant_id] = sent
+        else:
+            self.__sent.pop(restaurant_id, None)
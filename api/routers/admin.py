@@ -1,14 +1,22 @@
-#need admin token to access these routes
-
 from fastapi import APIRouter, Depends
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.dependencies.event import get_event
+from api.dependencies.id import get_admin_id
 from api.dependencies.state import get_state
 from api.state import State
 from api.crud.admin import create_tag, create_restaurant_tag
+from api.crud.order import archive_finished_orders
+from api.event import Event
+from api.schemas.catalog import CatalogCacheStatistics
+from api.schemas.event import EventStatistics
 from api.schemas.Tag import RestaurantTagCreate as RestaurantTagCreateSchema
 
+# every route requires an administrator token, see `api.admin_token`
 router = APIRouter(
     prefix="/admin",
     tags=["admin"],
+    dependencies=[Depends(get_admin_id)],
 )
 
 @router.post(
@@ -30,4 +38,60 @@ async def create_restaurant_tag_api(
     payload: RestaurantTagCreateSchema, 
     state : State = Depends(get_state),
 ) -> int : 
-    return await create_restaurant_tag(state, payload)
\ No newline at end of file
+    return await create_restaurant_tag(state, payload)
+
+
+@router.get(
+    "/catalog_cache",
+    description="Gets the hit and miss counters of the catalog cache.",
+)
+async def get_catalog_cache_statistics_api(
+    configuration: Configuration = Depends(get_configuration),
+) -> CatalogCacheStatistics:
+    catalog_cache = configuration.catalog_cache
+
+    return CatalogCacheStatistics(
+        hits=catalog_cache.hits,
+        misses=catalog_cache.misses,
+        size=catalog_cache.size,
+    )
+
+
+@router.get(
+    "/events",
+    description="""
+        Gets the counters of the notification buffers of the SSE listeners
+        of this worker.
+    """,
+)
+async def get_event_statistics_api(
+    event: Event = Depends(get_event),
+) -> EventStatistics:
+    statistics = event.statistics
+
+    return EventStatistics(
+        listeners=event.listener_count,
+        users=event.user_count,
+        dropped=statistics.dropped,
+        collapsed=statistics.collapsed,
+        disconnected=statistics.disconnected,
+        high_water_mark=statistics.high_water_mark,
+    )
+
+
+@router.post(
+    "/archive_orders",
+    description="""
+        Moves the settled and cancelled orders older than `ORDER_ARCHIVE_AGE`
+        out of the hot partition of the orders. Meant to be called
+        periodically with an administrator token. Returns the number of
+        archived orders.
+    """,
+)
+async def archive_orders_api(
+    configuration: Configuration = Depends(get_configuration),
+    state: State = Depends(get_state),
+) -> int:
+    return await archive_finished_orders(
+        state, configuration.order_archive_age
+    )
@@ -2,6 +2,7 @@ from typing import List
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     Response,
     UploadFile,
     File,
@@ -19,17 +20,21 @@ from api.crud.canteen import (
     get_canteen_img,
     get_nearest_restaurants,
     get_canteen_by_restaurant_id,
+    get_canteen_queues,
 )
 
 from api.dependencies.configuration import get_configuration
 from api.dependencies.state import get_state
 
 from api.schemas.restaurant import Restaurant
-from api.schemas.canteen import Canteen, CanteenBase
+from api.schemas.canteen import Canteen, CanteenBase, CanteenQueue
 
 
 from api.state import State
 
+import hashlib
+import json
+
 router = APIRouter(
     prefix="/canteens",
     tags=["canteen"],
@@ -122,6 +127,55 @@ async def get_restaurants_in_canteen_api(
     return await get_restaurants_in_canteen(state, canteen_id)
 
 
+def __queues_etag(queues: List[CanteenQueue]) -> str:
+    content = json.dumps([queue.model_dump() for queue in queues])
+
+    return f'"{hashlib.sha256(content.encode()).hexdigest()[:32]}"'
+
+
+def __etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if if_none_match is None:
+        return False
+
+    # the weak comparison of RFC 9110, a weak tag matches its strong one
+    return any(
+        candidate.strip().removeprefix("W/") in ("*", etag)
+        for candidate in if_none_match.split(",")
+    )
+
+
+@router.get(
+    "/{canteen_id}/queues",
+    description="""
+        Gets the queue of every restaurant in the canteen. The response has
+        an `ETag`; a request whose `If-None-Match` matches the current one
+        gets an empty `304 Not Modified`.
+    """,
+    response_model=List[CanteenQueue],
+    responses={304: {"description": "The queues haven't changed"}},
+)
+async def get_canteen_queues_api(
+    canteen_id: int,
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+    state: State = Depends(get_state),
+) -> List[CanteenQueue] | Response:
+    queues = await get_canteen_queues(state, canteen_id)
+    etag = __queues_etag(queues)
+
+    # the boards poll, they must revalidate every time
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if __etag_matches(etag, if_none_match):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+
+    response.headers.update(headers)
+
+    return queues
+
+
 @router.put(
     "/{canteen_id}/img",
     description="""
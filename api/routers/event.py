@@ -1,33 +1,70 @@
-from typing import AsyncGenerator
-from fastapi import APIRouter, Depends, Request
+from typing import AsyncGenerator, List
+from fastapi import APIRouter, Depends, Header, Query, Request
 
 from sse_starlette import EventSourceResponse
 
+from api.crud.order import authorize_queue_subscriptions
 from api.dependencies.id import Role, get_user
 from api.dependencies.event import get_event
+from api.dependencies.state import get_state
 
-from api.event import Event, User, Listener
+from api.errors import InvalidArgumentError
+from api.event import Event, User, Listener, encode_frame
+from api.schemas.event import ResyncRequiredNotification
+from api.state import State
 
+import re
 
 router = APIRouter(
     prefix="/events",
     tags=["event"],
 )
 
+MAX_TOPICS = 32
+"""The maximum number of topics a single stream can subscribe to."""
+
+__TOPIC = re.compile(r"restaurant:[0-9]+:queue")
+
+
+def __parse_topics(topics: list[str]) -> tuple[str, ...]:
+    if len(topics) > MAX_TOPICS:
+        raise InvalidArgumentError(
+            f"can't subscribe to more than {MAX_TOPICS} topics"
+        )
+
+    for topic in topics:
+        if not __TOPIC.fullmatch(topic):
+            raise InvalidArgumentError(f"topic `{topic}` is not valid")
+
+    # subscribed once, in the given order
+    return tuple(dict.fromkeys(topics))
+
 
 async def event_generator(
     event: Event,
     listener: Listener,
-) -> AsyncGenerator[str, None]:
-    while True:
-        notification = await listener
+) -> AsyncGenerator[bytes, None]:
+    # the response cancels the generator once the client disconnects
+    try:
+        if listener.resync_required and listener.position is not None:
+            yield encode_frame(
+                listener.position,
+                ResyncRequiredNotification().model_dump_json().encode(),
+            )
+        elif listener.position is not None:
+            # lets a client that drops before its first notification resume
+            yield f"id: {listener.position}\r\n\r\n".encode()
 
-        if notification is None:
-            break
+        while True:
+            delivery = await listener
 
-        yield str(notification.model_dump_json())
+            if delivery is None:
+                break
 
-    event.remove_listener(listener)
+            # the frame is encoded once for all the listeners
+            yield delivery.frame
+    finally:
+        event.remove_listener(listener)
 
 
 @router.get(
@@ -38,14 +75,47 @@ async def event_generator(
         noficiation will be in JSON format. The schemas of the notifications
         are named in `*Notification` patterns e.g. 
         `OrderStatusChangeNotification`, `OrderQueueChangeNotification`.
+
+        Every notification has an SSE `id`. A client that reconnects with
+        the `Last-Event-ID` header gets the notifications it missed, or a
+        `ResyncRequiredNotification` first if they're no longer kept, in
+        which case it must fetch its orders and queues again.
+
+        The stream can subscribe to the queues of restaurants with the
+        `topics` query parameter, e.g. `?topics=restaurant:1:queue`. A
+        `RestaurantQueueNotification` is sent on every change of the queue,
+        the last one without an `id` as soon as the stream starts; the
+        customers find their orders in it to derive their positions. A
+        merchant can subscribe to the queues of its restaurants, a customer
+        to the queues it has an active order in.
     """,
     response_class=EventSourceResponse,
 )
-def get_events_api(
+async def get_events_api(
     request: Request,
     user: tuple[int, Role] = Depends(get_user),
     event: Event = Depends(get_event),
+    last_event_id: str | None = Header(default=None),
+    topics: List[str] = Query(default=[]),
+    state: State = Depends(get_state),
 ) -> EventSourceResponse:
-    connection = event.listens(User(user_id=user[0], role=user[1]), request)
+    parsed_topics = __parse_topics(topics)
+
+    await authorize_queue_subscriptions(
+        state,
+        user[0],
+        user[1],
+        [int(topic.split(":")[1]) for topic in parsed_topics],
+    )
+
+    # the stream doesn't use the session again
+    state.session.close()
+
+    connection = event.listens(
+        User(user_id=user[0], role=user[1]),
+        request,
+        last_event_id,
+        parsed_topics,
+    )
 
     return EventSourceResponse(event_generator(event, connection))
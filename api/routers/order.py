@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Body, Depends, Header, Query, Response
 from fastapi.security import HTTPBearer
 
 from api.crud.order import (
@@ -11,23 +11,41 @@ from api.crud.order import (
     get_order_queue,
     get_restaurant_queue,
     update_order_status,
+    update_order_statuses,
 )
 from api.dependencies.event import get_event, Event
+from api.dependencies.idempotency import get_idempotency_store
+from api.dependencies.ingestion import get_order_ingestion
+from api.dependencies.queues import get_queue_change_notifier
 from api.dependencies.state import get_state
 from api.errors import InvalidArgumentError
+from api.idempotency import IdempotencyStore
+from api.ingestion import OrderIngestion
+from api.queues import QueueChangeNotifier
 from api.schemas.order import (
     Order,
     OrderCreate,
     OrderItem,
     OrderStatus,
+    OrderStatusBulkUpdate,
+    OrderStatusBulkUpdateResult,
     OrderStatusFlag,
     OrderStatusUpdate,
     Queue,
 )
-from api.dependencies.id import Role, get_customer_id, get_user
+from api.dependencies.id import (
+    Role,
+    get_customer_id,
+    get_merchant_id,
+    get_user,
+)
 from api.state import State
 
 
+DEFAULT_ORDERS_PAGE_SIZE = 100
+MAX_ORDERS_PAGE_SIZE = 500
+MAX_BULK_STATUS_UPDATES = 100
+
 router = APIRouter(
     prefix="/orders",
     tags=["order"],
@@ -37,32 +55,64 @@ router = APIRouter(
 @router.post(
     "/",
     description="""
-        Creates a new order.
+        Creates a new order. If an `Idempotency-Key` header is given, retries
+        of the request with the same key return the ID of the order created
+        by the first request instead of creating a new order.
     """,
     dependencies=[Depends(HTTPBearer())],
 )
 async def create_order_api(
     payload: OrderCreate,
     customer_id: int = Depends(get_customer_id),
+    idempotency_key: str | None = Header(
+        default=None, alias="Idempotency-Key", max_length=255
+    ),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+    ingestion: OrderIngestion | None = Depends(get_order_ingestion),
     state: State = Depends(get_state),
 ) -> int:
-    return await create_order(state, customer_id, payload)
+    if idempotency_key is None:
+        return await create_order(state, customer_id, payload, ingestion)
+
+    return await idempotency_store.execute(
+        state,
+        customer_id,
+        idempotency_key,
+        lambda idempotency: create_order(
+            state, customer_id, payload, ingestion, idempotency
+        ),
+    )
 
 
 @router.get(
     "/",
     description="""
-        Gets all orders for the customer or merchant based on the JWT token.
+        Gets the orders for the customer or merchant based on the JWT token.
         If authenticated as a customer, the customer's orders are returned.
         If authenticated as a merchant, the orders of all restaurants owned by 
         the merchant are returned.
+
+        The orders are ordered by `ordered_at` and then by `id`, and are
+        returned in pages of at most `limit` orders. If there might be more
+        orders, the response carries an `X-Next-Cursor` header; pass its
+        value as `after_id` to get the next page; an `after_id` that isn't
+        one of the user's orders is rejected with 400. `ordered_after`
+        (inclusive) and `ordered_before` (exclusive) filter the orders by the
+        time they were placed.
     """,
     dependencies=[Depends(HTTPBearer())],
 )
 async def get_orders_api(
+    response: Response,
     user: tuple[int, Role] = Depends(get_user),
     restaurant_id: int | None = None,
     status: str | None = None,
+    after_id: int | None = None,
+    limit: int = Query(
+        default=DEFAULT_ORDERS_PAGE_SIZE, ge=1, le=MAX_ORDERS_PAGE_SIZE
+    ),
+    ordered_after: int | None = None,
+    ordered_before: int | None = None,
     state: State = Depends(get_state),
 ) -> list[Order]:
     try:
@@ -74,12 +124,23 @@ async def get_orders_api(
             split_status = status.split("|")
             statuses = [OrderStatusFlag[status] for status in split_status]
 
-        return [
-            await convert_to_schema(state, order)
-            for order in await get_orders(
-                state, id, role, restaurant_id, statuses
-            )
-        ]
+        orders = await get_orders(
+            state,
+            id,
+            role,
+            restaurant_id,
+            statuses,
+            after_id=after_id,
+            limit=limit,
+            ordered_after=ordered_after,
+            ordered_before=ordered_before,
+        )
+
+        # a full page means there might be more orders
+        if len(orders) == limit:
+            response.headers["X-Next-Cursor"] = str(orders[-1].id)
+
+        return [await convert_to_schema(state, order) for order in orders]
 
     except KeyError as e:
         raise InvalidArgumentError(f"status flag {e} is not valid")
@@ -117,13 +178,41 @@ async def update_order_status_api(
     status: OrderStatusUpdate,
     user: tuple[int, Role] = Depends(get_user),
     event: Event = Depends(get_event),
+    notifier: QueueChangeNotifier | None = Depends(get_queue_change_notifier),
     state: State = Depends(get_state),
 ) -> str:
-    await update_order_status(state, event, user[0], user[1], order_id, status)
+    await update_order_status(
+        state, event, user[0], user[1], order_id, status, notifier
+    )
 
     return "success"
 
 
+@router.put(
+    "/status",
+    description="""
+        Updates the status of many orders of the merchant at once, following
+        the same rules as `PUT /orders/{order_id}/status`. The changes are
+        applied in one transaction; each of them succeeds or fails on its own
+        and the response reports the result of each change in the order they
+        were given. An order can appear only once in the request.
+    """,
+    dependencies=[Depends(HTTPBearer())],
+)
+async def update_order_statuses_api(
+    updates: list[OrderStatusBulkUpdate] = Body(
+        max_length=MAX_BULK_STATUS_UPDATES
+    ),
+    merchant_id: int = Depends(get_merchant_id),
+    event: Event = Depends(get_event),
+    notifier: QueueChangeNotifier | None = Depends(get_queue_change_notifier),
+    state: State = Depends(get_state),
+) -> list[OrderStatusBulkUpdateResult]:
+    return await update_order_statuses(
+        state, event, merchant_id, updates, notifier
+    )
+
+
 @router.get(
     "/{order_id}/queues",
     description="Gets the queue of the given order",
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, ConfigDict
+from api.schemas.order import Queue
 
 
 class CanteenBase(BaseModel):
@@ -11,3 +12,8 @@ class Canteen(CanteenBase):
     id: int
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class CanteenQueue(BaseModel):
+    restaurant_id: int
+    queue: Queue
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+
+
+class CatalogCacheStatistics(BaseModel):
+    """The counters of the in-process restaurant catalog cache."""
+
+    hits: int
+    misses: int
+    size: int
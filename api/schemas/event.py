@@ -13,6 +13,8 @@ class NotificationFlag(StrEnum):
 
     ORDER_STATUS_CHANGE = "ORDER_STATUS_CHANGE"
     ORDER_QUEUE_CHANGE = "ORDER_QUEUE_CHANGE"
+    RESYNC_REQUIRED = "RESYNC_REQUIRED"
+    RESTAURANT_QUEUE = "RESTAURANT_QUEUE"
 
 
 class OrderStatusChangeNotification(BaseModel):
@@ -44,7 +46,98 @@ class OrderQueueChangeNotification(BaseModel):
     queue: Queue
 
 
-Notification = OrderStatusChangeNotification | OrderQueueChangeNotification
+class QueueEntry(BaseModel):
+    """An active order in the queue of its restaurant."""
+
+    order_id: int
+    prep_time: int
+    """The estimated time to prepare the order."""
+
+
+class RestaurantQueueNotification(BaseModel):
+    """
+    Snapshot of the queue of a restaurant, broadcast to the subscribers of the
+    `restaurant:{id}:queue` topic whenever it changes. The active orders are
+    in the queue order; the queue in front of an order is the number of the
+    orders before it and the sum of their `prep_time`.
+    """
+
+    type: Literal[NotificationFlag.RESTAURANT_QUEUE] = (
+        NotificationFlag.RESTAURANT_QUEUE
+    )
+
+    restaurant_id: int
+    orders: list[QueueEntry]
+
+
+class ResyncRequiredNotification(BaseModel):
+    """
+    Sent first on a reconnection whose missed notifications are no longer
+    kept. The client must fetch its orders and queues again.
+    """
+
+    type: Literal[NotificationFlag.RESYNC_REQUIRED] = (
+        NotificationFlag.RESYNC_REQUIRED
+    )
+
+
+Notification = (
+    OrderStatusChangeNotification
+    | OrderQueueChangeNotification
+    | RestaurantQueueNotification
+)
 """
 Union of all possible notifications
 """
+
+
+@unique
+class OverflowPolicy(StrEnum):
+    """
+    What a listener does with a new notification once its buffer is full
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    """Drops the oldest buffered notification."""
+
+    COLLAPSE = "collapse"
+    """
+    Drops the buffered queue change of the same order or restaurant, which
+    the new one supersedes, or the oldest notification if there's none.
+    """
+
+    DISCONNECT = "disconnect"
+    """Disconnects the client, which has to reconnect to catch up."""
+
+
+@unique
+class QueueNotifications(StrEnum):
+    """
+    How the customers are told about the changes of the restaurant queues
+    """
+
+    ORDERS = "orders"
+    """
+    An `OrderQueueChangeNotification` to the customer of every order whose
+    queue changed.
+    """
+
+    RESTAURANTS = "restaurants"
+    """
+    A single `RestaurantQueueNotification` to the subscribers of the queue of
+    the restaurant.
+    """
+
+    BOTH = "both"
+    """Both of them."""
+
+
+class EventStatistics(BaseModel):
+    """The counters of the notification buffers of the listeners."""
+
+    listeners: int
+    users: int
+    dropped: int
+    collapsed: int
+    disconnected: int
+    high_water_mark: int
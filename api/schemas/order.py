@@ -143,3 +143,14 @@ class Order(OrderBase):
     price_paid: Decimal
     ordered_at: int
     model_config = ConfigDict(from_attributes=True)
+
+
+class OrderStatusBulkUpdate(BaseModel):
+    order_id: int
+    status: OrderStatusUpdate
+
+
+class OrderStatusBulkUpdateResult(BaseModel):
+    order_id: int
+    success: bool
+    error: str | None
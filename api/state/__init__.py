@@ -1,6 +1,9 @@
 from dataclasses import dataclass
 from sqlalchemy.orm import Session
 
+from api.catalog import CatalogCache
+from api.queues import QueueEngine
+from api.schemas.event import QueueNotifications
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
@@ -16,3 +19,20 @@ class State:
     """
     The sqlalchemy session object used to interact with the database.
     """
+
+    catalog: CatalogCache
+    """
+    The restaurant catalog cache shared across requests. It must be
+    invalidated whenever a menu, customization or option is modified.
+    """
+
+    queues: QueueEngine
+    """
+    The queues of the restaurants shared across requests. It must be told
+    about every order that enters or leaves the queue of a restaurant.
+    """
+
+    queue_notifications: QueueNotifications = QueueNotifications.BOTH
+    """
+    How the customers are told about the changes of the restaurant queues.
+    """
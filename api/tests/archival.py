@@ -0,0 +1,351 @@
+from datetime import timedelta
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from api.admin_token import issue_admin_token
+from api.configuration import Configuration
+from api.crud.order import archive_finished_orders
+from api.dependencies.configuration import get_configuration
+from api.state import State
+from api.tests.helpers import change_order_status, order_item, place_order
+from api import app
+
+import asyncio
+import pytest
+
+DAY = 24 * 60 * 60
+
+
+def test_archive_finished_orders(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "John",
+            "last_name": "Doe",
+            "username": "johndoe",
+            "email": "johndoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": "janedoe",
+            "email": "janedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Test Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_id: int = test_client.post(
+        "/restaurants/",
+        json={
+            "name": "Steak House",
+            "address": "address",
+            "canteen_id": canteen_id,
+            "location": {"lat": 0, "lng": 0},
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    menu_id: int = test_client.post(
+        f"/restaurants/{restaurant_id}/menus",
+        json={
+            "name": "steak",
+            "description": "a juicy steak",
+            "price": 10,
+            "estimated_prep_time": 10,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    assert (
+        test_client.put(
+            f"/restaurants/{restaurant_id}/open",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    (
+        settled_order_id,
+        cancelled_order_id,
+        preparing_order_id,
+        ordered_order_id,
+        recent_settled_order_id,
+    ) = [
+        place_order(
+            test_client, customer_jwt, restaurant_id, [order_item(menu_id)]
+        )
+        for _ in range(5)
+    ]
+
+    for order_id in (settled_order_id, recent_settled_order_id):
+        change_order_status(
+            test_client, order_id, merchant_jwt, {"type": "PREPARING"}
+        )
+        change_order_status(
+            test_client, order_id, merchant_jwt, {"type": "READY"}
+        )
+        change_order_status(
+            test_client, order_id, customer_jwt, {"type": "SETTLED"}
+        )
+
+    change_order_status(
+        test_client,
+        cancelled_order_id,
+        customer_jwt,
+        {"type": "CANCELLED", "reason": "changed my mind"},
+    )
+    change_order_status(
+        test_client, preparing_order_id, merchant_jwt, {"type": "PREPARING"}
+    )
+
+    # place the orders in the past, the settled one two months before the
+    # rest so that it lands in another monthly partition
+    with configuration_fixture.create_session() as session:
+        session.execute(
+            text(
+                "UPDATE order_ids SET ordered_at = ordered_at - :age "
+                "WHERE id = ANY(:ids)"
+            ),
+            {
+                "age": 90 * DAY,
+                "ids": [
+                    cancelled_order_id,
+                    preparing_order_id,
+                    ordered_order_id,
+                ],
+            },
+        )
+        session.execute(
+            text(
+                "UPDATE order_ids SET ordered_at = ordered_at - :age "
+                "WHERE id = :id"
+            ),
+            {"age": 150 * DAY, "id": settled_order_id},
+        )
+        session.commit()
+
+    # the orders were moved behind the back of the queue engine
+    configuration_fixture.queue_engine.invalidate(restaurant_id)
+
+    orders_before = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()
+
+    # only the administrators can archive the orders
+    admin_jwt = issue_admin_token(
+        configuration_fixture.jwt_secret, timedelta(minutes=5)
+    )
+
+    assert test_client.post("/admin/archive_orders").status_code == 403
+    assert (
+        test_client.post(
+            "/admin/archive_orders",
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 401
+    )
+
+    # the orders are moved in batches, one transaction each
+    with configuration_fixture.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration_fixture.catalog_cache,
+            queues=configuration_fixture.queue_engine,
+        )
+
+        with pytest.raises(ValueError):
+            asyncio.run(archive_finished_orders(state, 30 * DAY, 0))
+
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[tuple[str, Any]] = []
+    commits: list[None] = []
+
+    def record_statement(*args: Any):
+        statements.append((args[2], args[3]))
+
+    def record_commit(*args: Any):
+        commits.append(None)
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    event.listen(engine, "commit", record_commit)
+    try:
+        with configuration_fixture.create_session() as session:
+            state = State(
+                session=session,
+                catalog=configuration_fixture.catalog_cache,
+                queues=configuration_fixture.queue_engine,
+            )
+
+            archived = asyncio.run(
+                archive_finished_orders(state, 30 * DAY, batch_size=1)
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+        event.remove(engine, "commit", record_commit)
+
+    archive_statements = [
+        statement
+        for statement, _ in statements
+        if statement.lstrip().startswith(("CREATE", "UPDATE"))
+    ]
+
+    assert archived == 2
+
+    # the partitions of the months are created first, each on its own, then
+    # a batch is moved for each order and the last one is empty
+    kinds = [statement.split()[0] for statement in archive_statements]
+    creates = kinds.count("CREATE")
+
+    assert creates >= 2
+    assert kinds == ["CREATE"] * creates + ["UPDATE"] * 3
+    assert len(commits) >= len(archive_statements)
+
+    # nothing left to archive
+    archive_response = test_client.post(
+        "/admin/archive_orders",
+        headers={"Authorization": f"Bearer {admin_jwt}"},
+    )
+
+    assert archive_response.status_code == 200
+    assert archive_response.json() == 0
+
+    with configuration_fixture.create_session() as session:
+        partitions = dict(
+            session.execute(
+                text("SELECT id, tableoid::regclass::text FROM orders")
+            ).all()
+        )
+
+    assert partitions[settled_order_id].startswith("orders_archive_")
+    assert partitions[cancelled_order_id].startswith("orders_archive_")
+    assert partitions[settled_order_id] != partitions[cancelled_order_id]
+    assert partitions[preparing_order_id] == "orders_hot"
+    assert partitions[ordered_order_id] == "orders_hot"
+    assert partitions[recent_settled_order_id] == "orders_hot"
+
+    # the read APIs work across the partitions
+    assert (
+        test_client.get(
+            "/orders/",
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).json()
+        == orders_before
+    )
+
+    cancelled_order = test_client.get(
+        f"/orders/{cancelled_order_id}",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert cancelled_order.status_code == 200
+    assert cancelled_order.json()["status"]["reason"] == "changed my mind"
+
+    assert (
+        test_client.get(
+            f"/orders/{settled_order_id}/status",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()["type"]
+        == "SETTLED"
+    )
+
+    # the ongoing orders are still updatable and new orders still go to the
+    # hot partition
+    change_order_status(
+        test_client, ordered_order_id, merchant_jwt, {"type": "PREPARING"}
+    )
+
+    new_order_id = place_order(
+        test_client, customer_jwt, restaurant_id, [order_item(menu_id)]
+    )
+
+    assert new_order_id > recent_settled_order_id
+
+    # the queue is loaded from the hot partition only
+    configuration_fixture.queue_engine.invalidate(restaurant_id)
+
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[tuple[str, Any]] = []
+
+    def record_statement(*args: Any):
+        statements.append((args[2], args[3]))
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        queue_response = test_client.get(
+            "/orders/queues", params={"restaurant_id": restaurant_id}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    assert queue_response.status_code == 200
+
+    [(queue_statement, queue_parameters)] = [
+        (statement, parameters)
+        for statement, parameters in statements
+        if "FROM orders" in statement
+    ]
+
+    with engine.connect() as connection:
+        plan = "\n".join(
+            row[0]
+            for row in connection.exec_driver_sql(
+                f"EXPLAIN {queue_statement}", queue_parameters
+            )
+        )
+
+    assert "orders_hot" in plan
+    assert "orders_archive" not in plan
+
+    # the order IDs are unique across the partitions and referenced by the
+    # items of the orders
+    with configuration_fixture.create_session() as session:
+        session.execute(
+            text(
+                "CREATE TEMPORARY TABLE duplicate_order AS "
+                "SELECT * FROM orders WHERE id = :id"
+            ),
+            {"id": settled_order_id},
+        )
+        session.execute(
+            text(
+                "UPDATE duplicate_order "
+                "SET archived = false, ordered_at = ordered_at + 1"
+            )
+        )
+
+        with pytest.raises(IntegrityError, match="orders_id_fkey"):
+            session.execute(
+                text("INSERT INTO orders SELECT * FROM duplicate_order")
+            )
+
+        session.rollback()
+
+        with pytest.raises(IntegrityError, match="order_items_order_id_fkey"):
+            session.execute(
+                text(
+                    "INSERT INTO order_items (order_id, menu_id, quantity) "
+                    "VALUES (:order_id, :menu_id, 1)"
+                ),
+                {"order_id": new_order_id + 1000, "menu_id": menu_id},
+            )
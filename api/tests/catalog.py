@@ -0,0 +1,177 @@
+from fastapi.testclient import TestClient
+
+from api.bus import PostgresEventBus
+from api.catalog import CatalogCache
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api import app
+
+import pytest
+import time
+
+
+def test_catalog_cache(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Catalog",
+            "last_name": "Merchant",
+            "username": "catalogmerchant",
+            "email": "catalogmerchant@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Catalog Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    def add_restaurant(name: str) -> tuple[int, list[int]]:
+        restaurant_id: int = test_client.post(
+            "/restaurants/",
+            json={
+                "name": name,
+                "address": "address",
+                "canteen_id": canteen_id,
+                "location": {"lat": 0, "lng": 0},
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()
+
+        menu_ids: list[int] = [
+            test_client.post(
+                f"/restaurants/{restaurant_id}/menus",
+                json={
+                    "name": f"{name} menu {i}",
+                    "description": "a menu",
+                    "price": 10,
+                    "estimated_prep_time": 5,
+                },
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).json()
+            for i in range(2)
+        ]
+
+        return restaurant_id, menu_ids
+
+    restaurants = [add_restaurant(f"Catalog {i}") for i in range(3)]
+
+    with pytest.raises(ValueError):
+        CatalogCache(max_restaurants=0)
+
+    cache = CatalogCache(max_restaurants=2)
+
+    with configuration_fixture.create_session() as session:
+        for restaurant_id, _ in restaurants[:2]:
+            cache.get(session, restaurant_id)
+
+        # the first catalog is used again, the second one is evicted first
+        first_menu = cache.get_menu(session, restaurants[0][1][0])
+
+        assert first_menu is not None and first_menu.name == "Catalog 0 menu 0"
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        cache.get(session, restaurants[2][0])
+
+        assert (cache.size, cache.menu_count) == (2, 4)
+
+        cache.get(session, restaurants[0][0])
+
+        assert (cache.hits, cache.misses) == (2, 3)
+
+        cache.get(session, restaurants[1][0])
+
+        # the index of the menus is bounded along with the catalogs
+        assert (cache.hits, cache.misses) == (2, 4)
+        assert (cache.size, cache.menu_count) == (2, 4)
+
+        cache.invalidate(restaurants[0][0])
+
+        assert (cache.size, cache.menu_count) == (1, 2)
+
+    # updating a menu invalidates the catalog cached by the application
+    restaurant_id, menu_ids = restaurants[0]
+    catalog_cache = configuration_fixture.catalog_cache
+
+    def get_menus() -> list[dict[str, object]]:
+        response = test_client.get(f"/restaurants/{restaurant_id}/menus")
+
+        assert response.status_code == 200
+
+        return response.json()
+
+    get_menus()
+    misses = catalog_cache.misses
+
+    assert get_menus()[0]["price"] == "10.00"
+    assert catalog_cache.misses == misses
+
+    assert (
+        test_client.put(
+            f"/restaurants/menus/{menu_ids[0]}",
+            json={
+                "name": "Catalog 0 menu 0",
+                "description": "a pricier menu",
+                "price": 12,
+                "estimated_prep_time": 7,
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    updated_menu = next(
+        menu for menu in get_menus() if menu["id"] == menu_ids[0]
+    )
+
+    assert catalog_cache.misses == misses + 1
+    assert (updated_menu["price"], updated_menu["estimated_prep_time"]) == (
+        "12.00",
+        7,
+    )
+
+
+def test_catalog_caches_across_workers(configuration_fixture: Configuration):
+    engine = configuration_fixture.create_session().get_bind().engine
+    buses = [PostgresEventBus(engine, "test_catalogs") for _ in range(2)]
+
+    # the catalog caches of two workers
+    first, second = [CatalogCache(bus=bus) for bus in buses]
+    restaurant_id = 1_000_000
+
+    try:
+        with configuration_fixture.create_session() as session:
+            first.get(session, restaurant_id)
+            second.get(session, restaurant_id)
+
+            first.invalidate(restaurant_id)
+
+            assert first.size == 0
+
+            # evicted by the other worker as well
+            deadline = time.monotonic() + 10
+
+            while second.size != 0:
+                assert time.monotonic() < deadline
+
+                time.sleep(0.05)
+
+            # its own invalidation doesn't evict the catalog loaded again
+            first.get(session, restaurant_id)
+            time.sleep(0.5)
+            first.get(session, restaurant_id)
+
+            assert (first.hits, first.misses) == (1, 2)
+    finally:
+        for bus in buses:
+            bus.close()
@@ -61,4 +61,7 @@ def configuration_fixture(
                 SessionLocal,
                 "secret",
                 temp_dir.name,
+                # the test client runs every request in its own event loop,
+                # notify the queue changes within the request
+                queue_notification_window=0,
             )
@@ -0,0 +1,741 @@
+from multiprocessing.queues import Queue as ProcessQueue
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from starlette.types import Message
+from sqlalchemy import Engine, create_engine
+from sse_starlette import ServerSentEvent
+from api.bus import MAX_PAYLOAD_SIZE, PostgresEventBus, split_chunks
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.dependencies.event import get_event
+from api.dependencies.id import Role, get_admin_id, get_user
+from api.event import (
+    Delivery,
+    Event,
+    Listener,
+    User,
+    encode_frame,
+    restaurant_queue_topic,
+)
+from api.routers.event import event_generator
+from api.schemas.event import (
+    OrderQueueChangeNotification,
+    OrderStatusChangeNotification,
+    OverflowPolicy,
+    QueueEntry,
+    RestaurantQueueNotification,
+    ResyncRequiredNotification,
+)
+from api.schemas.order import OrderedOrder, Queue
+from api import app
+
+import asyncio
+import multiprocessing
+import pytest
+import threading
+
+
+class FakeConnection:
+    """An SSE connection whose disconnection is controlled by the test."""
+
+    disconnected: bool
+    receive_calls: int
+
+    def __init__(self) -> None:
+        self.disconnected = False
+        self.receive_calls = 0
+
+    async def receive(self) -> Message:
+        self.receive_calls += 1
+
+        # the request cancels the receive if nothing is available
+        while not self.disconnected:
+            await asyncio.sleep(3600)
+
+        return {"type": "http.disconnect"}
+
+    def request(self) -> Request:
+        return Request({"type": "http"}, self.receive)
+
+
+def queue_notification(
+    order_id: int, queue_count: int = 1
+) -> OrderQueueChangeNotification:
+    return OrderQueueChangeNotification(
+        order_id=order_id,
+        queue=Queue(queue_count=queue_count, estimated_time=5),
+    )
+
+
+def queue_delivery(order_id: int) -> Delivery:
+    notification = queue_notification(order_id)
+
+    return Delivery(
+        id=f"test:{order_id}",
+        notification=notification,
+        frame=encode_frame(
+            f"test:{order_id}", notification.model_dump_json().encode()
+        ),
+    )
+
+
+def parse_frame(frame: bytes) -> ServerSentEvent:
+    assert frame.endswith(b"\r\n\r\n")
+
+    fields = dict(
+        line.split(": ", 1) for line in frame.decode().split("\r\n") if line
+    )
+
+    return ServerSentEvent(id=fields.get("id"), data=fields.get("data"))
+
+
+def status_notification(order_id: int) -> OrderStatusChangeNotification:
+    return OrderStatusChangeNotification(
+        order_id=order_id, status=OrderedOrder()
+    )
+
+
+def test_listener_wakes_up():
+    asyncio.run(listen())
+
+
+async def listen():
+    user = User(user_id=1, role=Role.CUSTOMER)
+    connection = FakeConnection()
+    listener = Listener(user, connection.request(), 0.1)
+
+    # the deliveries added before waiting are returned right away
+    listener.add_delivery(queue_delivery(1))
+
+    assert await listener == queue_delivery(1)
+
+    # a waiting listener is woken up by the notification, also from another
+    # thread
+    waiting = asyncio.ensure_future(listener.next())
+    await asyncio.sleep(0.01)
+
+    assert not waiting.done()
+
+    listener.add_delivery(queue_delivery(2))
+
+    assert await asyncio.wait_for(waiting, 1) == queue_delivery(2)
+
+    waiting = asyncio.ensure_future(listener.next())
+    await asyncio.sleep(0.01)
+
+    thread = threading.Thread(
+        target=listener.add_delivery, args=(queue_delivery(3),)
+    )
+    thread.start()
+    thread.join()
+
+    assert await asyncio.wait_for(waiting, 1) == queue_delivery(3)
+
+    # an idle listener only checks the connection once per interval
+    connection.receive_calls = 0
+    waiting = asyncio.ensure_future(listener.next())
+    await asyncio.sleep(0.35)
+
+    assert not waiting.done()
+    assert connection.receive_calls <= 4
+
+    # and notices the disconnection at the next check
+    connection.disconnected = True
+
+    assert await asyncio.wait_for(waiting, 1) is None
+
+    # the generator removes its listener when it's cancelled by the
+    # response on disconnection
+    event = Event(disconnect_check_interval=0.1)
+    listening_connection = FakeConnection()
+    generator = event_generator(
+        event, event.listens(user, listening_connection.request())
+    )
+
+    await event.add_notification(user, queue_notification(4))
+
+    # the stream starts with the position the client would resume from
+    assert parse_frame(await anext(generator)).data is None
+    assert parse_frame(await anext(generator)).data == (
+        queue_notification(4).model_dump_json()
+    )
+
+    streaming = asyncio.ensure_future(anext(generator))
+    await asyncio.sleep(0.01)
+    streaming.cancel()
+
+    try:
+        await streaming
+    except asyncio.CancelledError:
+        pass
+
+    # nobody is listening anymore, the disconnection is not checked
+    listening_connection.receive_calls = 0
+    await event.add_notification(user, queue_notification(5))
+
+    assert listening_connection.receive_calls == 0
+
+    # publishing never checks the connections, the reaper does
+    event = Event(disconnect_check_interval=3600, reap_interval=0.05)
+    connections = [FakeConnection() for _ in range(3)]
+    other_user = User(user_id=2, role=Role.CUSTOMER)
+    listeners = [
+        event.listens(user, connections[0].request()),
+        event.listens(user, connections[1].request()),
+        event.listens(other_user, connections[2].request()),
+    ]
+
+    assert (event.listener_count, event.user_count) == (3, 2)
+
+    for connection in connections:
+        connection.disconnected = True
+
+    connections[1].disconnected = False
+    await event.add_notification(user, queue_notification(6))
+
+    assert all(connection.receive_calls == 0 for connection in connections)
+    delivered = await listeners[1]
+
+    assert delivered is not None
+    assert delivered.notification == queue_notification(6)
+
+    await asyncio.sleep(0.2)
+
+    # the users without listeners are dropped
+    assert (event.listener_count, event.user_count) == (1, 1)
+
+    event.remove_listener(listeners[1])
+
+    assert (event.listener_count, event.user_count) == (0, 0)
+    assert await event.reap() == 0
+
+
+def test_notification_shared_by_listeners():
+    asyncio.run(share_notification())
+
+
+async def share_notification():
+    customer = User(user_id=1, role=Role.CUSTOMER)
+    merchant = User(user_id=1, role=Role.MERCHANT)
+    event = Event()
+    listeners = [
+        event.listens(user, FakeConnection().request())
+        for user in (customer, customer, merchant)
+    ]
+    notification = status_notification(1)
+
+    await event.add_notification(customer, notification)
+    await event.add_notification(merchant, notification)
+
+    deliveries = [await listener for listener in listeners]
+
+    # the listeners of a user share the delivery and its encoded frame
+    assert deliveries[0] is deliveries[1]
+    assert deliveries[0] is not None and deliveries[2] is not None
+
+    customer_frame = parse_frame(deliveries[0].frame)
+    merchant_frame = parse_frame(deliveries[2].frame)
+
+    assert customer_frame.data == merchant_frame.data == (
+        notification.model_dump_json()
+    )
+    assert customer_frame.id != merchant_frame.id
+
+
+def test_listener_buffer_overflow():
+    asyncio.run(overflow_buffers())
+
+
+async def overflow_buffers():
+    user = User(user_id=1, role=Role.CUSTOMER)
+
+    async def drain(listener: Listener) -> list[object]:
+        notifications: list[object] = []
+
+        while True:
+            try:
+                delivery = await asyncio.wait_for(listener.next(), 0.05)
+            except TimeoutError:
+                return notifications
+
+            if delivery is None:
+                notifications.append(None)
+                return notifications
+
+            notifications.append(delivery.notification)
+
+    # the oldest notifications are given up for the new ones
+    event = Event(buffer_size=3, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    listener = event.listens(user, FakeConnection().request())
+
+    for order_id in range(5):
+        await event.add_notification(user, status_notification(order_id))
+
+    assert await drain(listener) == [
+        status_notification(order_id) for order_id in (2, 3, 4)
+    ]
+    assert (
+        event.statistics.dropped,
+        event.statistics.high_water_mark,
+    ) == (2, 3)
+
+    # the new queue of an order supersedes the buffered one
+    event = Event(buffer_size=3, overflow_policy=OverflowPolicy.COLLAPSE)
+    listener = event.listens(user, FakeConnection().request())
+
+    await event.add_notification(user, status_notification(1))
+    await event.add_notification(user, queue_notification(1, 3))
+    await event.add_notification(user, queue_notification(2, 4))
+    await event.add_notification(user, queue_notification(1, 2))
+    await event.add_notification(user, queue_notification(1, 1))
+
+    # nothing left to collapse, the oldest is dropped
+    await event.add_notification(user, queue_notification(3, 5))
+
+    assert await drain(listener) == [
+        queue_notification(2, 4),
+        queue_notification(1, 1),
+        queue_notification(3, 5),
+    ]
+    assert (event.statistics.collapsed, event.statistics.dropped) == (2, 1)
+
+    # a buffer must hold at least one notification
+    with pytest.raises(ValueError):
+        Event(buffer_size=0)
+
+    with pytest.raises(ValueError):
+        Listener(user, FakeConnection().request(), buffer_size=0)
+
+    # the slow consumer is disconnected, the others aren't affected
+    event = Event(buffer_size=2, overflow_policy=OverflowPolicy.DISCONNECT)
+    slow_listener = event.listens(user, FakeConnection().request())
+
+    for order_id in range(3):
+        await event.add_notification(user, status_notification(order_id))
+
+    fast_listener = event.listens(user, FakeConnection().request())
+    await event.add_notification(user, status_notification(3))
+
+    assert await drain(slow_listener) == [None]
+    assert await drain(fast_listener) == [status_notification(3)]
+    assert event.statistics.disconnected == 1
+
+    # the counters are exposed to the administrators
+    app.dependency_overrides[get_event] = lambda: event
+    app.dependency_overrides[get_admin_id] = lambda: 0
+
+    try:
+        statistics = TestClient(app).get("/admin/events")
+    finally:
+        del app.dependency_overrides[get_event]
+        del app.dependency_overrides[get_admin_id]
+
+    assert statistics.json() == {
+        "listeners": 2,
+        "users": 1,
+        "dropped": 0,
+        "collapsed": 0,
+        "disconnected": 1,
+        "high_water_mark": 2,
+    }
+
+
+def test_listener_resumption():
+    asyncio.run(resume())
+
+
+async def resume():
+    user = User(user_id=1, role=Role.CUSTOMER)
+    other_user = User(user_id=2, role=Role.CUSTOMER)
+    event = Event(replay_window=3, replay_users=2)
+
+    async def stream(last_event_id: str | None) -> list[ServerSentEvent]:
+        generator = event_generator(
+            event,
+            event.listens(user, FakeConnection().request(), last_event_id),
+        )
+        events: list[ServerSentEvent] = []
+
+        try:
+            while True:
+                events.append(
+                    parse_frame(await asyncio.wait_for(anext(generator), 0.05))
+                )
+        except TimeoutError:
+            return events
+        finally:
+            await generator.aclose()
+
+    # a new stream starts with its position, before any notification
+    [start] = await stream(None)
+
+    assert start.data is None
+
+    for order_id in range(1, 4):
+        await event.add_notification(user, queue_notification(order_id))
+
+    # only the missed notifications are replayed
+    replayed = await stream(start.id)
+
+    assert [sent.data for sent in replayed] == [
+        queue_notification(order_id).model_dump_json()
+        for order_id in (1, 2, 3)
+    ]
+    assert [sent.data for sent in await stream(replayed[0].id)] == [
+        queue_notification(order_id).model_dump_json() for order_id in (2, 3)
+    ]
+
+    # the notifications of the other users don't count
+    await event.add_notification(other_user, queue_notification(9))
+
+    # nothing missed, the stream starts with its position again
+    assert [sent.data for sent in await stream(replayed[-1].id)] == [None]
+
+    await event.add_notification(user, queue_notification(4))
+
+    [last] = await stream(replayed[-1].id)
+
+    assert last.data == queue_notification(4).model_dump_json()
+
+    # the window was exceeded, an unknown ID or one of another worker
+    for last_event_id in (start.id, "garbage", f"other{last.id}"):
+        [resync] = await stream(last_event_id)
+
+        assert resync.data == ResyncRequiredNotification().model_dump_json()
+
+        # and resuming from the marker misses nothing
+        assert [sent.data for sent in await stream(resync.id)] == [None]
+
+    # a user forgotten to make room for the others can't resume either
+    for user_id in (3, 4):
+        await event.add_notification(
+            User(user_id=user_id, role=Role.CUSTOMER), queue_notification(7)
+        )
+
+    [resync] = await stream(replayed[-1].id)
+
+    assert resync.data == ResyncRequiredNotification().model_dump_json()
+
+
+def test_topic_subscriptions(configuration_fixture: Configuration):
+    asyncio.run(subscribe_to_topics(configuration_fixture))
+
+
+async def subscribe_to_topics(configuration: Configuration):
+    topic = restaurant_queue_topic(1)
+    event = Event()
+    subscribers = [
+        event.listens(
+            User(user_id=user_id, role=Role.CUSTOMER),
+            FakeConnection().request(),
+            topics=(topic,),
+        )
+        for user_id in (1, 2)
+    ]
+    other = event.listens(
+        User(user_id=3, role=Role.CUSTOMER),
+        FakeConnection().request(),
+        topics=(restaurant_queue_topic(2),),
+    )
+    snapshot = RestaurantQueueNotification(
+        restaurant_id=1,
+        orders=[
+            QueueEntry(order_id=order_id, prep_time=prep_time)
+            for order_id, prep_time in ((5, 60), (7, 30), (8, 90))
+        ],
+    )
+
+    await event.publish(topic, snapshot)
+
+    # a single delivery and frame for all the subscribers
+    deliveries = [await subscriber for subscriber in subscribers]
+
+    assert deliveries[0] is deliveries[1]
+    assert deliveries[0] is not None
+    assert deliveries[0].notification == snapshot
+
+    with pytest.raises(TimeoutError):
+        await asyncio.wait_for(other.next(), 0.05)
+
+    # each customer finds its order in the snapshot
+    sent = RestaurantQueueNotification.model_validate_json(
+        parse_frame(deliveries[0].frame).data or ""
+    )
+    index = [entry.order_id for entry in sent.orders].index(8)
+
+    assert Queue(
+        queue_count=index,
+        estimated_time=sum(entry.prep_time for entry in sent.orders[:index]),
+    ) == Queue(queue_count=2, estimated_time=90)
+
+    # a new subscriber starts with its position and the last snapshot,
+    # which doesn't move the position back
+    generator = event_generator(
+        event,
+        event.listens(
+            User(user_id=4, role=Role.CUSTOMER),
+            FakeConnection().request(),
+            topics=(topic,),
+        ),
+    )
+
+    try:
+        start = parse_frame(await anext(generator))
+        retained = parse_frame(await anext(generator))
+    finally:
+        await generator.aclose()
+
+    assert start.data is None and start.id is not None
+    assert (retained.id, retained.data) == (None, snapshot.model_dump_json())
+
+    # a resumed stream gets the snapshots it missed along with the
+    # notifications of its user
+    await event.add_notification(
+        User(user_id=1, role=Role.CUSTOMER), status_notification(5)
+    )
+    await event.publish(topic, snapshot)
+
+    resumed = event.listens(
+        User(user_id=1, role=Role.CUSTOMER),
+        FakeConnection().request(),
+        start.id,
+        (topic,),
+    )
+
+    assert [(await resumed).notification for _ in range(2)] == [
+        status_notification(5),
+        snapshot,
+    ]
+
+    # only the topics of the restaurant queues can be subscribed to, and
+    # only by the users with orders there
+    app.dependency_overrides[get_configuration] = lambda: configuration
+    app.dependency_overrides[get_event] = lambda: event
+    app.dependency_overrides[get_user] = lambda: (1, Role.CUSTOMER)
+
+    try:
+        for topics in (["restaurant:x:queue"], ["orders"], ["a"] * 33):
+            response = TestClient(app).get(
+                "/events/", params={"topics": topics}
+            )
+
+            assert response.status_code == 400
+
+        response = TestClient(app).get(
+            "/events/", params={"topics": [restaurant_queue_topic(1_000_000)]}
+        )
+
+        assert response.status_code == 403
+    finally:
+        del app.dependency_overrides[get_event]
+        del app.dependency_overrides[get_user]
+
+
+def test_event_bus_across_processes(configuration_fixture: Configuration):
+    database_url = (
+        configuration_fixture.create_session()
+        .get_bind()
+        .engine.url.render_as_string(hide_password=False)
+    )
+
+    # a second worker process, with its own event and listeners
+    context = multiprocessing.get_context("spawn")
+    ready: ProcessQueue[bool] = context.Queue()
+    received: ProcessQueue[str | None] = context.Queue()
+    worker = context.Process(
+        target=run_worker, args=(database_url, ready, received)
+    )
+    worker.start()
+
+    try:
+        assert ready.get(timeout=30)
+
+        asyncio.run(publish_to_worker(database_url, received))
+    finally:
+        worker.join(timeout=30)
+
+        if worker.is_alive():
+            worker.kill()
+
+    assert worker.exitcode == 0
+
+
+async def publish_to_worker(
+    database_url: str, received: "ProcessQueue[str | None]"
+):
+    bus = PostgresEventBus(create_engine(database_url), channel="test_events")
+    event = Event(bus=bus)
+    merchant = User(user_id=2, role=Role.MERCHANT)
+    listener = event.listens(merchant, FakeConnection().request())
+
+    try:
+        # the customer listens on the other worker only
+        await event.add_notification(
+            User(user_id=1, role=Role.CUSTOMER), queue_notification(1)
+        )
+
+        assert received.get(timeout=10) == (
+            queue_notification(1).model_dump_json()
+        )
+
+        # and the reply of the other worker reaches the listener here
+        delivery = await asyncio.wait_for(listener.next(), 10)
+
+        assert delivery is not None
+        assert delivery.notification == queue_notification(2)
+    finally:
+        bus.close()
+
+
+def run_worker(
+    database_url: str,
+    ready: "ProcessQueue[bool]",
+    received: "ProcessQueue[str | None]",
+):
+    asyncio.run(worker(database_url, ready, received))
+
+
+async def worker(
+    database_url: str,
+    ready: "ProcessQueue[bool]",
+    received: "ProcessQueue[str | None]",
+):
+    bus = PostgresEventBus(create_engine(database_url), channel="test_events")
+    event = Event(bus=bus)
+    customer = User(user_id=1, role=Role.CUSTOMER)
+    listener = event.listens(customer, FakeConnection().request())
+
+    ready.put(True)
+
+    try:
+        delivery = await asyncio.wait_for(listener.next(), 10)
+        received.put(
+            delivery.notification.model_dump_json() if delivery else None
+        )
+
+        await event.add_notification(
+            User(user_id=2, role=Role.MERCHANT), queue_notification(2)
+        )
+
+        # the bus publishes in the background
+        await asyncio.sleep(1)
+    finally:
+        bus.close()
+
+
+def test_event_bus_large_messages(configuration_fixture: Configuration):
+    # the characters aren't split between the chunks
+    message = "snapshot é 😀 " * 1000
+    chunks = split_chunks(message, 7)
+
+    assert "".join(chunks) == message
+    assert all(0 < len(chunk.encode()) <= 7 for chunk in chunks)
+    assert split_chunks("") == [""]
+
+    engine = configuration_fixture.create_session().get_bind().engine
+
+    asyncio.run(publish_large_snapshot(engine))
+
+
+async def publish_large_snapshot(engine: Engine):
+    buses = [PostgresEventBus(engine, "test_large_events") for _ in range(2)]
+    publisher, subscriber = [Event(bus=bus) for bus in buses]
+    topic = restaurant_queue_topic(1)
+    listener = subscriber.listens(
+        User(user_id=1, role=Role.CUSTOMER),
+        FakeConnection().request(),
+        topics=(topic,),
+    )
+
+    # far larger than a `NOTIFY` payload
+    snapshot = RestaurantQueueNotification(
+        restaurant_id=1,
+        orders=[
+            QueueEntry(order_id=order_id, prep_time=10)
+            for order_id in range(1, 2001)
+        ],
+    )
+
+    assert len(snapshot.model_dump_json()) > 4 * MAX_PAYLOAD_SIZE
+
+    try:
+        await publisher.publish(topic, snapshot)
+        await publisher.publish(
+            topic, snapshot.model_copy(update={"orders": []})
+        )
+
+        first = await asyncio.wait_for(listener.next(), 10)
+        second = await asyncio.wait_for(listener.next(), 10)
+
+        assert first is not None and first.notification == snapshot
+        assert second is not None and second.notification.orders == []
+    finally:
+        for bus in buses:
+            bus.close()
+
+
+def test_event_ids_across_workers(configuration_fixture: Configuration):
+    engine = configuration_fixture.create_session().get_bind().engine
+
+    asyncio.run(resume_on_another_worker(engine))
+
+
+async def resume_on_another_worker(engine: Engine):
+    buses = [PostgresEventBus(engine, "test_resumed_events")]
+    first = Event(bus=buses[0])
+    customer = User(user_id=1, role=Role.CUSTOMER)
+
+    try:
+        listener = first.listens(customer, FakeConnection().request())
+
+        for order_id in range(1, 4):
+            await first.add_notification(
+                customer, status_notification(order_id)
+            )
+
+        received = [
+            await asyncio.wait_for(listener.next(), 10) for _ in range(3)
+        ]
+
+        assert all(delivery is not None for delivery in received)
+
+        # a worker started afterwards numbers the notifications the same way
+        buses.append(PostgresEventBus(engine, "test_resumed_events"))
+        second = Event(bus=buses[1])
+        late = second.listens(customer, FakeConnection().request())
+        await first.add_notification(customer, status_notification(4))
+
+        fourth = await asyncio.wait_for(listener.next(), 10)
+        late_fourth = await asyncio.wait_for(late.next(), 10)
+
+        assert fourth is not None and late_fourth is not None
+        assert fourth.id == late_fourth.id
+
+        # a client reconnecting to it resumes its stream
+        resumed = second.listens(
+            customer,
+            FakeConnection().request(),
+            received[-1].id,  # type: ignore
+        )
+
+        assert not resumed.resync_required
+        assert await asyncio.wait_for(resumed.next(), 10) == fourth
+
+        # unless it missed the deliveries made before it started
+        too_early = second.listens(
+            customer,
+            FakeConnection().request(),
+            received[0].id,  # type: ignore
+        )
+
+        assert too_early.resync_required
+
+        # the ones of the workers without a bus can't be resumed
+        assert second.listens(
+            customer,
+            FakeConnection().request(),
+            Event().listens(customer, FakeConnection().request()).position,
+        ).resync_required
+    finally:
+        for bus in buses:
+            bus.close()
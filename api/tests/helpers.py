@@ -0,0 +1,200 @@
+from decimal import Decimal
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+from api.idempotency import IdempotencyRecord
+from api.ingestion import ValidatedOrder, insert_orders
+from api.schemas.order import OrderItemCreate
+
+import time
+
+
+def open_restaurant_with_menus(
+    test_client: TestClient, name: str
+) -> tuple[str, str, int, list[dict[str, Any]]]:
+    """
+    Registers a customer and a merchant with an open restaurant of ten menus,
+    each with a required size.
+
+    :return: the customer's and the merchant's tokens, the restaurant ID and
+        an order item for each menu with the large size.
+    """
+
+    customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": name.title(),
+            "last_name": "Customer",
+            "username": f"{name}customer",
+            "email": f"{name}customer@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": name.title(),
+            "last_name": "Merchant",
+            "username": f"{name}merchant",
+            "email": f"{name}merchant@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": f"{name.title()} Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_id: int = test_client.post(
+        "/restaurants/",
+        json={
+            "name": f"{name.title()} House",
+            "address": "address",
+            "canteen_id": canteen_id,
+            "location": {"lat": 0, "lng": 0},
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    assert (
+        test_client.put(
+            f"/restaurants/{restaurant_id}/open",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    items: list[dict[str, Any]] = []
+
+    for i in range(10):
+        menu_id: int = test_client.post(
+            f"/restaurants/{restaurant_id}/menus",
+            json={
+                "name": f"menu {i}",
+                "description": "a menu",
+                "price": 10,
+                "estimated_prep_time": 5,
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()
+
+        assert (
+            test_client.post(
+                f"/restaurants/menus/{menu_id}/customizations",
+                json={
+                    "title": "Size",
+                    "description": None,
+                    "unique": True,
+                    "required": True,
+                    "options": [
+                        {"name": "S", "extra_price": 0.0, "description": None},
+                        {"name": "L", "extra_price": 1.0, "description": None},
+                    ],
+                },
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).status_code
+            == 200
+        )
+
+        size = test_client.get(
+            f"/restaurants/menus/{menu_id}/customizations"
+        ).json()[0]
+
+        items.append(
+            {
+                "menu_id": menu_id,
+                "quantity": 1,
+                "extra_requests": None,
+                "options": [{"option_id": size["options"][1]["id"]}],
+            }
+        )
+
+    return customer_jwt, merchant_jwt, restaurant_id, items
+
+
+def place_order(
+    test_client: TestClient,
+    customer_jwt: str,
+    restaurant_id: int,
+    items: list[dict[str, Any]],
+) -> int:
+    response = test_client.post(
+        "/orders/",
+        json={"restaurant_id": restaurant_id, "items": items},
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert response.status_code == 200
+
+    return response.json()
+
+
+def order_item(menu_id: int, quantity: int = 1) -> dict[str, Any]:
+    """An order item of the menu without any option."""
+
+    return {
+        "menu_id": menu_id,
+        "quantity": quantity,
+        "extra_requests": None,
+        "options": [],
+    }
+
+
+def change_order_status(
+    test_client: TestClient,
+    order_id: int,
+    jwt_token: str,
+    status: dict[str, Any],
+):
+    assert (
+        test_client.put(
+            f"/orders/{order_id}/status",
+            json=status,
+            headers={"Authorization": f"Bearer {jwt_token}"},
+        ).status_code
+        == 200
+    )
+
+
+def insert_order(
+    session: Session,
+    customer_id: int,
+    restaurant_id: int,
+    menu_id: int,
+    idempotency: IdempotencyRecord | None = None,
+) -> int:
+    """
+    Inserts an order of the menu in the transaction of the session, without
+    committing it.
+    """
+
+    [order_id] = insert_orders(
+        session,
+        [
+            ValidatedOrder(
+                customer_id=customer_id,
+                restaurant_id=restaurant_id,
+                ordered_at=int(time.time()),
+                price_paid=Decimal(10),
+                items=[
+                    OrderItemCreate(
+                        menu_id=menu_id,
+                        quantity=1,
+                        extra_requests=None,
+                        options=[],
+                    )
+                ],
+                idempotency=idempotency,
+            )
+        ],
+    )
+
+    return order_id
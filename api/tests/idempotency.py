@@ -0,0 +1,381 @@
+from typing import Any
+from fastapi.testclient import TestClient
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api.errors import ConflictingError
+from api.idempotency import (
+    IdempotencyRecord,
+    IdempotencyStore,
+    InMemoryIdempotencyStore,
+    PostgresIdempotencyStore,
+)
+from api.models.order import Order
+from api.state import State
+from api.tests.helpers import insert_order, order_item
+from api import app
+from concurrent.futures import Future, ThreadPoolExecutor
+from sqlalchemy import func, select
+
+import asyncio
+import jwt
+import pytest
+import time
+
+
+def test_idempotent_order(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_response = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "John",
+            "last_name": "Doe",
+            "username": "johndoe",
+            "email": "johndoe@test.com",
+            "password": "password",
+        },
+    )
+
+    assert customer_response.status_code == 200
+
+    customer_jwt: str = customer_response.json()["jwt_token"]
+
+    other_customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "Jake",
+            "last_name": "Doe",
+            "username": "jakedoe",
+            "email": "jakedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": "janedoe",
+            "email": "janedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Test Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_id: int = test_client.post(
+        "/restaurants/",
+        json={
+            "name": "Steak House",
+            "address": "address",
+            "canteen_id": canteen_id,
+            "location": {"lat": 0, "lng": 0},
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    menu_id: int = test_client.post(
+        f"/restaurants/{restaurant_id}/menus",
+        json={
+            "name": "steak",
+            "description": "a juicy steak",
+            "price": 10,
+            "estimated_prep_time": 10,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    order: dict[str, Any] = {
+        "restaurant_id": restaurant_id,
+        "items": [order_item(menu_id)],
+    }
+
+    # failed requests are not remembered
+    closed_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={
+            "Authorization": f"Bearer {customer_jwt}",
+            "Idempotency-Key": "first",
+        },
+    )
+
+    assert closed_response.status_code == 409
+
+    assert (
+        test_client.put(
+            f"/restaurants/{restaurant_id}/open",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    first_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={
+            "Authorization": f"Bearer {customer_jwt}",
+            "Idempotency-Key": "first",
+        },
+    )
+
+    assert first_response.status_code == 200
+
+    retry_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={
+            "Authorization": f"Bearer {customer_jwt}",
+            "Idempotency-Key": "first",
+        },
+    )
+
+    assert retry_response.status_code == 200
+    assert retry_response.json() == first_response.json()
+
+    # the keys are scoped by the customer
+    other_customer_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={
+            "Authorization": f"Bearer {other_customer_jwt}",
+            "Idempotency-Key": "first",
+        },
+    )
+
+    assert other_customer_response.status_code == 200
+    assert other_customer_response.json() != first_response.json()
+
+    second_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={
+            "Authorization": f"Bearer {customer_jwt}",
+            "Idempotency-Key": "second",
+        },
+    )
+
+    assert second_response.status_code == 200
+    assert second_response.json() != first_response.json()
+
+    orders_response = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert orders_response.status_code == 200
+    assert len(orders_response.json()) == 2
+
+    customer_id: int = jwt.decode(  # type: ignore
+        customer_jwt,
+        configuration_fixture.jwt_secret,
+        algorithms=["HS256"],
+    )["customer_id"]
+
+    asyncio.run(
+        concurrent_duplicates(
+            configuration_fixture,
+            InMemoryIdempotencyStore(60),
+            customer_id,
+            second_response.json(),
+        )
+    )
+
+    concurrent_postgres_duplicates(
+        configuration_fixture, customer_id, restaurant_id, menu_id
+    )
+
+
+async def concurrent_duplicates(
+    configuration: Configuration,
+    store: IdempotencyStore,
+    customer_id: int,
+    order_id: int,
+):
+    calls: list[int] = []
+    key = f"concurrent-{type(store).__name__}"
+
+    async def operation(_: IdempotencyRecord | None) -> int:
+        calls.append(len(calls))
+
+        # keep the key claimed while the duplicates arrive
+        await asyncio.sleep(0.1)
+
+        return order_id
+
+    async def failing_operation(_: IdempotencyRecord | None) -> int:
+        raise RuntimeError("failed")
+
+    states = [
+        State(
+            session=configuration.create_session(),
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+        )
+        for _ in range(3)
+    ]
+
+    try:
+        results = await asyncio.gather(
+            *[
+                store.execute(state, customer_id, key, operation)
+                for state in states
+            ]
+        )
+
+        assert results == [order_id, order_id, order_id]
+        assert len(calls) == 1
+
+        with pytest.raises(RuntimeError):
+            await store.execute(
+                states[0], customer_id, "failing", failing_operation
+            )
+
+        # the failed key can be used again
+        assert (
+            await store.execute(states[0], customer_id, "failing", operation)
+            == order_id
+        )
+
+    finally:
+        for state in states:
+            state.session.close()
+
+
+def concurrent_postgres_duplicates(
+    configuration: Configuration,
+    customer_id: int,
+    restaurant_id: int,
+    menu_id: int,
+):
+    store = PostgresIdempotencyStore(60)
+    impatient_store = PostgresIdempotencyStore(60, pending_timeout=0.1)
+    key = "concurrent-postgres"
+
+    first, duplicate, impatient = [
+        State(
+            session=configuration.create_session(),
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+        )
+        for _ in range(3)
+    ]
+
+    def count_orders() -> int:
+        count = first.session.scalar(
+            select(func.count())
+            .select_from(Order)
+            .where(Order.customer_id == customer_id)
+        )
+        first.session.commit()
+
+        return count or 0
+
+    duplicate_calls: list[str | None] = []
+
+    async def duplicate_operation(idempotency: IdempotencyRecord | None):
+        duplicate_calls.append(idempotency and idempotency.key)
+        order_id = insert_order(
+            duplicate.session, customer_id, restaurant_id, menu_id, idempotency
+        )
+        duplicate.session.commit()
+
+        return order_id
+
+    async def impatient_operation(idempotency: IdempotencyRecord | None):
+        raise AssertionError("the key is claimed by the first request")
+
+    async def failing_operation(idempotency: IdempotencyRecord | None):
+        insert_order(
+            first.session, customer_id, restaurant_id, menu_id, idempotency
+        )
+
+        raise RuntimeError("failed")
+
+    executor = ThreadPoolExecutor(2)
+    duplicate_results: list[Future[int]] = []
+
+    async def first_operation(idempotency: IdempotencyRecord | None):
+        # the key is claimed before the order is placed, the duplicates
+        # arrive before it's committed
+        order_id = insert_order(
+            first.session, customer_id, restaurant_id, menu_id, idempotency
+        )
+
+        impatient_result = executor.submit(
+            asyncio.run,
+            impatient_store.execute(
+                impatient, customer_id, key, impatient_operation
+            ),
+        )
+
+        # the duplicates wait for the claim and give up after the pending
+        # timeout
+        with pytest.raises(ConflictingError):
+            impatient_result.result(5)
+
+        duplicate_result = executor.submit(
+            asyncio.run,
+            store.execute(duplicate, customer_id, key, duplicate_operation),
+        )
+
+        duplicate_results.append(duplicate_result)
+        time.sleep(0.2)
+
+        assert not duplicate_result.done()
+
+        first.session.commit()
+
+        return order_id
+
+    try:
+        orders_before = count_orders()
+        first_order_id = asyncio.run(
+            store.execute(first, customer_id, key, first_operation)
+        )
+
+        # the duplicate waits for the first request to commit, then returns
+        # its order without placing one
+        assert duplicate_results[0].result(5) == first_order_id
+        assert duplicate_calls == []
+        assert count_orders() == orders_before + 1
+
+        # a failed operation records nothing, the key can be used again
+        with pytest.raises(RuntimeError):
+            asyncio.run(
+                store.execute(first, customer_id, "failing", failing_operation)
+            )
+
+        first.session.rollback()
+
+        retried_order_id = asyncio.run(
+            store.execute(
+                duplicate, customer_id, "failing", duplicate_operation
+            )
+        )
+
+        assert duplicate_calls == ["failing"]
+        assert count_orders() == orders_before + 2
+        assert (
+            asyncio.run(
+                store.execute(first, customer_id, "failing", failing_operation)
+            )
+            == retried_order_id
+        )
+
+    finally:
+        executor.shutdown()
+
+        for state in (first, duplicate, impatient):
+            state.session.close()
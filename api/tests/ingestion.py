@@ -0,0 +1,295 @@
+from decimal import Decimal
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from api.configuration import Configuration
+from api.crud.order import create_order
+from api.dependencies.configuration import get_configuration
+from api.idempotency import IdempotencyRecord, PostgresIdempotencyStore
+from api.ingestion import OrderIngestion, ValidatedOrder
+from api.schemas.order import OrderCreate
+from api.state import State
+from api.tests.helpers import order_item
+from api import app
+
+import asyncio
+import jwt
+import pytest
+
+
+def test_batched_order_ingestion(configuration_fixture: Configuration):
+    batched_configuration = Configuration(
+        configuration_fixture.create_session,
+        configuration_fixture.jwt_secret,
+        configuration_fixture.application_data_path,
+        order_ingestion=OrderIngestion(
+            configuration_fixture.create_session, batch_size=8, window=0.05
+        ),
+        queue_notification_window=0,
+    )
+
+    app.dependency_overrides[get_configuration] = lambda: batched_configuration
+    test_client = TestClient(app)
+
+    customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "John",
+            "last_name": "Doe",
+            "username": "johndoe",
+            "email": "johndoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": "janedoe",
+            "email": "janedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Test Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_id: int = test_client.post(
+        "/restaurants/",
+        json={
+            "name": "Steak House",
+            "address": "address",
+            "canteen_id": canteen_id,
+            "location": {"lat": 0, "lng": 0},
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    menu_id: int = test_client.post(
+        f"/restaurants/{restaurant_id}/menus",
+        json={
+            "name": "steak",
+            "description": "a juicy steak",
+            "price": 10,
+            "estimated_prep_time": 10,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    customization_id: int = test_client.post(
+        f"/restaurants/menus/{menu_id}/customizations",
+        json={
+            "title": "doneness",
+            "description": None,
+            "unique": True,
+            "required": True,
+            "options": [
+                {"name": "rare", "description": None, "extra_price": None},
+                {"name": "well done", "description": None, "extra_price": 2},
+            ],
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    option_ids: list[int] = [
+        option["id"]
+        for option in test_client.get(
+            f"/restaurants/menus/{menu_id}/customizations",
+        ).json()[0]["options"]
+    ]
+
+    assert (
+        test_client.put(
+            f"/restaurants/{restaurant_id}/open",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    # the orders placed through the API are written by the pipeline
+    order: dict[str, Any] = {
+        "restaurant_id": restaurant_id,
+        "items": [
+            {
+                "menu_id": menu_id,
+                "quantity": 1,
+                "extra_requests": "no salt",
+                "options": [{"option_id": option_ids[1]}],
+            }
+        ],
+    }
+
+    order_response = test_client.post(
+        "/orders/",
+        json=order,
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert order_response.status_code == 200
+
+    order_id: int = order_response.json()
+
+    created_order = test_client.get(
+        f"/orders/{order_id}",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()
+
+    assert Decimal(created_order["price_paid"]) == Decimal(12)
+    assert created_order["items"][0]["extra_requests"] == "no salt"
+    assert [
+        option["option_id"] for option in created_order["items"][0]["options"]
+    ] == [option_ids[1]]
+
+    # the validation errors are still reported before reaching the pipeline
+    invalid_response = test_client.post(
+        "/orders/",
+        json={
+            "restaurant_id": restaurant_id,
+            "items": [order_item(menu_id)],
+        },
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert invalid_response.status_code == 400
+    assert invalid_response.json()["detail"]["error"].endswith(
+        f"requires customization with id {customization_id}"
+    )
+
+    customer_id: int = jwt.decode(  # type: ignore
+        customer_jwt,
+        configuration_fixture.jwt_secret,
+        algorithms=["HS256"],
+    )["customer_id"]
+
+    asyncio.run(
+        concurrent_orders(
+            configuration_fixture,
+            customer_id,
+            OrderCreate.model_validate(order),
+        )
+    )
+
+    orders_response = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert orders_response.status_code == 200
+    # the idempotent duplicates placed a single order
+    assert len(orders_response.json()) == 1 + 8 + 2 + 1
+
+    for created_order in orders_response.json():
+        assert len(created_order["items"]) == 1
+        assert [
+            option["option_id"]
+            for option in created_order["items"][0]["options"]
+        ] == [option_ids[1]]
+
+
+async def concurrent_orders(
+    configuration: Configuration, customer_id: int, payload: OrderCreate
+):
+    flush_sessions: list[Session] = []
+
+    def session_maker() -> Session:
+        session = configuration.create_session()
+        flush_sessions.append(session)
+
+        return session
+
+    ingestion = OrderIngestion(session_maker, batch_size=4, window=0.05)
+
+    states = [
+        State(
+            session=configuration.create_session(),
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+        )
+        for _ in range(8)
+    ]
+
+    try:
+        order_ids = await asyncio.gather(
+            *[
+                create_order(state, customer_id, payload, ingestion)
+                for state in states
+            ]
+        )
+
+        # every caller gets the ID of its own order
+        assert len(set(order_ids)) == len(states)
+
+        # the writer opens a session per batch
+        assert len(flush_sessions) < len(states)
+
+        # an order that fails to be written doesn't fail the rest of its
+        # batch
+        valid_order = ValidatedOrder(
+            customer_id=customer_id,
+            restaurant_id=payload.restaurant_id,
+            ordered_at=0,
+            price_paid=Decimal(12),
+            items=payload.items,
+        )
+        invalid_order = ValidatedOrder(
+            customer_id=-1,
+            restaurant_id=payload.restaurant_id,
+            ordered_at=0,
+            price_paid=Decimal(12),
+            items=payload.items,
+        )
+
+        results = await asyncio.gather(
+            ingestion.submit(valid_order),
+            ingestion.submit(invalid_order),
+            ingestion.submit(valid_order),
+            return_exceptions=True,
+        )
+
+        assert isinstance(results[0], int)
+        assert isinstance(results[1], IntegrityError)
+        assert isinstance(results[2], int)
+        assert results[0] != results[2]
+
+        # the duplicates of an idempotent request wait for the claim of the
+        # first one, outside of the writer, and get its ID without
+        # submitting an order of their own
+        store = PostgresIdempotencyStore(60)
+        submitted: list[State] = []
+
+        def idempotent_order(state: State):
+
+            def operation(idempotency: IdempotencyRecord | None):
+                submitted.append(state)
+
+                return create_order(
+                    state, customer_id, payload, ingestion, idempotency
+                )
+
+            return store.execute(state, customer_id, "batched", operation)
+
+        idempotent_order_ids = await asyncio.gather(
+            *[idempotent_order(state) for state in states[:3]]
+        )
+
+        assert len(set(idempotent_order_ids)) == 1
+        assert len(submitted) == 1
+        assert await idempotent_order(states[3]) == idempotent_order_ids[0]
+
+    finally:
+        for state in states:
+            state.session.close()
+
+    with pytest.raises(ValueError):
+        OrderIngestion(configuration.create_session, batch_size=0)
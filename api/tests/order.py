@@ -1,12 +1,33 @@
 from copy import deepcopy
-from typing import Any
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Generator
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from api.configuration import Configuration
+from api.crud.order import (
+    authorize_queue_subscriptions,
+    get_order_status_no_validation,
+)
 from api.dependencies.configuration import get_configuration
+from api.dependencies.event import get_event
+from api.dependencies.id import Role
+from api.errors.authentication import UnauthorizedError
+from api.event import Event, User
+from api.models.order import Order
+from api.schemas.event import (
+    Notification,
+    OrderQueueChangeNotification,
+    OrderStatusChangeNotification,
+)
+from api.schemas.order import CancelledOrder, PreparingOrder
+from api.state import State
+from api.tests.helpers import open_restaurant_with_menus, place_order
 from api import app
 
+import asyncio
 import jwt
-
+import pytest
 
 def test_order(configuration_fixture: Configuration):
     app.dependency_overrides[get_configuration] = lambda: configuration_fixture
@@ -637,3 +658,598 @@ def test_order(configuration_fixture: Configuration):
 
     assert restaurant_queue.json()["queue_count"] == 3
     assert restaurant_queue.json()["estimated_time"] == 30
+
+
+@contextmanager
+def record_statements(
+    configuration: Configuration,
+) -> Generator[list[str], None, None]:
+    """Records the SQL statements issued within the block."""
+
+    engine = configuration.create_session().get_bind()
+    statements: list[str] = []
+
+    def record_statement(*args: Any):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+
+def test_create_order_query_count(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, _, restaurant_id, items = open_restaurant_with_menus(
+        test_client, "bulk"
+    )
+
+    def count_statements(order: dict[str, Any]) -> tuple[int, int]:
+        with record_statements(configuration_fixture) as statements:
+            response = test_client.post(
+                "/orders/",
+                json=order,
+                headers={"Authorization": f"Bearer {customer_jwt}"},
+            )
+
+        assert response.status_code == 200
+
+        # the queries issued while validating and pricing
+        selects = 0
+        for statement in statements:
+            if statement.lstrip().upper().startswith("INSERT"):
+                break
+
+            selects += 1
+
+        return selects, len(statements)
+
+    one_item_selects, one_item_statements = count_statements(
+        {"restaurant_id": restaurant_id, "items": items[:1]}
+    )
+    ten_item_selects, ten_item_statements = count_statements(
+        {"restaurant_id": restaurant_id, "items": items}
+    )
+
+    # neither the validation nor the inserts may issue more queries as the
+    # cart grows
+    assert ten_item_selects == one_item_selects
+    assert ten_item_selects <= 4
+    assert ten_item_statements == one_item_statements
+    assert ten_item_statements - ten_item_selects <= 3
+
+    orders = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()
+
+    assert len(orders) == 2
+    assert sorted(Decimal(order["price_paid"]) for order in orders) == [
+        Decimal(11),
+        Decimal(110),
+    ]
+
+
+def test_order_status_query_count(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "status")
+    )
+    preparing_order_id = place_order(
+        test_client, customer_jwt, restaurant_id, items[:1]
+    )
+    cancelled_order_id = place_order(
+        test_client, customer_jwt, restaurant_id, items
+    )
+
+    assert (
+        test_client.put(
+            f"/orders/{preparing_order_id}/status",
+            json={"type": "PREPARING"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    assert (
+        test_client.put(
+            f"/orders/{cancelled_order_id}/status",
+            json={"type": "CANCELLED", "reason": "out of stock"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    # the status of an order is rendered from the loaded row without any
+    # extra query
+    with configuration_fixture.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration_fixture.catalog_cache,
+            queues=configuration_fixture.queue_engine,
+        )
+
+        loaded_orders = {
+            order.id: order
+            for order in session.query(Order).filter(
+                Order.id.in_([preparing_order_id, cancelled_order_id])
+            )
+        }
+
+        with record_statements(configuration_fixture) as statements:
+            preparing_status = asyncio.run(
+                get_order_status_no_validation(
+                    state, loaded_orders[preparing_order_id]
+                )
+            )
+            cancelled_status = asyncio.run(
+                get_order_status_no_validation(
+                    state, loaded_orders[cancelled_order_id]
+                )
+            )
+
+    assert statements == []
+    assert isinstance(preparing_status, PreparingOrder)
+    assert isinstance(cancelled_status, CancelledOrder)
+    assert cancelled_status.cancelled_by == "MERCHANT"
+    assert cancelled_status.reason == "out of stock"
+
+
+def test_list_orders_query_count(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "listing")
+    )
+
+    place_order(test_client, customer_jwt, restaurant_id, items[:1])
+    place_order(test_client, customer_jwt, restaurant_id, items)
+
+    # the items and their options are loaded with the orders
+    orders = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()
+    ten_item_order = max(orders, key=lambda order: len(order["items"]))
+
+    assert [item["menu_id"] for item in ten_item_order["items"]] == [
+        item["menu_id"] for item in items
+    ]
+    assert all(len(item["options"]) == 1 for item in ten_item_order["items"])
+
+    # listing the orders runs the same number of queries regardless of the
+    # number of orders and items
+    def count_list_statements() -> tuple[int, int]:
+        with record_statements(configuration_fixture) as statements:
+            response = test_client.get(
+                "/orders/",
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            )
+
+        assert response.status_code == 200
+
+        return len(response.json()), len(statements)
+
+    few_orders, few_orders_statements = count_list_statements()
+
+    for _ in range(5):
+        place_order(test_client, customer_jwt, restaurant_id, items)
+
+    many_orders, many_orders_statements = count_list_statements()
+
+    assert (few_orders, many_orders) == (2, 7)
+    assert many_orders_statements == few_orders_statements
+    assert many_orders_statements <= 4
+
+
+def test_list_orders_pagination(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, _, restaurant_id, items = open_restaurant_with_menus(
+        test_client, "paging"
+    )
+
+    for _ in range(7):
+        place_order(test_client, customer_jwt, restaurant_id, items[:2])
+
+    # the orders are paginated with a cursor
+    all_orders = test_client.get(
+        "/orders/",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    )
+
+    assert all_orders.status_code == 200
+    assert "X-Next-Cursor" not in all_orders.headers
+    assert [
+        (order["ordered_at"], order["id"]) for order in all_orders.json()
+    ] == sorted(
+        (order["ordered_at"], order["id"]) for order in all_orders.json()
+    )
+
+    pages: list[list[dict[str, Any]]] = []
+    cursor: str | None = None
+
+    while True:
+        page_response = test_client.get(
+            "/orders/",
+            params={"limit": 3}
+            | ({"after_id": cursor} if cursor is not None else {}),
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        )
+
+        assert page_response.status_code == 200
+
+        pages.append(page_response.json())
+        cursor = page_response.headers.get("X-Next-Cursor")
+
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [order for page in pages for order in page] == all_orders.json()
+
+    # a cursor that isn't one of the customer's orders is rejected instead
+    # of ending the listing
+    for invalid_cursor in (all_orders.json()[-1]["id"] + 1000, -1):
+        assert (
+            test_client.get(
+                "/orders/",
+                params={"limit": 3, "after_id": invalid_cursor},
+                headers={"Authorization": f"Bearer {customer_jwt}"},
+            ).status_code
+            == 400
+        )
+
+    # the time range filters
+    first_ordered_at: int = all_orders.json()[0]["ordered_at"]
+
+    assert (
+        test_client.get(
+            "/orders/",
+            params={"ordered_before": first_ordered_at},
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).json()
+        == []
+    )
+
+    assert (
+        test_client.get(
+            "/orders/",
+            params={
+                "ordered_after": first_ordered_at,
+                "ordered_before": first_ordered_at + 24 * 60 * 60,
+            },
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).json()
+        == all_orders.json()
+    )
+
+    for invalid_limit in (0, 501):
+        assert (
+            test_client.get(
+                "/orders/",
+                params={"limit": invalid_limit},
+                headers={"Authorization": f"Bearer {customer_jwt}"},
+            ).status_code
+            == 422
+        )
+
+
+def test_update_order_status_race(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "racing")
+    )
+    racing_order_id = place_order(
+        test_client, customer_jwt, restaurant_id, items[:1]
+    )
+
+    def prepare_order() -> Any:
+        return test_client.put(
+            f"/orders/{racing_order_id}/status",
+            json={"type": "PREPARING"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        )
+
+    # a status change that finds the order locked by another status change
+    # lost the race
+    with configuration_fixture.create_session() as session:
+        session.query(Order).filter(
+            Order.id == racing_order_id
+        ).with_for_update().one()
+
+        conflict_response = prepare_order()
+
+        assert conflict_response.status_code == 409
+
+        session.rollback()
+
+    assert prepare_order().status_code == 200
+
+    # the same change applied afterwards is no longer allowed
+    repeated_response = prepare_order()
+
+    assert repeated_response.status_code == 400
+    assert (
+        repeated_response.json()["detail"]["error"]
+        == "order can be prepared only once"
+    )
+
+    # the transition doesn't read the order before updating it
+    with record_statements(configuration_fixture) as statements:
+        ready_response = test_client.put(
+            f"/orders/{racing_order_id}/status",
+            json={"type": "READY"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        )
+
+    assert ready_response.status_code == 200
+    assert statements[0].lstrip().startswith("UPDATE orders")
+
+
+def test_bulk_update_order_statuses(configuration_fixture: Configuration):
+    notifications: list[tuple[User, Notification]] = []
+
+    class RecordingEvent(Event):
+        async def add_notification(
+            self, user: User, notification: Notification
+        ) -> None:
+            notifications.append((user, notification))
+
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    app.dependency_overrides[get_event] = lambda: RecordingEvent()
+
+    try:
+        bulk_update_order_statuses(
+            configuration_fixture, TestClient(app), notifications
+        )
+    finally:
+        del app.dependency_overrides[get_event]
+
+
+def bulk_update_order_statuses(
+    configuration: Configuration,
+    test_client: TestClient,
+    notifications: list[tuple[User, Notification]],
+):
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "rush")
+    )
+    _, _, other_restaurant_id, other_items = open_restaurant_with_menus(
+        test_client, "otherrush"
+    )
+
+    customer_id: int = test_client.get(
+        "/customers/me",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()["id"]
+
+    order_ids = [
+        place_order(test_client, customer_jwt, restaurant_id, items[:1])
+        for _ in range(6)
+    ]
+    other_order_id = place_order(
+        test_client, customer_jwt, other_restaurant_id, other_items[:1]
+    )
+
+    notifications.clear()
+
+    with configuration.create_session() as session:
+        # a concurrent status change holds the lock of the fourth order
+        session.query(Order).filter(
+            Order.id == order_ids[3]
+        ).with_for_update().one()
+
+        with record_statements(configuration) as statements:
+            response = test_client.put(
+                "/orders/status",
+                json=[
+                    {
+                        "order_id": order_ids[0],
+                        "status": {"type": "PREPARING"},
+                    },
+                    {
+                        "order_id": order_ids[1],
+                        "status": {"type": "PREPARING"},
+                    },
+                    {
+                        "order_id": order_ids[2],
+                        "status": {"type": "CANCELLED", "reason": "sold out"},
+                    },
+                    {
+                        "order_id": order_ids[3],
+                        "status": {"type": "PREPARING"},
+                    },
+                    {"order_id": order_ids[4], "status": {"type": "READY"}},
+                    {"order_id": order_ids[5], "status": {"type": "SETTLED"}},
+                    {"order_id": order_ids[0], "status": {"type": "READY"}},
+                    {
+                        "order_id": other_order_id,
+                        "status": {"type": "PREPARING"},
+                    },
+                    {"order_id": 2**31 - 1, "status": {"type": "PREPARING"}},
+                ],
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            )
+
+        session.rollback()
+
+    # the merchant of the updated orders isn't looked up for each of them
+    assert not [
+        statement
+        for statement in statements
+        if "FROM restaurants" in statement and "orders" not in statement
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"order_id": order_ids[0], "success": True, "error": None},
+        {"order_id": order_ids[1], "success": True, "error": None},
+        {"order_id": order_ids[2], "success": True, "error": None},
+        {
+            "order_id": order_ids[3],
+            "success": False,
+            "error": "order is being updated by another request",
+        },
+        {
+            "order_id": order_ids[4],
+            "success": False,
+            "error": "order can be ready after it's prepared",
+        },
+        {
+            "order_id": order_ids[5],
+            "success": False,
+            "error": "order can't be settled by merchant",
+        },
+        {
+            "order_id": order_ids[0],
+            "success": False,
+            "error": "order can only be updated once per request",
+        },
+        {
+            "order_id": other_order_id,
+            "success": False,
+            "error": "merchant does not own the order",
+        },
+        {
+            "order_id": 2**31 - 1,
+            "success": False,
+            "error": f"order with id {2**31 - 1} not found",
+        },
+    ]
+
+    def get_status(order_id: int) -> dict[str, Any]:
+        return test_client.get(
+            f"/orders/{order_id}/status",
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).json()
+
+    assert [get_status(order_id)["type"] for order_id in order_ids] == [
+        "PREPARING",
+        "PREPARING",
+        "CANCELLED",
+        "ORDERED",
+        "ORDERED",
+        "ORDERED",
+    ]
+    assert get_status(order_ids[2])["reason"] == "sold out"
+    assert get_status(other_order_id)["type"] == "ORDERED"
+
+    # a status notification for each updated order to both of its parties,
+    # and a single round of queue notifications for the restaurant
+    status_notifications = [
+        (user.role.name, notification.order_id)
+        for user, notification in notifications
+        if isinstance(notification, OrderStatusChangeNotification)
+    ]
+    queue_notifications = [
+        (user, notification.order_id)
+        for user, notification in notifications
+        if isinstance(notification, OrderQueueChangeNotification)
+    ]
+
+    assert sorted(status_notifications) == sorted(
+        (role.name, order_id)
+        for role in (Role.CUSTOMER, Role.MERCHANT)
+        for order_id in order_ids[:3]
+    )
+    assert sorted(queue_notifications) == sorted(
+        (User(user_id=customer_id, role=Role.CUSTOMER), order_id)
+        for order_id in order_ids[:2] + order_ids[3:]
+    )
+
+    # only merchants can update in bulk, and only so many orders at once
+    assert (
+        test_client.put(
+            "/orders/status",
+            json=[],
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        != 200
+    )
+    assert (
+        test_client.put(
+            "/orders/status",
+            json=[{"order_id": order_ids[3], "status": {"type": "PREPARING"}}]
+            * 101,
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 422
+    )
+
+
+def test_queue_subscription_authorization(
+    configuration_fixture: Configuration,
+):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "subscribing")
+    )
+    _, _, other_restaurant_id, _ = open_restaurant_with_menus(
+        test_client, "unsubscribed"
+    )
+
+    def decode(token: str, key: str) -> int:
+        return jwt.decode(  # type: ignore
+            token, configuration_fixture.jwt_secret, algorithms=["HS256"]
+        )[key]
+
+    customer_id = decode(customer_jwt, "customer_id")
+    merchant_id = decode(merchant_jwt, "merchant_id")
+
+    def authorize(user_id: int, role: Role, restaurant_ids: list[int]):
+        with configuration_fixture.create_session() as session:
+            state = State(
+                session=session,
+                catalog=configuration_fixture.catalog_cache,
+                queues=configuration_fixture.queue_engine,
+            )
+
+            asyncio.run(
+                authorize_queue_subscriptions(
+                    state, user_id, role, restaurant_ids
+                )
+            )
+
+    # a customer without an active order there can't see the queue
+    with pytest.raises(UnauthorizedError):
+        authorize(customer_id, Role.CUSTOMER, [restaurant_id])
+
+    order_id = place_order(test_client, customer_jwt, restaurant_id, items[:1])
+
+    authorize(customer_id, Role.CUSTOMER, [restaurant_id])
+
+    with pytest.raises(UnauthorizedError):
+        authorize(
+            customer_id, Role.CUSTOMER, [restaurant_id, other_restaurant_id]
+        )
+
+    # nor once the order left the queue
+    assert (
+        test_client.put(
+            f"/orders/{order_id}/status",
+            json={"type": "CANCELLED", "reason": "closing"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    with pytest.raises(UnauthorizedError):
+        authorize(customer_id, Role.CUSTOMER, [restaurant_id])
+
+    # a merchant sees the queues of its own restaurants only
+    authorize(merchant_id, Role.MERCHANT, [restaurant_id])
+
+    with pytest.raises(UnauthorizedError):
+        authorize(merchant_id, Role.MERCHANT, [other_restaurant_id])
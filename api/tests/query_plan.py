@@ -0,0 +1,362 @@
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from api.configuration import Configuration
+from api.dependencies.configuration import get_configuration
+from api import app
+
+
+def test_query_plans_use_indexes(configuration_fixture: Configuration):
+    """
+    Runs the API flows that exercise the queries of `api/crud/*`, records
+    every statement they send and checks that none of the filtered ones has
+    to sequentially scan a table.
+
+    The plans are made with `enable_seqscan` turned off, so the planner only
+    falls back to a sequential scan when no index can serve the filter; the
+    result doesn't depend on the size of the seeded tables.
+    """
+
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[tuple[str, Any]] = []
+
+    def record_statement(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+
+    try:
+        seed(test_client)
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    filtered_statements = [
+        (statement, parameters)
+        for statement, parameters in statements
+        if statement.lstrip()
+        .upper()
+        .startswith(("SELECT", "UPDATE", "DELETE"))
+        and "WHERE" in statement.upper()
+    ]
+
+    # make sure that the flows actually reached the hot paths
+    def ran(fragment: str) -> bool:
+        return any(fragment in statement for statement, _ in statements)
+
+    assert ran("FROM orders")
+    assert ran("FROM order_items")
+    assert ran("FROM menus")
+    assert ran("FROM customizations")
+    assert ran("FROM options")
+    assert ran("FROM favorite_restaurants")
+    assert ran("FROM customer_reviews")
+    assert ran("FROM refresh_tokens")
+
+    sequential_scans: list[str] = []
+
+    with engine.connect() as connection:
+        connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("SET enable_seqscan = off")
+
+        for statement, parameters in filtered_statements:
+            plan = "\n".join(
+                row[0]
+                for row in connection.exec_driver_sql(
+                    f"EXPLAIN {statement}", parameters
+                )
+            )
+
+            if "Seq Scan" in plan:
+                sequential_scans.append(f"{statement}\n{plan}")
+
+        connection.rollback()
+
+    assert sequential_scans == [], "\n\n".join(sequential_scans)
+
+
+def seed(test_client: TestClient):
+    customer_response = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "John",
+            "last_name": "Doe",
+            "username": "johndoe",
+            "email": "johndoe@test.com",
+            "password": "password",
+        },
+    )
+
+    assert customer_response.status_code == 200
+
+    customer_jwt: str = customer_response.json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": "janedoe",
+            "email": "janedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_id: int = test_client.get(
+        "/merchants/me",
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    # logging in again replaces the refresh token of the customer
+    login_response = test_client.post(
+        "/customers/login",
+        json={"username": "johndoe", "password": "password"},
+    )
+
+    assert login_response.status_code == 200
+    assert (
+        test_client.get(
+            "/customers/refresh",
+            cookies={"refresh_token": login_response.cookies["refresh_token"]},
+        ).status_code
+        == 200
+    )
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Test Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_ids: list[int] = []
+    menu_ids: list[int] = []
+
+    for i in range(3):
+        restaurant_id: int = test_client.post(
+            "/restaurants/",
+            json={
+                "name": f"Restaurant {i}",
+                "address": "address",
+                "canteen_id": canteen_id,
+                "location": {"lat": 0, "lng": 0},
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()
+        restaurant_ids.append(restaurant_id)
+
+        assert (
+            test_client.put(
+                f"/restaurants/{restaurant_id}/open",
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).status_code
+            == 200
+        )
+
+        for j in range(3):
+            menu_id: int = test_client.post(
+                f"/restaurants/{restaurant_id}/menus",
+                json={
+                    "name": f"menu {j}",
+                    "description": "description",
+                    "price": 10,
+                    "estimated_prep_time": 5,
+                },
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).json()
+            menu_ids.append(menu_id)
+
+            assert (
+                test_client.post(
+                    f"/restaurants/menus/{menu_id}/customizations",
+                    json={
+                        "title": "size",
+                        "description": None,
+                        "unique": True,
+                        "required": False,
+                        "options": [
+                            {
+                                "name": "large",
+                                "description": None,
+                                "extra_price": 1,
+                            }
+                        ],
+                    },
+                    headers={"Authorization": f"Bearer {merchant_jwt}"},
+                ).status_code
+                == 200
+            )
+
+            assert (
+                test_client.get(
+                    f"/restaurants/menus/{menu_id}/customizations"
+                ).status_code
+                == 200
+            )
+
+        assert (
+            test_client.get(f"/restaurants/{restaurant_id}/menus").status_code
+            == 200
+        )
+
+    assert (
+        test_client.get(f"/canteens/{canteen_id}/restaurants").status_code
+        == 200
+    )
+    assert (
+        test_client.get(f"/merchants/{merchant_id}/restaurants").status_code
+        == 200
+    )
+
+    # favorites and reviews
+    assert (
+        test_client.post(
+            "/customers/favorite-restaurants",
+            json=restaurant_ids[:2],
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+    assert (
+        test_client.get(
+            "/customers/favorite-restaurants",
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+    assert (
+        test_client.request(
+            "DELETE",
+            "/customers/favorite-restaurants",
+            json=restaurant_ids[:1],
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    assert (
+        test_client.post(
+            "/customers/add_reviews",
+            json={
+                "restaurant_id": restaurant_ids[0],
+                "menu_id": menu_ids[0],
+                "review": "good",
+                "tastiness": 5,
+                "hygiene": 5,
+                "quickness": 5,
+            },
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+    assert (
+        test_client.get(
+            "/customers/customer/reviews",
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+    assert (
+        test_client.get(
+            f"/restaurants/reviews/{restaurant_ids[0]}"
+        ).status_code
+        == 200
+    )
+
+    # orders and their status changes
+    order_ids: list[int] = []
+
+    for i, menu_id in enumerate(menu_ids):
+        order_response = test_client.post(
+            "/orders/",
+            json={
+                "restaurant_id": restaurant_ids[i // 3],
+                "items": [
+                    {
+                        "menu_id": menu_id,
+                        "quantity": 1,
+                        "extra_requests": None,
+                        "options": [],
+                    }
+                ],
+            },
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        )
+
+        assert order_response.status_code == 200
+
+        order_ids.append(order_response.json())
+
+    assert (
+        test_client.put(
+            f"/orders/{order_ids[0]}/status",
+            json={"type": "PREPARING"},
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+    assert (
+        test_client.put(
+            f"/orders/{order_ids[1]}/status",
+            json={"type": "CANCELLED", "reason": None},
+            headers={"Authorization": f"Bearer {customer_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    for jwt_token in (customer_jwt, merchant_jwt):
+        assert (
+            test_client.get(
+                "/orders/",
+                params={"limit": 2},
+                headers={"Authorization": f"Bearer {jwt_token}"},
+            ).status_code
+            == 200
+        )
+        assert (
+            test_client.get(
+                "/orders/",
+                params={
+                    "after_id": order_ids[0],
+                    "restaurant_id": restaurant_ids[0],
+                    "status": "ORDERED|PREPARING",
+                },
+                headers={"Authorization": f"Bearer {jwt_token}"},
+            ).status_code
+            == 200
+        )
+
+    for order_id in order_ids[:2]:
+        for path in (
+            f"/orders/{order_id}",
+            f"/orders/{order_id}/status",
+            f"/orders/{order_id}/queues",
+        ):
+            assert (
+                test_client.get(
+                    path,
+                    headers={"Authorization": f"Bearer {merchant_jwt}"},
+                ).status_code
+                == 200
+            )
+
+    assert (
+        test_client.get(
+            "/orders/queues", params={"restaurant_id": restaurant_ids[0]}
+        ).status_code
+        == 200
+    )
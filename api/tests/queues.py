@@ -0,0 +1,754 @@
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from api.bus import PostgresEventBus
+from api.configuration import Configuration
+from api.crud.canteen import get_canteen_queues
+from api.crud.order import (
+    check_queue_consistency,
+    compute_canteen_queues,
+    compute_order_queue,
+    compute_order_queue_with_window,
+    compute_restaurant_order_queues,
+    update_order_status,
+)
+from api.dependencies.configuration import get_configuration
+from api.dependencies.id import Role
+from api.event import Event, User, restaurant_queue_topic
+from api.models.order import Order
+from api.queues import (
+    QueueChangeNotifier,
+    QueueEngine,
+    QueuedOrder,
+    RestaurantQueue,
+)
+from api.schemas.event import (
+    Notification,
+    OrderQueueChangeNotification,
+    OrderStatusChangeNotification,
+    RestaurantQueueNotification,
+)
+from api.schemas.order import CancelledOrderUpdate, Queue
+from api.state import State
+from api.tests.helpers import (
+    change_order_status,
+    open_restaurant_with_menus,
+    order_item,
+    place_order,
+)
+from api import app
+
+import asyncio
+import random
+import time
+
+
+def test_queue_engine(configuration_fixture: Configuration):
+    # the restaurant queue agrees with a brute force computation through
+    # appends, out of order inserts and removals
+    randomness = random.Random(0)
+    restaurant_queue = RestaurantQueue()
+    orders: dict[int, tuple[int, int]] = {}
+
+    for order_id in range(1, 400):
+        ordered_at = order_id // 3
+
+        # an order written late by the group commit pipeline
+        if randomness.random() < 0.05:
+            ordered_at -= randomness.randint(1, 10)
+
+        prep_time = randomness.randint(1, 20)
+
+        queued_order = QueuedOrder(
+            order_id=order_id,
+            customer_id=order_id % 7,
+            ordered_at=ordered_at,
+            prep_time=prep_time,
+        )
+
+        restaurant_queue.add(queued_order)
+        restaurant_queue.add(queued_order)
+        orders[order_id] = (ordered_at, prep_time)
+
+        if randomness.random() < 0.6:
+            removed_order_id = randomness.choice(list(orders))
+            restaurant_queue.remove(removed_order_id)
+            restaurant_queue.remove(removed_order_id)
+            del orders[removed_order_id]
+
+        assert restaurant_queue.queue() == Queue(
+            queue_count=len(orders),
+            estimated_time=sum(prep for _, prep in orders.values()),
+        )
+
+        probe_id = randomness.randint(1, order_id)
+        probe_ordered_at = probe_id // 3
+        prior = [
+            prep
+            for other_id, (other_ordered_at, prep) in orders.items()
+            if (other_ordered_at, other_id) < (probe_ordered_at, probe_id)
+        ]
+
+        assert restaurant_queue.queue_before(
+            probe_ordered_at, probe_id
+        ) == Queue(queue_count=len(prior), estimated_time=sum(prior))
+
+    # the fan-out gives every active order the queue in front of it
+    assert [
+        (queued_order.order_id, queue)
+        for queued_order, queue in restaurant_queue.queues_of_orders()
+    ] == [
+        (order_id, restaurant_queue.queue_before(ordered_at, order_id))
+        for order_id, (ordered_at, _) in sorted(
+            orders.items(), key=lambda order: (order[1][0], order[0])
+        )
+    ]
+
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "John",
+            "last_name": "Doe",
+            "username": "johndoe",
+            "email": "johndoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": "janedoe",
+            "email": "janedoe@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    canteen_id: int = test_client.post(
+        "/canteens/add_canteen",
+        json={
+            "name": "Test Canteen",
+            "address": "123 Test St",
+            "latitude": 123,
+            "longitude": 123,
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    restaurant_id: int = test_client.post(
+        "/restaurants/",
+        json={
+            "name": "Steak House",
+            "address": "address",
+            "canteen_id": canteen_id,
+            "location": {"lat": 0, "lng": 0},
+        },
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()
+
+    menu_ids: list[int] = [
+        test_client.post(
+            f"/restaurants/{restaurant_id}/menus",
+            json={
+                "name": f"menu {i}",
+                "description": "a menu",
+                "price": 10,
+                "estimated_prep_time": prep_time,
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()
+        for i, prep_time in enumerate((5, 8, None))
+    ]
+
+    assert (
+        test_client.put(
+            f"/restaurants/{restaurant_id}/open",
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    def check_consistency(queue_engine: QueueEngine) -> list[str]:
+        with configuration_fixture.create_session() as session:
+            return asyncio.run(
+                check_queue_consistency(
+                    State(
+                        session=session,
+                        catalog=configuration_fixture.catalog_cache,
+                        queues=queue_engine,
+                    ),
+                    restaurant_id,
+                )
+            )
+
+    order_ids = [
+        place_order(
+            test_client,
+            customer_jwt,
+            restaurant_id,
+            [order_item(menu_ids[i % 3], i % 2 + 1)],
+        )
+        for i in range(8)
+    ]
+
+    assert check_consistency(configuration_fixture.queue_engine) == []
+
+    change_order_status(
+        test_client, order_ids[0], merchant_jwt, {"type": "PREPARING"}
+    )
+    change_order_status(
+        test_client, order_ids[0], merchant_jwt, {"type": "READY"}
+    )
+    change_order_status(
+        test_client, order_ids[1], merchant_jwt, {"type": "PREPARING"}
+    )
+    change_order_status(
+        test_client,
+        order_ids[2],
+        customer_jwt,
+        {"type": "CANCELLED", "reason": None},
+    )
+    change_order_status(
+        test_client,
+        order_ids[3],
+        merchant_jwt,
+        {"type": "CANCELLED", "reason": None},
+    )
+
+    order_ids.append(
+        place_order(
+            test_client,
+            customer_jwt,
+            restaurant_id,
+            [order_item(menu_ids[1], 3)],
+        )
+    )
+
+    assert check_consistency(configuration_fixture.queue_engine) == []
+
+    # changing the preparation time of a menu changes the queues
+    queue_before = test_client.get(
+        "/orders/queues", params={"restaurant_id": restaurant_id}
+    ).json()
+
+    assert (
+        test_client.put(
+            f"/restaurants/menus/{menu_ids[1]}",
+            json={
+                "name": "menu 1",
+                "description": "a menu",
+                "price": 10,
+                "estimated_prep_time": 20,
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).status_code
+        == 200
+    )
+
+    queue_after = test_client.get(
+        "/orders/queues", params={"restaurant_id": restaurant_id}
+    ).json()
+
+    assert queue_after["queue_count"] == queue_before["queue_count"]
+    assert queue_after["estimated_time"] > queue_before["estimated_time"]
+    assert check_consistency(configuration_fixture.queue_engine) == []
+
+    # once loaded, the queues are answered without the database
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[str] = []
+
+    def record_statement(*args: Any):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        restaurant_queue = test_client.get(
+            "/orders/queues", params={"restaurant_id": restaurant_id}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    assert restaurant_queue.status_code == 200
+    assert restaurant_queue.json() == queue_after
+    assert statements == []
+
+    last_order_queue = test_client.get(
+        f"/orders/{order_ids[-1]}/queues",
+        headers={"Authorization": f"Bearer {customer_jwt}"},
+    ).json()
+
+    assert last_order_queue["queue_count"] == queue_after["queue_count"] - 1
+
+    # the queue notifications of a status change cost the same number of
+    # statements however many orders are waiting
+    def count_status_change_statements(order_id: int) -> int:
+        statements.clear()
+
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            change_order_status(
+                test_client, order_id, merchant_jwt, {"type": "PREPARING"}
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+        return len(statements)
+
+    few_waiting_statements = count_status_change_statements(order_ids[4])
+
+    order_ids.extend(
+        place_order(
+            test_client,
+            customer_jwt,
+            restaurant_id,
+            [order_item(menu_ids[0], 1)],
+        )
+        for _ in range(20)
+    )
+
+    assert count_status_change_statements(order_ids[5]) == (
+        few_waiting_statements
+    )
+    assert check_consistency(configuration_fixture.queue_engine) == []
+
+    # the window function queries agree with the orders, also for the orders
+    # that are no longer active
+    with configuration_fixture.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration_fixture.catalog_cache,
+            queues=configuration_fixture.queue_engine,
+        )
+
+        restaurant_queues = asyncio.run(
+            compute_restaurant_order_queues(state, restaurant_id)
+        )
+
+        assert len(restaurant_queues) == queue_after["queue_count"] + 20
+
+        # and so do the queues of the restaurants of the canteen
+        assert asyncio.run(
+            compute_canteen_queues(state, canteen_id)
+        ) == asyncio.run(get_canteen_queues(state, canteen_id))
+
+        for order in session.query(Order).filter(Order.id.in_(order_ids)):
+            assert asyncio.run(
+                compute_order_queue_with_window(state, order)
+            ) == asyncio.run(compute_order_queue(state, order))
+
+    # a new process rebuilds the same queues from the database
+    assert check_consistency(QueueEngine()) == []
+
+    # the queue changes of a restaurant are coalesced, the status changes
+    # are not
+    merchant_id: int = test_client.get(
+        "/merchants/me",
+        headers={"Authorization": f"Bearer {merchant_jwt}"},
+    ).json()["id"]
+
+    asyncio.run(
+        coalesce_queue_changes(
+            configuration_fixture,
+            restaurant_id,
+            merchant_id,
+            order_ids[-18::6],
+        )
+    )
+
+    assert check_consistency(configuration_fixture.queue_engine) == []
+
+
+async def coalesce_queue_changes(
+    configuration: Configuration,
+    restaurant_id: int,
+    merchant_id: int,
+    cancelled_order_ids: list[int],
+):
+    notifications: list[Notification] = []
+    published: list[tuple[str, Notification]] = []
+
+    class RecordingEvent(Event):
+        async def add_notification(
+            self, user: User, notification: Notification
+        ) -> None:
+            notifications.append(notification)
+
+        async def publish(
+            self, topic: str, notification: Notification
+        ) -> None:
+            published.append((topic, notification))
+
+    def queue_notifications() -> dict[int, int]:
+        notified: dict[int, int] = {}
+
+        for notification in notifications:
+            if isinstance(notification, OrderQueueChangeNotification):
+                notified[notification.order_id] = (
+                    notified.get(notification.order_id, 0) + 1
+                )
+
+        return notified
+
+    notifier = QueueChangeNotifier(
+        configuration.create_session,
+        configuration.catalog_cache,
+        configuration.queue_engine,
+        window=0.05,
+    )
+    event = RecordingEvent()
+
+    with configuration.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+        )
+
+        # the first round sends the queue of every waiting order
+        queued_order_ids = [
+            queued_order.order_id
+            for queued_order, _ in configuration.queue_engine.queues_of_orders(
+                session, configuration.catalog_cache, restaurant_id
+            )
+        ]
+
+        async def ignore(queued_order: QueuedOrder, queue: Queue) -> None:
+            pass
+
+        async def ignore_all(
+            restaurant_id: int, queues: list[tuple[QueuedOrder, Queue]]
+        ) -> None:
+            pass
+
+        await notifier.notify(restaurant_id, ignore, ignore_all)
+
+        for order_id in cancelled_order_ids:
+            await update_order_status(
+                state,
+                event,
+                merchant_id,
+                Role.MERCHANT,
+                order_id,
+                CancelledOrderUpdate(reason=None),
+                notifier,
+            )
+
+        # the status changes are sent right away, the queues later on
+        assert [
+            notification.order_id
+            for notification in notifications
+            if isinstance(notification, OrderStatusChangeNotification)
+        ] == [order_id for order_id in cancelled_order_ids for _ in range(2)]
+        assert queue_notifications() == {}
+
+        await asyncio.sleep(0.2)
+
+        # only the orders behind the cancelled ones are notified, once
+        first_cancelled = queued_order_ids.index(cancelled_order_ids[0])
+
+        assert queue_notifications() == {
+            order_id: 1
+            for order_id in queued_order_ids[first_cancelled:]
+            if order_id not in cancelled_order_ids
+        }
+
+        # and the whole queue is published once to the restaurant's topic
+        [(topic, snapshot)] = published
+
+        assert topic == restaurant_queue_topic(restaurant_id)
+        assert isinstance(snapshot, RestaurantQueueNotification)
+        assert [entry.order_id for entry in snapshot.orders] == [
+            order_id
+            for order_id in queued_order_ids
+            if order_id not in cancelled_order_ids
+        ]
+
+        # nothing is sent if the queues haven't changed
+        notifications.clear()
+        notifier.mark_changed(restaurant_id, event.add_notification)
+        await asyncio.sleep(0.2)
+
+        assert notifications == []
+
+
+def test_canteen_queue_board(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt: str = test_client.post(
+        "/customers/register",
+        json={
+            "first_name": "Board",
+            "last_name": "Customer",
+            "username": "boardcustomer",
+            "email": "boardcustomer@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    merchant_jwt: str = test_client.post(
+        "/merchants/register",
+        json={
+            "first_name": "Board",
+            "last_name": "Merchant",
+            "username": "boardmerchant",
+            "email": "boardmerchant@test.com",
+            "password": "password",
+        },
+    ).json()["jwt_token"]
+
+    def add_canteen(name: str) -> int:
+        return test_client.post(
+            "/canteens/add_canteen",
+            json={
+                "name": name,
+                "address": "123 Test St",
+                "latitude": 123,
+                "longitude": 123,
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()["id"]
+
+    canteen_id = add_canteen("Board Canteen")
+    empty_canteen_id = add_canteen("Empty Canteen")
+
+    restaurant_ids: list[int] = []
+    menu_ids: list[int] = []
+
+    for i in range(3):
+        restaurant_id: int = test_client.post(
+            "/restaurants/",
+            json={
+                "name": f"Board Restaurant {i}",
+                "address": "address",
+                "canteen_id": canteen_id,
+                "location": {"lat": 0, "lng": 0},
+            },
+            headers={"Authorization": f"Bearer {merchant_jwt}"},
+        ).json()
+
+        menu_ids.append(
+            test_client.post(
+                f"/restaurants/{restaurant_id}/menus",
+                json={
+                    "name": "menu",
+                    "description": "a menu",
+                    "price": 10,
+                    "estimated_prep_time": 3 + i,
+                },
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).json()
+        )
+
+        assert (
+            test_client.put(
+                f"/restaurants/{restaurant_id}/open",
+                headers={"Authorization": f"Bearer {merchant_jwt}"},
+            ).status_code
+            == 200
+        )
+
+        restaurant_ids.append(restaurant_id)
+
+    # the last restaurant has no orders
+    for restaurant_index in (0, 0, 1, 0, 1):
+        place_order(
+            test_client,
+            customer_jwt,
+            restaurant_ids[restaurant_index],
+            [order_item(menu_ids[restaurant_index], 2)],
+        )
+
+    # a cold board loads all the restaurants with a single query
+    for restaurant_id in restaurant_ids:
+        configuration_fixture.queue_engine.invalidate(restaurant_id)
+
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[str] = []
+
+    def record_statement(*args: Any):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        board = test_client.get(f"/canteens/{canteen_id}/queues")
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    assert board.status_code == 200
+    assert (
+        len(
+            [
+                statement
+                for statement in statements
+                if "FROM orders" in statement
+            ]
+        )
+        == 1
+    )
+    assert board.json() == [
+        {
+            "restaurant_id": restaurant_id,
+            "queue": test_client.get(
+                "/orders/queues", params={"restaurant_id": restaurant_id}
+            ).json(),
+        }
+        for restaurant_id in restaurant_ids
+    ]
+    assert [queue["queue"] for queue in board.json()] == [
+        {"queue_count": 3, "estimated_time": 18},
+        {"queue_count": 2, "estimated_time": 16},
+        {"queue_count": 0, "estimated_time": 0},
+    ]
+
+    # the same board is computed from the orders in the database
+    with configuration_fixture.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration_fixture.catalog_cache,
+            queues=configuration_fixture.queue_engine,
+        )
+
+        assert [
+            canteen_queue.model_dump()
+            for canteen_queue in asyncio.run(
+                compute_canteen_queues(state, canteen_id)
+            )
+        ] == board.json()
+
+    # an unchanged board costs a 304
+    etag = board.headers["ETag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        not_modified = test_client.get(
+            f"/canteens/{canteen_id}/queues",
+            headers={"If-None-Match": if_none_match},
+        )
+
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["ETag"] == etag
+
+    # a new order changes the board
+    place_order(
+        test_client,
+        customer_jwt,
+        restaurant_ids[2],
+        [order_item(menu_ids[2], 2)],
+    )
+
+    changed_board = test_client.get(
+        f"/canteens/{canteen_id}/queues", headers={"If-None-Match": etag}
+    )
+
+    assert changed_board.status_code == 200
+    assert changed_board.headers["ETag"] != etag
+    assert changed_board.json()[2]["queue"] == {
+        "queue_count": 1,
+        "estimated_time": 10,
+    }
+
+    assert test_client.get(f"/canteens/{empty_canteen_id}/queues").json() == []
+    assert test_client.get("/canteens/999999/queues").status_code == 404
+
+
+def test_queue_engines_across_workers(configuration_fixture: Configuration):
+    engine = configuration_fixture.create_session().get_bind().engine
+    buses = [PostgresEventBus(engine, "test_queues") for _ in range(2)]
+
+    # the queue engines of two workers, a restaurant without any order
+    first, second = [QueueEngine(bus) for bus in buses]
+    catalog = configuration_fixture.catalog_cache
+    restaurant_id = 1_000_000
+
+    def queue_count(queues: QueueEngine) -> int:
+        with configuration_fixture.create_session() as session:
+            return queues.restaurant_queue(
+                session, catalog, restaurant_id
+            ).queue_count
+
+    def wait_for_count(queues: QueueEngine, count: int):
+        deadline = time.monotonic() + 10
+
+        while queue_count(queues) != count:
+            assert time.monotonic() < deadline
+
+            time.sleep(0.05)
+
+    try:
+        assert queue_count(first) == queue_count(second) == 0
+
+        # an order only added in the memory of the second worker; its own
+        # change isn't dropped
+        second.add(
+            restaurant_id,
+            QueuedOrder(order_id=1, customer_id=1, ordered_at=0, prep_time=1),
+        )
+        time.sleep(0.5)
+
+        assert queue_count(second) == 1
+
+        # a change of the first worker makes the second load the queue again
+        first.remove(restaurant_id, 1)
+        wait_for_count(second, 0)
+    finally:
+        for bus in buses:
+            bus.close()
+
+
+def test_queue_engine_warm_up(configuration_fixture: Configuration):
+    app.dependency_overrides[get_configuration] = lambda: configuration_fixture
+    test_client = TestClient(app)
+
+    customer_jwt, merchant_jwt, restaurant_id, items = (
+        open_restaurant_with_menus(test_client, "warming")
+    )
+    order_ids = [
+        place_order(test_client, customer_jwt, restaurant_id, items[:1])
+        for _ in range(3)
+    ]
+
+    change_order_status(
+        test_client, order_ids[0], merchant_jwt, {"type": "PREPARING"}
+    )
+    change_order_status(
+        test_client,
+        order_ids[1],
+        merchant_jwt,
+        {"type": "CANCELLED", "reason": None},
+    )
+
+    # a fresh worker rebuilds the queues of the restaurants on startup
+    fresh_configuration = Configuration(
+        configuration_fixture.create_session,
+        configuration_fixture.jwt_secret,
+        configuration_fixture.application_data_path,
+        queue_notification_window=0,
+    )
+    app.dependency_overrides[get_configuration] = lambda: fresh_configuration
+
+    with TestClient(app):
+        pass
+
+    engine = configuration_fixture.create_session().get_bind()
+    statements: list[str] = []
+
+    def record_statement(*args: Any):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        with configuration_fixture.create_session() as session:
+            queue = fresh_configuration.queue_engine.restaurant_queue(
+                session, fresh_configuration.catalog_cache, restaurant_id
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    assert statements == []
+    assert queue.queue_count == 2
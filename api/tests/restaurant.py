@@ -1,7 +1,9 @@
 import os
+from datetime import timedelta
 from typing import Any
 from fastapi.testclient import TestClient
 
+from api.admin_token import issue_admin_token
 from api.configuration import Configuration
 from api.dependencies.configuration import get_configuration
 from api import app
@@ -392,3 +394,46 @@ def test_restaurant(configuration_fixture: Configuration):
 
     assert response.status_code == 200
     assert not response.json()["open"]
+
+    # updating the menu must invalidate the cached catalog
+    response = test_client.put(
+        f"/restaurants/menus/{menu_id}",
+        json={
+            "name": "Steak",
+            "description": "An even juicier steak",
+            "price": 350.0,
+            "estimated_prep_time": 25,
+        },
+        headers={"Authorization": f"Bearer {merchant_token}"},
+    )
+
+    assert response.status_code == 200
+
+    response = test_client.get(
+        f"restaurants/{restaurant_id}/menus",
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0]["description"] == "An even juicier steak"
+    assert response.json()[0]["price"] == "350.00"
+    assert response.json()[0]["estimated_prep_time"] == 25
+
+    response = test_client.get(
+        f"restaurants/{restaurant_id}/menus",
+    )
+
+    assert response.status_code == 200
+
+    assert test_client.get("/admin/catalog_cache").status_code == 403
+
+    admin_jwt = issue_admin_token(
+        configuration_fixture.jwt_secret, timedelta(minutes=5)
+    )
+    response = test_client.get(
+        "/admin/catalog_cache",
+        headers={"Authorization": f"Bearer {admin_jwt}"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["hits"] >= 1
+    assert response.json()["misses"] >= 1
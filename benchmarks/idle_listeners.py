@@ -0,0 +1,163 @@
+"""
+Measures the CPU time spent by a worker with many connected but idle SSE
+listeners, and the time it takes to wake all of them up with a notification.
+
+`busy polling` reproduces the previous `Listener`, which checked the
+connection and yielded back to the event loop in a loop; `wake-up` is the
+current one, which sleeps until a notification arrives. Run it from the
+repository root:
+
+    python -m benchmarks.idle_listeners --listeners 2000
+"""
+
+from typing import Awaitable, Callable, Generator
+
+from starlette.requests import Request
+from starlette.types import Message
+
+from api.dependencies.id import Role
+from api.event import Event, User
+from api.schemas.event import Notification, OrderQueueChangeNotification
+from api.schemas.order import Queue
+
+import argparse
+import asyncio
+import time
+
+
+async def never_disconnect() -> Message:
+    # the request cancels the receive if nothing is available
+    await asyncio.sleep(3600)
+
+    return {"type": "http.disconnect"}
+
+
+class BusyPollingListener:
+    """The listener that checked its connection on every turn of the loop."""
+
+    __request: Request
+    __notifications: list[Notification]
+
+    def __init__(self, request: Request) -> None:
+        self.__request = request
+        self.__notifications = []
+
+    def add_notification(self, notification: Notification) -> None:
+        self.__notifications.append(notification)
+
+    def __await__(self) -> Generator[None, None, Notification | None]:
+        while True:
+            is_disconnected = (
+                yield from self.__request.is_disconnected().__await__()
+            )
+
+            if is_disconnected:
+                return None
+
+            if self.__notifications:
+                return self.__notifications.pop(0)
+
+            yield
+
+
+async def measure(
+    name: str,
+    listeners: int,
+    idle: float,
+    wait: Callable[[int], Awaitable[Notification | None]],
+    notify: Callable[[Notification], Awaitable[None]],
+) -> None:
+    received = 0
+    all_received = asyncio.Event()
+
+    async def listen(listener_id: int) -> None:
+        nonlocal received
+
+        await wait(listener_id)
+        received += 1
+
+        if received == listeners:
+            all_received.set()
+
+    tasks = [
+        asyncio.create_task(listen(listener_id))
+        for listener_id in range(listeners)
+    ]
+
+    # let every listener start waiting
+    await asyncio.sleep(0.1)
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle)
+    cpu_per_second = (time.process_time() - cpu_start) / idle
+
+    start = time.perf_counter()
+    await notify(
+        OrderQueueChangeNotification(
+            order_id=1, queue=Queue(queue_count=1, estimated_time=1)
+        )
+    )
+    await all_received.wait()
+    wake_up = time.perf_counter() - start
+
+    await asyncio.gather(*tasks)
+
+    print(
+        f"{name:>15}: {cpu_per_second * 100:6.1f}% of a core while idle, "
+        f"{wake_up * 1000:8.2f} ms to wake up every listener"
+    )
+
+
+async def run(listeners: int, idle: float) -> None:
+    request = Request({"type": "http"}, never_disconnect)
+
+    busy_listeners = [BusyPollingListener(request) for _ in range(listeners)]
+
+    async def notify_busy_listeners(notification: Notification) -> None:
+        for listener in busy_listeners:
+            listener.add_notification(notification)
+
+    await measure(
+        "busy polling",
+        listeners,
+        idle,
+        lambda listener_id: busy_listeners[listener_id],
+        notify_busy_listeners,
+    )
+
+    # every listener is a different user, as on a canteen during a rush
+    event = Event()
+    users = [
+        User(user_id=listener_id, role=Role.CUSTOMER)
+        for listener_id in range(listeners)
+    ]
+    event_listeners = [event.listens(user, request) for user in users]
+
+    async def notify_event_listeners(notification: Notification) -> None:
+        for user in users:
+            await event.add_notification(user, notification)
+
+    await measure(
+        "wake-up",
+        listeners,
+        idle,
+        lambda listener_id: event_listeners[listener_id].next(),
+        notify_event_listeners,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the CPU use of idle SSE listeners."
+    )
+    parser.add_argument("--listeners", type=int, default=2000)
+    parser.add_argument("--idle", type=float, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.listeners} idle listeners for {args.idle} seconds")
+
+    asyncio.run(run(args.listeners, args.idle))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measures the cost of fanning a notification out to many listeners of the
+same user, from `Event.add_notification` to the bytes written to each SSE
+stream.
+
+`per listener` serializes the notification and encodes the SSE event for
+every listener, as `event_generator` used to; `shared frame` writes the
+frame that `Event` encodes once per delivery. Run it from the repository
+root:
+
+    python -m benchmarks.notification_fanout --listeners 1000
+"""
+
+from typing import Callable
+
+from sse_starlette import ServerSentEvent
+from starlette.requests import Request
+from starlette.types import Message
+
+from api.dependencies.id import Role
+from api.event import Delivery, Event, User
+from api.schemas.event import OrderStatusChangeNotification
+from api.schemas.order import CancelledOrder, OrderCancelledBy
+
+import argparse
+import asyncio
+import time
+
+
+async def never_disconnect() -> Message:
+    await asyncio.sleep(3600)
+
+    return {"type": "http.disconnect"}
+
+
+def per_listener(delivery: Delivery) -> bytes:
+    return ServerSentEvent(
+        id=delivery.id, data=delivery.notification.model_dump_json()
+    ).encode()
+
+
+def shared_frame(delivery: Delivery) -> bytes:
+    return delivery.frame
+
+
+async def measure(
+    name: str,
+    listeners: int,
+    repeat: int,
+    write: Callable[[Delivery], bytes],
+) -> None:
+    user = User(user_id=1, role=Role.CUSTOMER)
+    event = Event(buffer_size=repeat)
+    request = Request({"type": "http"}, never_disconnect)
+    user_listeners = [event.listens(user, request) for _ in range(listeners)]
+
+    notification = OrderStatusChangeNotification(
+        order_id=1,
+        status=CancelledOrder(
+            cancelled_time=int(time.time()),
+            cancelled_by=OrderCancelledBy.MERCHANT,
+            reason="out of ingredients",
+        ),
+    )
+
+    written = 0
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        await event.add_notification(user, notification)
+
+        for listener in user_listeners:
+            delivery = await listener
+
+            assert delivery is not None
+            written += len(write(delivery))
+
+    elapsed = (time.perf_counter() - start) / repeat
+    per_thousand = elapsed / listeners * 1000
+
+    print(
+        f"{name:>15}: {per_thousand * 1000:8.3f} ms per 1k listeners "
+        f"({written // (repeat * listeners)} bytes each)"
+    )
+
+
+async def run(listeners: int, repeat: int) -> None:
+    await measure("per listener", listeners, repeat, per_listener)
+    await measure("shared frame", listeners, repeat, shared_frame)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the fan-out of a notification."
+    )
+    parser.add_argument("--listeners", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"a notification to {args.listeners} listeners of one user")
+
+    asyncio.run(run(args.listeners, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
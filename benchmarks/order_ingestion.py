@@ -0,0 +1,177 @@
+"""
+Compares the throughput of `POST /orders/` writes committed by each request
+(`direct`) against the group commit pipeline (`batched`).
+
+The benchmark runs against the database in `DATABASE_URL`, creates its own
+customer, merchant, canteen, restaurant and menu, and leaves the created rows
+behind. Run it from the repository root:
+
+    python -m benchmarks.order_ingestion --orders 2000 --concurrency 8
+"""
+
+from decimal import Decimal
+
+from api.configuration import Configuration
+from api.crud.order import create_order
+from api.ingestion import OrderIngestion
+from api.models.canteen import Canteen
+from api.models.customer import Customer
+from api.models.merchant import Merchant
+from api.models.restaurant import Menu, Restaurant
+from api.schemas.order import OrderCreate, OrderItemCreate
+from api.schemas.point import Point
+from api.state import State
+
+import argparse
+import asyncio
+import secrets
+import time
+
+
+def create_fixtures(configuration: Configuration) -> tuple[int, OrderCreate]:
+    suffix = secrets.token_hex(4)
+
+    with configuration.create_session() as session:
+        customer = Customer(
+            first_name="Bench",
+            last_name="Customer",
+            username=f"bench-customer-{suffix}",
+            email=f"bench-customer-{suffix}@example.com",
+            hashed_password="",
+            salt="",
+        )
+        merchant = Merchant(
+            first_name="Bench",
+            last_name="Merchant",
+            username=f"bench-merchant-{suffix}",
+            email=f"bench-merchant-{suffix}@example.com",
+            hashed_password="",
+            salt="",
+        )
+        canteen = Canteen(
+            name=f"bench-canteen-{suffix}", img="", latitude=0, longitude=0
+        )
+        session.add_all([customer, merchant, canteen])
+        session.flush()
+
+        restaurant = Restaurant(
+            name=f"bench-restaurant-{suffix}",
+            address="",
+            merchant_id=merchant.id,
+            location=Point(lat=0, lng=0),
+            canteen_id=canteen.id,
+            open=True,
+        )
+        session.add(restaurant)
+        session.flush()
+
+        menus = [
+            Menu(
+                restaurant_id=restaurant.id,
+                name=f"menu {i}",
+                description="",
+                price=Decimal(10 + i),
+                estimated_prep_time=5,
+            )
+            for i in range(3)
+        ]
+        session.add_all(menus)
+        session.commit()
+
+        payload = OrderCreate(
+            restaurant_id=restaurant.id,
+            items=[
+                OrderItemCreate(
+                    menu_id=menu.id,
+                    quantity=1,
+                    extra_requests=None,
+                    options=[],
+                )
+                for menu in menus
+            ],
+        )
+
+        return customer.id, payload
+
+
+async def run(
+    configuration: Configuration,
+    ingestion: OrderIngestion | None,
+    customer_id: int,
+    payload: OrderCreate,
+    orders: int,
+    concurrency: int,
+) -> float:
+    remaining = orders
+
+    async def worker() -> None:
+        nonlocal remaining
+
+        state = State(
+            session=configuration.create_session(),
+            catalog=configuration.catalog_cache,
+            queues=configuration.queue_engine,
+        )
+
+        try:
+            while remaining > 0:
+                remaining -= 1
+                await create_order(state, customer_id, payload, ingestion)
+
+                # end the read transaction like the request would
+                state.session.rollback()
+
+        finally:
+            state.session.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the order ingestion pipeline."
+    )
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    configuration = Configuration(jwt_secret="benchmark")
+    customer_id, payload = create_fixtures(configuration)
+
+    modes: list[tuple[str, OrderIngestion | None]] = [
+        ("direct", None),
+        (
+            "batched",
+            OrderIngestion(
+                configuration.create_session,
+                batch_size=args.batch_size,
+                window=args.window_ms / 1000,
+            ),
+        ),
+    ]
+
+    for name, ingestion in modes:
+        elapsed = asyncio.run(
+            run(
+                configuration,
+                ingestion,
+                customer_id,
+                payload,
+                args.orders,
+                args.concurrency,
+            )
+        )
+
+        print(
+            f"{name:>8}: {args.orders} orders in {elapsed:.2f}s "
+            f"({args.orders / elapsed:.0f} orders/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Compares the ways of computing the order queues of a restaurant with many
+active orders: the Python loop over the loaded orders (`python`), the window
+function query (`window`) and the in-memory queue engine (`engine`).
+
+The benchmark runs against the database in `DATABASE_URL`, creates its own
+restaurant with the given number of active orders, and leaves the created
+rows behind. Run it from the repository root:
+
+    python -m benchmarks.order_queue --orders 10000
+"""
+
+from decimal import Decimal
+from typing import Awaitable, Callable, TypeVar
+
+from api.configuration import Configuration
+from api.crud.order import (
+    compute_order_queue,
+    compute_order_queue_with_window,
+    compute_restaurant_order_queues,
+    compute_restaurant_queue,
+)
+from api.ingestion import ValidatedOrder, insert_orders
+from api.models.order import Order
+from api.queues import QueueEngine
+from api.schemas.order import OrderCreate
+from api.state import State
+from benchmarks.order_ingestion import create_fixtures
+
+import argparse
+import asyncio
+import time
+
+T = TypeVar("T")
+
+
+def create_orders(
+    configuration: Configuration,
+    customer_id: int,
+    payload: OrderCreate,
+    orders: int,
+) -> None:
+    validated_order = ValidatedOrder(
+        customer_id=customer_id,
+        restaurant_id=payload.restaurant_id,
+        ordered_at=int(time.time()),
+        price_paid=Decimal(10),
+        items=payload.items,
+    )
+
+    with configuration.create_session() as session:
+        for start in range(0, orders, 1000):
+            insert_orders(
+                session, [validated_order] * min(1000, orders - start)
+            )
+
+        session.commit()
+
+
+async def measure(
+    name: str, repeat: int, operation: Callable[[], Awaitable[T]]
+) -> T:
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        result = await operation()
+
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>40}: {elapsed * 1000:10.2f} ms")
+
+    return result
+
+
+async def run(configuration: Configuration, restaurant_id: int, repeat: int):
+    with configuration.create_session() as session:
+        state = State(
+            session=session,
+            catalog=configuration.catalog_cache,
+            queues=QueueEngine(),
+        )
+
+        last_order = (
+            session.query(Order)
+            .filter(Order.restaurant_id == restaurant_id)
+            .order_by(Order.ordered_at.desc(), Order.id.desc())
+            .first()
+        )
+        assert last_order is not None
+
+        python_queue = await measure(
+            "python: restaurant queue",
+            repeat,
+            lambda: compute_restaurant_queue(state, restaurant_id),
+        )
+        window_queues = await measure(
+            "window: queues of every order",
+            repeat,
+            lambda: compute_restaurant_order_queues(state, restaurant_id),
+        )
+
+        python_order_queue = await measure(
+            "python: queue of the last order",
+            repeat,
+            lambda: compute_order_queue(state, last_order),
+        )
+        window_order_queue = await measure(
+            "window: queue of the last order",
+            repeat,
+            lambda: compute_order_queue_with_window(state, last_order),
+        )
+
+        assert python_order_queue == window_order_queue
+        assert python_queue.queue_count == len(window_queues)
+
+        # the queue engine loads the restaurant once and then answers from
+        # memory
+        start = time.perf_counter()
+        state.queues.restaurant_queue(session, state.catalog, restaurant_id)
+        print(
+            f"{'engine: load the restaurant':>40}: "
+            f"{(time.perf_counter() - start) * 1000:10.2f} ms"
+        )
+
+        async def engine_queues():
+            return state.queues.queues_of_orders(
+                session, state.catalog, restaurant_id
+            )
+
+        engine_queues_of_orders = await measure(
+            "engine: queues of every order", repeat, engine_queues
+        )
+
+        assert {
+            queued_order.order_id: queue
+            for queued_order, queue in engine_queues_of_orders
+        } == window_queues
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the order queue computations."
+    )
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    configuration = Configuration(jwt_secret="benchmark")
+    customer_id, payload = create_fixtures(configuration)
+    restaurant_id = payload.restaurant_id
+
+    create_orders(configuration, customer_id, payload, args.orders)
+
+    print(f"{args.orders} active orders in restaurant {restaurant_id}")
+
+    asyncio.run(run(configuration, restaurant_id, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""denormalize order status
+
+Revision ID: 4b8e2d6f0a17
+Revises: 9c2f4e7a1b3d
+Create Date: 2026-10-18 11:02:17.640915
+
+"""
+
+from typing import Sequence, Union
+
+from alembic.op import (
+    add_column,
+    create_table,
+    drop_column,
+    drop_table,
+    execute,
+)
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String
+from sqlalchemy.dialects import postgresql  # type: ignore
+
+# revision identifiers, used by Alembic.
+revision: str = "4b8e2d6f0a17"
+down_revision: Union[str, None] = "9c2f4e7a1b3d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the type was created along with the `cancelled_orders` table and outlives it
+order_cancelled_by = postgresql.ENUM(
+    "CUSTOMER", "MERCHANT", name="order_cancelled_by", create_type=False
+)
+
+
+def upgrade() -> None:
+    add_column("orders", Column("prepared_at", BigInteger, nullable=True))
+    add_column("orders", Column("ready_at", BigInteger, nullable=True))
+    add_column("orders", Column("settled_at", BigInteger, nullable=True))
+    add_column("orders", Column("cancelled_time", BigInteger, nullable=True))
+    add_column(
+        "orders",
+        Column(
+            "cancelled_by", order_cancelled_by, nullable=True
+        ),  # type: ignore
+    )
+    add_column("orders", Column("cancelled_reason", String, nullable=True))
+
+    execute("""
+        UPDATE orders SET prepared_at = preparing_orders.prepared_at
+        FROM preparing_orders WHERE preparing_orders.order_id = orders.id
+        """)
+    execute("""
+        UPDATE orders SET ready_at = ready_orders.ready_at
+        FROM ready_orders WHERE ready_orders.order_id = orders.id
+        """)
+    execute("""
+        UPDATE orders SET settled_at = settled_orders.settled_at
+        FROM settled_orders WHERE settled_orders.order_id = orders.id
+        """)
+    execute("""
+        UPDATE orders SET
+            cancelled_time = cancelled_orders.cancelled_time,
+            cancelled_by = cancelled_orders.cancelled_by,
+            cancelled_reason = cancelled_orders.reason
+        FROM cancelled_orders WHERE cancelled_orders.order_id = orders.id
+        """)
+
+    drop_table("cancelled_orders")
+    drop_table("ready_orders")
+    drop_table("settled_orders")
+    drop_table("preparing_orders")
+
+
+def downgrade() -> None:
+    create_table(
+        "preparing_orders",
+        Column(
+            "order_id",
+            Integer,
+            ForeignKey("orders.id"),
+            primary_key=True,
+        ),
+        Column("prepared_at", BigInteger, nullable=False),
+    )
+
+    create_table(
+        "settled_orders",
+        Column(
+            "order_id",
+            Integer,
+            ForeignKey("orders.id"),
+            primary_key=True,
+        ),
+        Column("settled_at", BigInteger, nullable=False),
+    )
+
+    create_table(
+        "ready_orders",
+        Column(
+            "order_id",
+            Integer,
+            ForeignKey("orders.id"),
+            primary_key=True,
+        ),
+        Column("ready_at", BigInteger, nullable=False),
+    )
+
+    create_table(
+        "cancelled_orders",
+        Column(
+            "order_id",
+            Integer,
+            ForeignKey("orders.id"),
+            primary_key=True,
+        ),
+        Column("cancelled_time", BigInteger, nullable=False),
+        Column(
+            "cancelled_by", order_cancelled_by, nullable=False
+        ),  # type: ignore
+        Column("reason", String, nullable=True),
+    )
+
+    execute("""
+        INSERT INTO preparing_orders (order_id, prepared_at)
+        SELECT id, prepared_at FROM orders WHERE prepared_at IS NOT NULL
+        """)
+    execute("""
+        INSERT INTO ready_orders (order_id, ready_at)
+        SELECT id, ready_at FROM orders WHERE ready_at IS NOT NULL
+        """)
+    execute("""
+        INSERT INTO settled_orders (order_id, settled_at)
+        SELECT id, settled_at FROM orders WHERE settled_at IS NOT NULL
+        """)
+    execute("""
+        INSERT INTO cancelled_orders
+            (order_id, cancelled_time, cancelled_by, reason)
+        SELECT id, cancelled_time, cancelled_by, cancelled_reason
+        FROM orders WHERE cancelled_time IS NOT NULL
+        """)
+
+    drop_column("orders", "cancelled_reason")
+    drop_column("orders", "cancelled_by")
+    drop_column("orders", "cancelled_time")
+    drop_column("orders", "settled_at")
+    drop_column("orders", "ready_at")
+    drop_column("orders", "prepared_at")
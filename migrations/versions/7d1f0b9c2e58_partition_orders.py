@@ -0,0 +1,164 @@
+"""partition orders
+
+Revision ID: 7d1f0b9c2e58
+Revises: e3a9c5d27f41
+Create Date: 2026-10-18 15:40:52.906114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic.op import execute
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7d1f0b9c2e58"
+down_revision: Union[str, None] = "e3a9c5d27f41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+columns = """
+    id, restaurant_id, customer_id, status, price_paid, ordered_at,
+    prepared_at, ready_at, settled_at, cancelled_time, cancelled_by,
+    cancelled_reason
+"""
+
+indexes = """
+    CREATE INDEX ix_orders_customer_id_ordered_at
+        ON orders (customer_id, ordered_at, id);
+    CREATE INDEX ix_orders_restaurant_id_ordered_at
+        ON orders (restaurant_id, ordered_at, id);
+    CREATE INDEX ix_orders_restaurant_id_status
+        ON orders (restaurant_id, status);
+    CREATE INDEX ix_orders_active_restaurant_id
+        ON orders (restaurant_id, ordered_at, id)
+        WHERE status IN ('ORDERED', 'PREPARING');
+"""
+
+drop_indexes = """
+    DROP INDEX ix_orders_customer_id_ordered_at;
+    DROP INDEX ix_orders_restaurant_id_ordered_at;
+    DROP INDEX ix_orders_restaurant_id_status;
+    DROP INDEX ix_orders_active_restaurant_id;
+"""
+
+
+def upgrade() -> None:
+    # a foreign key to a partitioned table must include the partition keys,
+    # the order IDs are checked by the application instead
+    execute(
+        """
+        ALTER TABLE order_items DROP CONSTRAINT order_items_order_id_fkey;
+        ALTER TABLE idempotency_keys
+            DROP CONSTRAINT idempotency_keys_order_id_fkey;
+        """
+    )
+
+    execute(drop_indexes)
+    execute(
+        """
+        ALTER TABLE orders RENAME TO orders_unpartitioned;
+        ALTER TABLE orders_unpartitioned
+            RENAME CONSTRAINT orders_pkey TO orders_unpartitioned_pkey;
+        """
+    )
+
+    execute(
+        """
+        CREATE TABLE orders (
+            id INTEGER NOT NULL DEFAULT nextval('orders_id_seq'),
+            restaurant_id INTEGER NOT NULL
+                CONSTRAINT orders_restaurant_id_fkey
+                REFERENCES restaurants (id),
+            customer_id INTEGER NOT NULL
+                CONSTRAINT orders_customer_id_fkey REFERENCES customers (id),
+            status order_status NOT NULL,
+            price_paid NUMERIC(10, 2) NOT NULL
+                CONSTRAINT orders_price_paid_check CHECK (price_paid >= 0),
+            ordered_at BIGINT NOT NULL,
+            prepared_at BIGINT,
+            ready_at BIGINT,
+            settled_at BIGINT,
+            cancelled_time BIGINT,
+            cancelled_by order_cancelled_by,
+            cancelled_reason VARCHAR,
+            archived BOOLEAN NOT NULL DEFAULT false,
+            CONSTRAINT orders_pkey PRIMARY KEY (id, archived, ordered_at)
+        ) PARTITION BY LIST (archived);
+
+        CREATE TABLE orders_hot PARTITION OF orders FOR VALUES IN (false);
+
+        -- the monthly partitions are created by the archival job as needed
+        CREATE TABLE orders_archive PARTITION OF orders FOR VALUES IN (true)
+            PARTITION BY RANGE (ordered_at);
+        """
+    )
+
+    execute(
+        f"""
+        INSERT INTO orders ({columns})
+        SELECT {columns} FROM orders_unpartitioned;
+
+        ALTER SEQUENCE orders_id_seq OWNED BY orders.id;
+        DROP TABLE orders_unpartitioned;
+        """
+    )
+
+    execute(indexes)
+
+
+def downgrade() -> None:
+    execute(drop_indexes)
+    execute(
+        """
+        ALTER TABLE orders RENAME TO orders_partitioned;
+        ALTER TABLE orders_partitioned
+            RENAME CONSTRAINT orders_pkey TO orders_partitioned_pkey;
+        """
+    )
+
+    execute(
+        """
+        CREATE TABLE orders (
+            id INTEGER NOT NULL DEFAULT nextval('orders_id_seq'),
+            restaurant_id INTEGER NOT NULL
+                CONSTRAINT orders_restaurant_id_fkey
+                REFERENCES restaurants (id),
+            customer_id INTEGER NOT NULL
+                CONSTRAINT orders_customer_id_fkey REFERENCES customers (id),
+            status order_status NOT NULL,
+            price_paid NUMERIC(10, 2) NOT NULL
+                CONSTRAINT orders_price_paid_check CHECK (price_paid >= 0),
+            ordered_at BIGINT NOT NULL,
+            prepared_at BIGINT,
+            ready_at BIGINT,
+            settled_at BIGINT,
+            cancelled_time BIGINT,
+            cancelled_by order_cancelled_by,
+            cancelled_reason VARCHAR,
+            CONSTRAINT orders_pkey PRIMARY KEY (id)
+        );
+        """
+    )
+
+    # dropping the partitioned table drops all of its partitions
+    execute(
+        f"""
+        INSERT INTO orders ({columns})
+        SELECT {columns} FROM orders_partitioned;
+
+        ALTER SEQUENCE orders_id_seq OWNED BY orders.id;
+        DROP TABLE orders_partitioned;
+        """
+    )
+
+    execute(indexes)
+    execute(
+        """
+        ALTER TABLE order_items ADD CONSTRAINT order_items_order_id_fkey
+            FOREIGN KEY (order_id) REFERENCES orders (id);
+        ALTER TABLE idempotency_keys
+            ADD CONSTRAINT idempotency_keys_order_id_fkey
+            FOREIGN KEY (order_id) REFERENCES orders (id);
+        """
+    )
@@ -0,0 +1,42 @@
+"""add idempotency keys
+
+Revision ID: 9c2f4e7a1b3d
+Revises: 173998d0ded4
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+
+from typing import Sequence, Union
+
+from alembic.op import create_primary_key, create_table, drop_table
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c2f4e7a1b3d"
+down_revision: Union[str, None] = "173998d0ded4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_table(
+        "idempotency_keys",
+        Column(
+            "customer_id", Integer, ForeignKey("customers.id"), nullable=False
+        ),
+        Column("key", String, nullable=False),
+        # NULL while the first request with the key is still in progress
+        Column("order_id", Integer, ForeignKey("orders.id"), nullable=True),
+        Column("expires_at", BigInteger, nullable=False),
+    )
+
+    create_primary_key(
+        "idempotency_keys_pk",
+        "idempotency_keys",
+        ["customer_id", "key"],
+    )
+
+
+def downgrade() -> None:
+    drop_table("idempotency_keys")
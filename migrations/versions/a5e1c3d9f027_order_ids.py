@@ -0,0 +1,94 @@
+"""order ids
+
+Revision ID: a5e1c3d9f027
+Revises: 7d1f0b9c2e58
+Create Date: 2026-10-18 18:12:31.540218
+
+"""
+
+from typing import Sequence, Union
+
+from alembic.op import execute
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a5e1c3d9f027"
+down_revision: Union[str, None] = "7d1f0b9c2e58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a unique constraint on the partitioned `orders` table must include the
+    # partition keys. Every order has a row here instead, unique by its ID,
+    # which it references along with its partition keys. Two orders with
+    # the same ID would reference the same row, thus have the same primary
+    # key.
+    execute(
+        """
+        CREATE TABLE order_ids (
+            id INTEGER NOT NULL,
+            archived BOOLEAN NOT NULL,
+            ordered_at BIGINT NOT NULL,
+            CONSTRAINT order_ids_pkey PRIMARY KEY (id),
+            CONSTRAINT order_ids_partition_key
+                UNIQUE (id, archived, ordered_at)
+        );
+
+        INSERT INTO order_ids (id, archived, ordered_at)
+        SELECT id, archived, ordered_at FROM orders;
+
+        -- archiving an order updates its row here, the update cascades and
+        -- moves the order to the archive partition
+        ALTER TABLE orders ADD CONSTRAINT orders_id_fkey
+            FOREIGN KEY (id, archived, ordered_at)
+            REFERENCES order_ids (id, archived, ordered_at)
+            ON UPDATE CASCADE;
+        """
+    )
+
+    # the row of a new order is added along with it. An order moved to
+    # another partition is inserted there again, its row is already there.
+    execute(
+        """
+        CREATE FUNCTION insert_order_id() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO order_ids (id, archived, ordered_at)
+            VALUES (NEW.id, NEW.archived, NEW.ordered_at)
+            ON CONFLICT DO NOTHING;
+
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER orders_insert_order_id
+            BEFORE INSERT ON orders
+            FOR EACH ROW EXECUTE FUNCTION insert_order_id();
+        """
+    )
+
+    execute(
+        """
+        ALTER TABLE order_items ADD CONSTRAINT order_items_order_id_fkey
+            FOREIGN KEY (order_id) REFERENCES order_ids (id);
+        ALTER TABLE idempotency_keys
+            ADD CONSTRAINT idempotency_keys_order_id_fkey
+            FOREIGN KEY (order_id) REFERENCES order_ids (id);
+        """
+    )
+
+
+def downgrade() -> None:
+    execute(
+        """
+        ALTER TABLE idempotency_keys
+            DROP CONSTRAINT idempotency_keys_order_id_fkey;
+        ALTER TABLE order_items DROP CONSTRAINT order_items_order_id_fkey;
+
+        DROP TRIGGER orders_insert_order_id ON orders;
+        DROP FUNCTION insert_order_id();
+
+        ALTER TABLE orders DROP CONSTRAINT orders_id_fkey;
+        DROP TABLE order_ids;
+        """
+    )
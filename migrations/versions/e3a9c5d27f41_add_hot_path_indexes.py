@@ -0,0 +1,74 @@
+"""add hot path indexes
+
+Revision ID: e3a9c5d27f41
+Revises: 4b8e2d6f0a17
+Create Date: 2026-10-18 13:27:05.118342
+
+"""
+
+from typing import Sequence, Union
+
+from alembic.op import create_index, drop_index
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e3a9c5d27f41"
+down_revision: Union[str, None] = "4b8e2d6f0a17"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the single column indexes on the foreign keys used for lookups, named the
+# way `mapped_column(index=True)` names them
+foreign_key_indexes: list[tuple[str, str]] = [
+    ("restaurants", "merchant_id"),
+    ("restaurants", "canteen_id"),
+    ("menus", "restaurant_id"),
+    ("customizations", "menu_id"),
+    ("options", "customization_id"),
+    ("order_items", "order_id"),
+    ("customer_reviews", "customer_id"),
+    ("customer_reviews", "restaurant_id"),
+    ("favorite_restaurants", "customer_id"),
+    ("refresh_tokens", "customer_id"),
+    ("refresh_tokens", "token"),
+]
+
+
+def upgrade() -> None:
+    for table, column in foreign_key_indexes:
+        create_index(f"ix_{table}_{column}", table, [column])
+
+    create_index(
+        "ix_orders_customer_id_ordered_at",
+        "orders",
+        ["customer_id", "ordered_at", "id"],
+    )
+    create_index(
+        "ix_orders_restaurant_id_ordered_at",
+        "orders",
+        ["restaurant_id", "ordered_at", "id"],
+    )
+    create_index(
+        "ix_orders_restaurant_id_status",
+        "orders",
+        ["restaurant_id", "status"],
+    )
+
+    # only a small fraction of the orders are still ongoing
+    create_index(
+        "ix_orders_active_restaurant_id",
+        "orders",
+        ["restaurant_id", "ordered_at", "id"],
+        postgresql_where=text("status IN ('ORDERED', 'PREPARING')"),
+    )
+
+
+def downgrade() -> None:
+    drop_index("ix_orders_active_restaurant_id", "orders")
+    drop_index("ix_orders_restaurant_id_status", "orders")
+    drop_index("ix_orders_restaurant_id_ordered_at", "orders")
+    drop_index("ix_orders_customer_id_ordered_at", "orders")
+
+    for table, column in reversed(foreign_key_indexes):
+        drop_index(f"ix_{table}_{column}", table)